@@ -1,21 +1,37 @@
 import os
+import sys
 import json
-import base64
-import requests
 import random
-import math
-import io
-from tqdm import tqdm
-from PIL import Image
-from PIL import Image, ImageFile
-
-Image.MAX_IMAGE_PIXELS = None
-ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "processing"))
+from async_client import response_content
+from batch_io import dispatch_requests
+from dead_letter import select_dead_letters
+from encode_image import IMAGE_CACHE
+from prefetch import prefetch_images, unreadable
+from image_transport import image_url
+import guided
+from logprob_scoring import scoring_fields, option_probabilities, best_option, records_calibration, format_calibration
+from response_cache import ResponseCache
+from manifest import load_manifest, task_rows, task_values
 
 BASE_DIR = "/hd/Images_dynasty"
+# one URL, or a list of URLs / (url, weight) pairs to spread the run over several replicas
 API_URL = "http://localhost:8000/v1/chat/completions"
 MODEL_NAME = "Qwen3-VL-4B-Instruct"
+CONCURRENCY = 32
+# "base64", "file" or "http", see processing/image_transport.py
+IMAGE_TRANSPORT = "base64"
+# None for online requests, "export" / "ingest" for offline `vllm run-batch`, see processing/batch_io.py
+BATCH_MODE = None
+# constrain decoding to one of the option lines with a tight max_tokens (processing/guided.py)
+GUIDED = False
+# "generate" parses the generated answer; "logprobs" scores the option letters from one forward pass with
+# max_tokens=1 and records a normalized probability per letter plus calibration (processing/logprob_scoring.py)
+SCORING = "generate"
+RESPONSE_CACHE = ResponseCache()
+# seeds the per-item option shuffle; change it to draw a different (still reproducible) set of orders
+PROMPT_SEED = 0
 
 DYNASTIES = [
     "唐(Tang Dynasty)",
@@ -25,35 +41,6 @@ DYNASTIES = [
     "清(Qing Dynasty)"
 ]
 
-def encode_image(image_path, max_pixels=2800000):
-    try:
-        with Image.open(image_path) as img:
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-            
-            orig_w, orig_h = img.size
-            current_pixels = orig_w * orig_h
-            
-            target_w, target_h = orig_w, orig_h
-
-            if current_pixels > max_pixels:
-                scale = math.sqrt(max_pixels / current_pixels)
-                target_w = int(orig_w * scale)
-                target_h = int(orig_h * scale)
-
-            target_w = max(28, (target_w // 28) * 28)
-            target_h = max(28, (target_h // 28) * 28)
-
-            if (target_w, target_h) != (orig_w, orig_h):
-                img = img.resize((target_w, target_h), Image.Resampling.LANCZOS)
-
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=90)
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
-    except Exception as e:
-        print(f"image failed {image_path}: {e}")
-        return None
-
 def get_processed_ids(output_path):
     processed_ids = set()
     if os.path.exists(output_path):
@@ -66,97 +53,122 @@ def get_processed_ids(output_path):
                     continue
     return processed_ids
 
-def generate_random_prompt():
+# static text first so vLLM's prefix cache can share it across requests; the shuffled options follow the image
+INSTRUCTION = (
+    "Which historical period does the style of the item in this image belong to, among the following options? \n"
+    "Please output the letter and the dynasty name only (e.g., 'A. 唐(Tang Dynasty)')."
+)
+
+def generate_random_prompt(rng):
     shuffled = DYNASTIES.copy()
-    random.shuffle(shuffled)
+    rng.shuffle(shuffled)
     
     letters = ['A', 'B', 'C', 'D', 'E']
     mapping = dict(zip(letters, shuffled))
     
     options_str = "\n".join([f"{l}. {d}" for l, d in mapping.items()])
     
-    prompt = f"""Which historical period does the style of the item in this image belong to, among the following options? 
-Options:
-{options_str}
-
-Please output the letter and the dynasty name only (e.g., 'A. 唐(Tang Dynasty)')."""
+    prompt = f"""Options:
+{options_str}"""
     
     return prompt, mapping
 
-def process_benchmark(file_path):
-    file_name = os.path.basename(file_path)
-    name_part = file_name.replace('_benchmark.jsonl', '')
+def item_rng(name_part, item_id):
+    # the option order only depends on the item, so reruns, caches and exported batches agree
+    return random.Random(f"{PROMPT_SEED}/{name_part}/{item_id}")
+
+def process_benchmark(name_part, rows):
+    file_name = f"{name_part}.jsonl"
     output_name = f"qwen3_4B_{name_part}_ans.jsonl"
     output_path = os.path.join(BASE_DIR, output_name)
     
     processed_ids = get_processed_ids(output_path)
 
-    with open(file_path, 'r', encoding='utf-8') as f:
-        total_lines = sum(1 for line in f if line.strip())
-
     print(f"\n[begin] {file_name} | jumped: {len(processed_ids)}")
 
-    with open(file_path, 'r', encoding='utf-8') as f_in, \
-         open(output_path, 'a', encoding='utf-8') as f_out:
-        
-        for line in tqdm(f_in, total=total_lines, desc=f"Processing {name_part}"):
-            line = line.strip()
-            if not line: continue
-                
-            try:
-                data = json.loads(line)
-            except: continue
-
-            if data.get('id') in processed_ids:
+    items = {}
+    for row in rows:
+        if row["id"] in processed_ids or row["size"] is None:
+            continue
+
+        current_prompt, current_mapping = generate_random_prompt(item_rng(name_part, row["id"]))
+        items[row["id"]] = {"data": row["record"], "path": row["path"],
+                            "prompt": current_prompt, "mapping": current_mapping}
+    batch_prefix = os.path.join(BASE_DIR, f"qwen3_4B_{name_part}")
+    items = {item_id: items[item_id] for item_id in select_dead_letters(list(items), batch_prefix)}
+
+    def jobs():
+        images = ((item_id, [item["path"]]) for item_id, item in items.items())
+        for item_id, b64_list in prefetch_images(images, transport=IMAGE_TRANSPORT):
+            if None in b64_list:
+                yield item_id, unreadable([items[item_id]["path"]], b64_list)
                 continue
-
-            original_path = data.get('image', '')
-            linux_path = original_path.replace('E:\\Images_dynasty', BASE_DIR).replace('\\', '/')
+            item = items[item_id]
+            base64_image = b64_list[0]
+            payload = {
+                "model": MODEL_NAME,
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": INSTRUCTION},
+                            {
+                                "type": "image_url",
+                                "image_url": {"url": image_url(base64_image, IMAGE_TRANSPORT)}
+                            },
+                            {"type": "text", "text": item["prompt"]}
+                        ]
+                    }
+                ],
+                "temperature": 0.1
+            }
+            if SCORING == "logprobs":
+                payload.update(scoring_fields())
+            elif GUIDED:
+                options = [f"{letter}. {dynasty}" for letter, dynasty in item["mapping"].items()]
+                guided.apply(payload, guided.choice(options, max_tokens=32))
+            yield item_id, payload
+
+    scored = []
+    with open(output_path, 'a', encoding='utf-8') as f_out:
+
+        def on_result(item_id, result):
+            # failed requests never get here, dispatch_requests dead-letters them
+            ans_content = response_content(result).strip()
+            mapping = items[item_id]["mapping"]
+
+            output_item = items[item_id]["data"].copy()
+            output_item['model_response'] = ans_content
+            output_item['option_mapping'] = mapping
+            output_item['telemetry'] = result.get("telemetry")
+            if SCORING == "logprobs":
+                probs = option_probabilities(result, list(mapping))
+                if probs is not None:
+                    letter = best_option(probs)
+                    output_item['model_response'] = f"{letter}. {mapping[letter]}"
+                    output_item['is_correct'] = f"({output_item.get('dynasty')} Dynasty)" in mapping[letter]
+                output_item['option_probs'] = probs
+                output_item['confidence'] = max(probs.values()) if probs else None
+                scored.append(output_item)
             
-            if not os.path.exists(linux_path):
-                continue
+            f_out.write(json.dumps(output_item, ensure_ascii=False) + '\n')
+            f_out.flush()
 
-            current_prompt, current_mapping = generate_random_prompt()
-
-            try:
-                base64_image = encode_image(linux_path)
-                payload = {
-                    "model": MODEL_NAME,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": current_prompt},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                                }
-                            ]
-                        }
-                    ],
-                    "temperature": 0.1
-                }
-
-                response = requests.post(API_URL, json=payload, timeout=60)
-                response.raise_for_status()
-                ans_content = response.json()['choices'][0]['message']['content'].strip()
-
-                output_item = data.copy()
-                output_item['model_response'] = ans_content
-                output_item['option_mapping'] = current_mapping
-                
-                f_out.write(json.dumps(output_item, ensure_ascii=False) + '\n')
-                f_out.flush()
-
-            except Exception as e:
-                print(f"\n[failed] ID {data.get('id')}: {e}")
+        dispatch_requests(jobs(), API_URL, on_result, list(items), batch_mode=BATCH_MODE,
+                          batch_prefix=batch_prefix,
+                          concurrency=CONCURRENCY, timeout=60, cache=RESPONSE_CACHE,
+                          desc=f"Processing {name_part}", total=len(items))
+    if SCORING == "logprobs":
+        print(f"{name_part} " + format_calibration(records_calibration(scored)))
 
 def main():
     if not os.path.exists(BASE_DIR):
         return
-    benchmark_files = [f for f in os.listdir(BASE_DIR) if f.endswith('_benchmark.jsonl')]
-    for bf in benchmark_files:
-        process_benchmark(os.path.join(BASE_DIR, bf))
+    manifest = load_manifest(cha_dir=BASE_DIR)
+    for name_part in task_values(manifest, "localization", "benchmark"):
+        process_benchmark(name_part, task_rows(manifest, "localization", benchmark=name_part))
+    print(IMAGE_CACHE.stats())
+    print(RESPONSE_CACHE.stats())
     print("\nover！")
 
 if __name__ == "__main__":
@@ -1,49 +1,42 @@
 import os
+import sys
 import json
-import base64
-import requests
 import random
-import math
-import io
-from tqdm import tqdm
-from PIL import Image
-from PIL import Image, ImageFile
 
-INPUT_FILE = "/hd/dynasty_sort_test_en.jsonl"
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "processing"))
+from async_client import response_content
+from batch_io import dispatch_requests
+from dead_letter import select_dead_letters
+from encode_image import IMAGE_CACHE
+from prefetch import prefetch_images, unreadable
+from image_transport import image_url
+import guided
+from response_cache import ResponseCache
+from manifest import load_manifest, task_rows
+
 OUTPUT_FILE = "/hd/images/sort_ans.jsonl"
+# one URL, or a list of URLs / (url, weight) pairs to spread the run over several replicas
 API_URL = "http://localhost:8000/v1/chat/completions"
 MODEL_NAME = "Qwen3-VL-4B-Instruct"
 BASE_DIR_LINUX = "/hd/Images_dynasty"
+CONCURRENCY = 32
+# "base64", "file" or "http", see processing/image_transport.py
+IMAGE_TRANSPORT = "base64"
+# vision tokens per request, split over its images by processing/token_budget.py; None = 2.8 MP per image
+TOKEN_BUDGET = None
+# None for online requests, "export" / "ingest" for offline `vllm run-batch`, see processing/batch_io.py
+BATCH_MODE = None
+# constrain decoding to {"ans": "<order>"} over the given images with a tight max_tokens (processing/guided.py)
+GUIDED = False
+RESPONSE_CACHE = ResponseCache()
+
+SYSTEM_PROMPT = (
+    "You are a professional historian and artifact expert. "
+    "Analyze the provided images and sort them in chronological order from oldest to newest. "
+    "CRITICAL: You must output ONLY a valid JSON object. Do not include any conversational text or thinking process outside the JSON. "
+    "If you need to think, put your reasoning inside a 'thought' key within the JSON."
+)
 
-def encode_image(image_path, max_pixels=2800000):
-
-    try:
-        with Image.open(image_path) as img:
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-            
-            orig_w, orig_h = img.size
-            current_pixels = orig_w * orig_h
-            
-            target_w, target_h = orig_w, orig_h
-
-            if current_pixels > max_pixels:
-                scale = math.sqrt(max_pixels / current_pixels)
-                target_w = int(orig_w * scale)
-                target_h = int(orig_h * scale)
-
-            target_w = max(28, (target_w // 28) * 28)
-            target_h = max(28, (target_h // 28) * 28)
-
-            if (target_w, target_h) != (orig_w, orig_h):
-                img = img.resize((target_w, target_h), Image.Resampling.LANCZOS)
-
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=90)
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
-    except Exception as e:
-        print(f"image fail:{image_path}: {e}")
-        return None
 def get_processed_ids(output_file):
     processed_ids = set()
     if os.path.exists(output_file):
@@ -66,96 +59,87 @@ def process_sort_test():
     if not os.path.exists(output_dir):
         os.makedirs(output_dir, exist_ok=True)
 
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        all_lines = [line.strip() for line in f if line.strip()]
+    manifest = load_manifest(cha_dir=BASE_DIR_LINUX)
 
+    items = {}
+    for row in task_rows(manifest, "sort"):
+        item_id = row["id"]
+        if not (1 <= item_id <= 1000) or item_id in processed_ids:
+            continue
 
-    with open(OUTPUT_FILE, 'a', encoding='utf-8') as f_out:
-        for line in tqdm(all_lines, desc="Processing Sort Task"):
-            try:
-                data = json.loads(line)
-                item_id = int(data.get('id', 0))
-            except:
-                continue
+        if None in row["sizes"]:
+            continue
 
-            if not (1 <= item_id <= 1000) or item_id in processed_ids:
-                continue
+        items[item_id] = {"data": row, "paths": row["paths"]}
+    batch_prefix = os.path.splitext(OUTPUT_FILE)[0]
+    items = {item_id: items[item_id] for item_id in select_dead_letters(list(items), batch_prefix)}
 
-            message_content = [{"type": "text", "text": data['prompt']}]
-            img_paths = data.get('images', [])
-            img_error = False
-            
-            for win_path in img_paths:
-                linux_path = win_path.replace('E:\\Images_dynasty', BASE_DIR_LINUX).replace('\\', '/')
-                if not os.path.exists(linux_path):
-                    img_error = True
-                    break
-                
-                try:
-                    base64_img = encode_image(linux_path)
-                    message_content.append({
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}
-                    })
-                except:
-                    img_error = True
-                    break
-            
-            if img_error:
+    def jobs():
+        images = ((item_id, item["paths"]) for item_id, item in items.items())
+        for item_id, b64_list in prefetch_images(images, transport=IMAGE_TRANSPORT, token_budget=TOKEN_BUDGET):
+            if None in b64_list:
+                yield item_id, unreadable(items[item_id]["paths"], b64_list)
                 continue
 
-            # --- API ---
-            try:
-                system_prompt = (
-                    "You are a professional historian and artifact expert. "
-                    "Analyze the provided images and sort them in chronological order from oldest to newest. "
-                    "CRITICAL: You must output ONLY a valid JSON object. Do not include any conversational text or thinking process outside the JSON. "
-                    "If you need to think, put your reasoning inside a 'thought' key within the JSON."
-                )
-                refined_user_prompt = (
-                    f"{data['prompt']}\n\n"
-                    "Requirement: Sort the images by dynasty. "
-                    "Output strictly in this JSON format: {\"ans\": \"the_sorted_indices_here\"}. "
-                    "Example: {\"ans\": \"2, 3, 1, 4, 5\"}"
-                )
-
-                message_content[0]["text"] = refined_user_prompt
-
-                payload = {
-                    "model": MODEL_NAME,
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": message_content}
-                    ],
-                    "temperature": 0.1,
-                    "response_format": {"type": "json_object"} 
-                }
-
-                response = requests.post(API_URL, json=payload, timeout=180)
-                response.raise_for_status()
-
-                raw_ans = response.json()['choices'][0]['message']['content'].strip()
+            data = items[item_id]["data"]
+            refined_user_prompt = (
+                f"{data['prompt']}\n\n"
+                "Requirement: Sort the images by dynasty. "
+                "Output strictly in this JSON format: {\"ans\": \"the_sorted_indices_here\"}. "
+                "Example: {\"ans\": \"2, 3, 1, 4, 5\"}"
+            )
+            message_content = [{"type": "text", "text": refined_user_prompt}]
+            for base64_img in b64_list:
+                message_content.append({
+                    "type": "image_url",
+                    "image_url": {"url": image_url(base64_img, IMAGE_TRANSPORT)}
+                })
+
+            payload = {
+                "model": MODEL_NAME,
+                "messages": [
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": message_content}
+                ],
+                "temperature": 0.1,
+                "response_format": {"type": "json_object"} 
+            }
+            if GUIDED:
+                guided.apply(payload, guided.json_schema(guided.order_schema(len(b64_list)), max_tokens=48))
+            yield item_id, payload
 
-                try:
-                    parsed_json = json.loads(raw_ans)
-                    ans_content = parsed_json.get("ans", raw_ans)
-                except:
-                    ans_content = raw_ans
-                
-                result = {
-                    "id": item_id,
-                    "category": data.get('category', ''),
-                    "ans": ans_content,
-                    "ground_truth": data.get('ground_truth', [])
-                }
-                f_out.write(json.dumps(result, ensure_ascii=False) + '\n')
-                f_out.flush()
-                processed_ids.add(item_id)
-
-            except Exception as e:
-                print(f"\n[failed] ID {item_id}: {e}")
+    with open(OUTPUT_FILE, 'a', encoding='utf-8') as f_out:
+
+        def on_result(item_id, result):
+            # failed requests never get here, dispatch_requests dead-letters them
+            raw_ans = response_content(result).strip()
+
+            try:
+                parsed_json = json.loads(raw_ans)
+                ans_content = parsed_json.get("ans", raw_ans)
+            except:
+                ans_content = raw_ans
+
+            data = items[item_id]["data"]
+            result = {
+                "id": item_id,
+                "category": data.get('category', ''),
+                "ans": ans_content,
+                "ground_truth": data.get('ground_truth', []),
+                "telemetry": result.get("telemetry")
+            }
+            f_out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            f_out.flush()
+            processed_ids.add(item_id)
+
+        dispatch_requests(jobs(), API_URL, on_result, list(items), batch_mode=BATCH_MODE,
+                          batch_prefix=batch_prefix,
+                          concurrency=CONCURRENCY, timeout=180, cache=RESPONSE_CACHE,
+                          desc="Processing Sort Task", total=len(items))
 
     print(f"\n[over] saved at: {OUTPUT_FILE}")
+    print(IMAGE_CACHE.stats())
+    print(RESPONSE_CACHE.stats())
 
 if __name__ == "__main__":
     process_sort_test()
\ No newline at end of file
@@ -1,126 +1,52 @@
-import os
-import json
-import re
-
-ROOT_DIR = "/hd/images"
-MIN_YEAR = 1900
-MAX_YEAR = 2025
-
-def extract_year_from_filename(filename):
-    if not filename: return None
-    match = re.search(r'(\d{4})', filename)
-    return int(match.group(1)) if match else None
-
-def extract_year_from_model_answer(answer):
-    if not isinstance(answer, str):
-        return None
-
-    matches = re.findall(r'(\d{4})', answer)
-    for m in matches:
-        year = int(m)
-        if MIN_YEAR <= year <= MAX_YEAR:
-            return year
-            
-    return None
-
-def analyze_results_detailed():
-    overall_y_total_count = 0
-    overall_y_correct_count = 0
-    overall_y_ae_sum = 0
-    overall_y_mae_valid_count = 0
-    
-    overall_mmt_total = 0
-    overall_mmt_correct = 0
-
-    header = f"{'Image_ID':<15} | {'GT Year':<10} | {'Pred Year':<10} | {'AE':<6} | {'Original Filename'}"
-    print("=" * 110)
-    print(header)
-    print("=" * 110)
-
-    for folder_name in sorted(os.listdir(ROOT_DIR)):
-        if not folder_name.endswith("_images"):
-            continue
-
-        abc_prefix = folder_name.replace("_images", "")
-        #print(abc_prefix)
-        base_path = os.path.join(ROOT_DIR, folder_name)
-        years_dir = os.path.join(base_path, "years")
-        years_ans_path = os.path.join(years_dir, f"{abc_prefix}_years_result.json")
-        years_map_path = os.path.join(years_dir, "year_name.json")
-        
-        if os.path.exists(years_ans_path) and os.path.exists(years_map_path):         
-            with open(years_ans_path, 'r', encoding='utf-8') as f:
-                y_ans = json.load(f)
-            with open(years_map_path, 'r', encoding='utf-8') as f:
-                y_map = json.load(f)
-            y_ans.sort(key=lambda x: int(os.path.splitext(x['image_id'])[0]) if os.path.splitext(x['image_id'])[0].isdigit() else 0)
-
-            f_y_total = 0
-            f_y_correct = 0
-            f_y_ae_sum = 0
-            f_y_mae_valid = 0
-            
-            for item in y_ans:
-                img_id = item['image_id']
-                model_reply = item['model_answer']
-                
-                orig_filename = y_map.get(img_id)
-                gt_year = extract_year_from_filename(orig_filename)
-                pred_year = extract_year_from_model_answer(model_reply)
-                
-                f_y_total += 1
-                ae_str = "N/A"
-                pred_year_str = "Invalid"
-                
-                if gt_year is not None:
-                    if pred_year is not None:
-                        ae = abs(gt_year - pred_year)
-                        f_y_ae_sum += ae
-                        f_y_mae_valid += 1
-                        ae_str = str(ae)
-                        pred_year_str = str(pred_year)
-                        if ae == 0:
-                            f_y_correct += 1
-                    else:
-                        pass
-
-            mmt_ans_path = os.path.join(base_path, "MMT-test", f"{abc_prefix}_MMT_result.json")
-            m_acc = 0.0
-            if os.path.exists(mmt_ans_path):
-                with open(mmt_ans_path, 'r', encoding='utf-8') as f:
-                    m_data = json.load(f)
-                f_m_total = len(m_data)
-                f_m_correct = sum(1 for x in m_data if x.get("is_correct") is True)
-                m_acc = f_m_correct / f_m_total if f_m_total > 0 else 0
-                overall_mmt_total += f_m_total
-                overall_mmt_correct += f_m_correct
-
-            y_acc = f_y_correct / f_y_total if f_y_total > 0 else 0
-            y_mae = f_y_ae_sum / f_y_mae_valid if f_y_mae_valid > 0 else 0
-            print("-" * 110)
-            print(f"summary[{folder_name}]:")
-            print(f"      Years Accuracy: {y_acc:.2%} ({f_y_correct}/{f_y_total})")
-            print(f"      Years MAE     : {y_mae:.2f} (number: {f_y_mae_valid})")
-            print(f"      MMT Accuracy  : {m_acc:.2%}")
-
-            overall_y_total_count += f_y_total
-            overall_y_correct_count += f_y_correct
-            overall_y_ae_sum += f_y_ae_sum
-            overall_y_mae_valid_count += f_y_mae_valid
-
-    print("\n" + "=" * 110)
-    print("OVERALL SUMMARY")
-    print("=" * 110)
-    if overall_y_total_count > 0:
-        final_y_acc = overall_y_correct_count / overall_y_total_count
-        final_y_mae = overall_y_ae_sum / overall_y_mae_valid_count if overall_y_mae_valid_count > 0 else 0
-        print(f"Years Task:  Overall Acc = {final_y_acc:.2%} ({overall_y_correct_count}/{overall_y_total_count})")
-        print(f"             Overall MAE = {final_y_mae:.2f} (number: {overall_y_mae_valid_count} )")
-    
-    if overall_mmt_total > 0:
-        final_m_acc = overall_mmt_correct / overall_mmt_total
-        print(f"Multimodal Task: Overall Acc = {final_m_acc:.2%} ({overall_mmt_correct}/{overall_mmt_total})")
-    print("=" * 110)
-
-if __name__ == "__main__":
-    analyze_results_detailed()
\ No newline at end of file
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "processing"))
+from scoring import load_years, load_mmt, score_years, score_mmt, save_scores
+
+ROOT_DIR = "/hd/images"
+# machine-readable copies of every metric, see processing/scoring.py
+JSON_OUTPUT = None
+CSV_OUTPUT = None
+
+def analyze_results_detailed():
+    # years: the first 1900-2025 year in the answer against year_name.json; MMT: the first image number
+    years_cols = load_years(ROOT_DIR)
+    mmt_cols = load_mmt(ROOT_DIR)
+    years = score_years(years_cols) if len(years_cols["correct"]) else {"groups": {}, "overall": {"n": 0}}
+    mmt = score_mmt(mmt_cols) if len(mmt_cols["correct"]) else {"groups": {}, "overall": {"n": 0}}
+
+    print("=" * 110)
+    for category in sorted(set(years["groups"]) | set(mmt["groups"])):
+        y = years["groups"].get(category, {"n": 0})
+        m = mmt["groups"].get(category, {"n": 0})
+        in_category = years_cols["category"] == category
+        y_correct = int(years_cols["correct"][in_category].sum())
+        y_valid = int(years_cols["valid"][in_category].sum())
+        print("-" * 110)
+        print(f"summary[{category}_images]:")
+        print(f"      Years Accuracy: {y.get('accuracy') or 0:.2%} ({y_correct}/{y['n']})")
+        print(f"      Years MAE     : {y.get('mae') or 0:.2f} (number: {y_valid})")
+        print(f"      Years within 1/5/10: {y.get('within_1') or 0:.2%} / {y.get('within_5') or 0:.2%} / "
+              f"{y.get('within_10') or 0:.2%}")
+        print(f"      MMT Accuracy  : {m.get('accuracy') or 0:.2%}")
+
+    print("\n" + "=" * 110)
+    print("OVERALL SUMMARY")
+    print("=" * 110)
+    y = years["overall"]
+    if y["n"] > 0:
+        y_correct = int(years_cols["correct"].sum())
+        y_valid = int(years_cols["valid"].sum())
+        print(f"Years Task:  Overall Acc = {y['accuracy']:.2%} ({y_correct}/{y['n']})")
+        print(f"             Overall MAE = {y['mae'] or 0:.2f} (number: {y_valid} )")
+    m = mmt["overall"]
+    if m["n"] > 0:
+        print(f"Multimodal Task: Overall Acc = {m['accuracy']:.2%} ({int(mmt_cols['correct'].sum())}/{m['n']})")
+    print("=" * 110)
+
+    scores = {task: result for task, result in (("years", years), ("mmt", mmt)) if result["overall"]["n"]}
+    save_scores(scores, JSON_OUTPUT, CSV_OUTPUT)
+
+if __name__ == "__main__":
+    analyze_results_detailed()
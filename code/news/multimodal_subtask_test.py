@@ -1,140 +1,154 @@
 import os
-import json
-import base64
-import requests
-import math
-import io
-from tqdm import tqdm
-from PIL import Image
-from PIL import Image, ImageFile
-Image.MAX_IMAGE_PIXELS = None
-ImageFile.LOAD_TRUNCATED_IMAGES = True
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "processing"))
+from async_client import response_content
+from batch_io import dispatch_requests
+from dead_letter import select_dead_letters
+from encode_image import IMAGE_CACHE
+from prefetch import prefetch_images, unreadable
+from image_transport import image_url
+import guided
+from logprob_scoring import scoring_fields, option_probabilities, best_option, records_calibration, format_calibration
+from response_cache import ResponseCache
+from checkpoint import JsonlCheckpoint
+from manifest import load_manifest, task_rows, task_values
+from scoring import mmt_prediction
+
+# one URL, or a list of URLs / (url, weight) pairs to spread the run over several replicas
 API_URL = "http://localhost:8000/v1/chat/completions"
 MODEL_NAME = "Qwen3-VL-4B-Instruct"
 ROOT_DIR = "/hd/images"
-
-def encode_image(image_path, max_pixels=2800000):
-    try:
-        with Image.open(image_path) as img:
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-            orig_w, orig_h = img.size
-            current_pixels = orig_w * orig_h
-            target_w, target_h = orig_w, orig_h
-
-            if current_pixels > max_pixels:
-                scale = math.sqrt(max_pixels / current_pixels)
-                target_w = int(orig_w * scale)
-                target_h = int(orig_h * scale)
-            target_w = max(28, (target_w // 28) * 28)
-            target_h = max(28, (target_h // 28) * 28)
-
-            if (target_w, target_h) != (orig_w, orig_h):
-                img = img.resize((target_w, target_h), Image.Resampling.LANCZOS)
-
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=90)
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
-    except Exception as e:
-        print(f"failed {image_path}: {e}")
-        return None
-
-def query_internvl_mmt(image_paths, event_description):
-    content = []
-
-    for i, path in enumerate(image_paths, 1):
-        b64_data = encode_image(path)
+CONCURRENCY = 32
+# "base64", "file" or "http", see processing/image_transport.py
+IMAGE_TRANSPORT = "base64"
+# vision tokens per request, split over its images by processing/token_budget.py; None = 2.8 MP per image
+TOKEN_BUDGET = None
+# None for online requests, "export" / "ingest" for offline `vllm run-batch`, see processing/batch_io.py
+BATCH_MODE = None
+# constrain decoding to one of the image numbers with a tight max_tokens (processing/guided.py)
+GUIDED = False
+# "generate" parses the generated answer; "logprobs" scores the options from one forward pass with max_tokens=1
+# and records a normalized probability per option plus calibration (processing/logprob_scoring.py)
+SCORING = "generate"
+RESPONSE_CACHE = ResponseCache()
+
+# static instructions first so vLLM's prefix cache can share them across requests
+MMT_INSTRUCTION = (
+    "The images are numbered '1' '2' '3' '4' in the order they were input(e.g. '1' represents the first input image, '4' represents the last input image)"
+    "\nBased on the visual evidence, which image was taken in the same year as the event?"
+    "Respond ONLY with the digit.(e.g. 1)"
+)
+
+def build_mmt_payload(image_base64_list, event_description):
+    content = [
+        {"type": "text", "text": MMT_INSTRUCTION},
+        {"type": "text", "text": f"\nEvent Description: {event_description}\n"},
+    ]
+
+    for i, b64_data in enumerate(image_base64_list, 1):
         if b64_data:
             content.append({"type": "text", "text": f"Image {i}:"})
             content.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{b64_data}"}
+                "image_url": {"url": image_url(b64_data, IMAGE_TRANSPORT)}
             })
-
-    prompt_text = (
-        f"\n The images are numbered '1' '2' '3' '4' in the order they were input(e.g. '1' represents the first input image, '4' represents the last input image)"
-        f"\nEvent Description: {event_description}\n"
-        f"Based on the visual evidence, which image was taken in the same year as the event?"
-        f"Respond ONLY with the digit.(e.g. 1)"
-    )
-    content.append({"type": "text", "text": prompt_text})
     
     payload = {
         "model": MODEL_NAME,
         "messages": [{"role": "user", "content": content}],
         "temperature": 0.0
     }
+    if SCORING == "logprobs":
+        payload.update(scoring_fields())
+    elif GUIDED:
+        numbers = [str(i) for i, b64_data in enumerate(image_base64_list, 1) if b64_data]
+        guided.apply(payload, guided.choice(numbers, max_tokens=2))
+    return payload
 
-    try:
-        response = requests.post(API_URL, json=payload, timeout=120)
-        response.raise_for_status()
-        return response.json()['choices'][0]['message']['content'].strip()
-    except Exception as e:
-        return f"Error: {str(e)}"
+def parse_mmt_answer(result):
+    # failed requests never get here, dispatch_requests dead-letters them
+    return response_content(result).strip()
 
 def run_mmt_test_aggregated():
-    for folder_name in os.listdir(ROOT_DIR):
-        if not folder_name.endswith("_images"):
+    manifest = load_manifest(images_dir=ROOT_DIR)
+    for abc_prefix in task_values(manifest, "mmt", "category"):
+        folder_name = f"{abc_prefix}_images"
+        mmt_test_root = os.path.join(ROOT_DIR, folder_name, "MMT-test")
+        if not os.path.isdir(mmt_test_root):
+            print(f" {folder_name}: can't find MMT-test")
             continue
-        
-        abc_prefix = folder_name.replace("_images", "")
-        base_path = os.path.join(ROOT_DIR, folder_name)
-        mmt_test_root = os.path.join(base_path, "MMT-test")
-
-        json_info_path = os.path.join(base_path, f"{abc_prefix}-MMT-test-information.json")
-        if not os.path.exists(json_info_path):
-            print(f" {folder_name}: can't find JSON")
-            continue
-
-
-        with open(json_info_path, 'r', encoding='utf-8') as f:
-            test_data_list = json.load(f)
-            if isinstance(test_data_list, dict):
-                test_data_list = [test_data_list]
-
-        print(f"\nnow: {folder_name} (tot cases: {len(test_data_list)} )")
-
-        all_results_for_category = []
 
-        for test_item in tqdm(test_data_list, desc=f"Testing {abc_prefix}"):
-            test_id = test_item.get("test_id")
-            event_desc = test_item.get("news", {}).get("description", "N/A")
-            ground_truth = test_item.get("correct_answer")
+        rows = task_rows(manifest, "mmt", category=abc_prefix)
+        print(f"\nnow: {folder_name} (tot cases: {len(rows)} )")
 
-            test_folder = os.path.join(mmt_test_root, test_id)
-            valid_exts = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.JPG', '.JPEG', '.PNG')
-
-            img_paths = [
-                next(os.path.join(test_folder, f"{i}{ext}") 
-                    for ext in valid_exts 
-                    if os.path.exists(os.path.join(test_folder, f"{i}{ext}")))
-                for i in range(1, 5)
-            ]
-
-            if not all(os.path.exists(p) for p in img_paths):
-                print(f" test {test_id}: can't find images")
+        tests = {}
+        for row in rows:
+            if None in row["sizes"]:
+                print(f" test {row['test_id']}: can't find images")
                 continue
-
-            model_ans = query_internvl_mmt(img_paths, event_desc)
-
-            all_results_for_category.append({
+            tests[row["test_id"]] = {"event": row["event"], "ground_truth": row["ground_truth"], "img_paths": row["paths"]}
+
+        summary_file_path = os.path.join(mmt_test_root, f"{abc_prefix}_MMT_result.json")
+        os.makedirs(mmt_test_root, exist_ok=True)
+        checkpoint = JsonlCheckpoint(f"{summary_file_path}l", key="test_id")
+        pending = [test_id for test_id in tests if test_id not in checkpoint.done]
+        if len(pending) < len(tests):
+            print(f"  resuming: {len(tests) - len(pending)} cases already done")
+        batch_prefix = os.path.join(mmt_test_root, f"{abc_prefix}_MMT")
+        pending = select_dead_letters(pending, batch_prefix)
+
+        def jobs():
+            images = ((test_id, tests[test_id]["img_paths"]) for test_id in pending)
+            for test_id, b64_list in prefetch_images(images, transport=IMAGE_TRANSPORT, token_budget=TOKEN_BUDGET):
+                if None in b64_list:
+                    yield test_id, unreadable(tests[test_id]["img_paths"], b64_list)
+                    continue
+                yield test_id, build_mmt_payload(b64_list, tests[test_id]["event"])
+
+        def on_result(test_id, result):
+            test = tests[test_id]
+            model_ans = parse_mmt_answer(result)
+            record = {
                 "test_id": test_id,
-                "event": event_desc,
+                "event": test["event"],
                 "model_response": model_ans,
-                "ground_truth": ground_truth,
-                "is_correct": str(ground_truth) in model_ans
-            })
-
-        if all_results_for_category:
-            summary_file_path = os.path.join(mmt_test_root, f"{abc_prefix}_MMT_result.json")
-            os.makedirs(mmt_test_root, exist_ok=True)
-            
-            with open(summary_file_path, 'w', encoding='utf-8') as f:
-                json.dump(all_results_for_category, f, ensure_ascii=False, indent=4)
-            
-            correct_count = sum(1 for res in all_results_for_category if res["is_correct"])
-            accuracy = correct_count / len(all_results_for_category)
+                "ground_truth": test["ground_truth"],
+                # same rule as processing/scoring.py: the first image number in the answer
+                "is_correct": mmt_prediction(model_ans) == str(test["ground_truth"]),
+                "telemetry": result.get("telemetry")
+            }
+            if SCORING == "logprobs":
+                probs = option_probabilities(result, [str(i) for i in range(1, len(test["img_paths"]) + 1)])
+                if probs is not None:
+                    record["model_response"] = best_option(probs)
+                    record["is_correct"] = record["model_response"] == str(test["ground_truth"])
+                record["option_probs"] = probs
+                record["confidence"] = max(probs.values()) if probs else None
+
+            checkpoint.append(record)
+
+        dispatch_requests(jobs(), API_URL, on_result, pending, batch_mode=BATCH_MODE,
+                          batch_prefix=batch_prefix,
+                          concurrency=CONCURRENCY, timeout=120, cache=RESPONSE_CACHE,
+                          desc=f"Testing {abc_prefix}", total=len(pending))
+        checkpoint.close()
+
+        correct_count = 0
+        total_count = 0
+        for record in checkpoint.records():
+            correct_count += 1 if record["is_correct"] else 0
+            total_count += 1
+
+        if total_count:
+            checkpoint.compact(summary_file_path, order=list(tests))
+            accuracy = correct_count / total_count
             print(f"  >> {folder_name} solved. acc: {accuracy:.2%} (saved at {summary_file_path})")
+            if SCORING == "logprobs":
+                print(format_calibration(records_calibration(checkpoint.records())))
+
+    print(IMAGE_CACHE.stats())
+    print(RESPONSE_CACHE.stats())
 
 if __name__ == "__main__":
     run_mmt_test_aggregated()
\ No newline at end of file
@@ -1,58 +1,32 @@
 import os
-import json
-import base64
-import requests
-import math
-import io
-from tqdm import tqdm
-from PIL import Image
-from PIL import Image, ImageFile
-
-Image.MAX_IMAGE_PIXELS = None
-ImageFile.LOAD_TRUNCATED_IMAGES = True
-
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "processing"))
+from async_client import response_content
+from batch_io import dispatch_requests
+from dead_letter import select_dead_letters
+from encode_image import IMAGE_CACHE
+from prefetch import prefetch_images, unreadable
+from image_transport import image_url
+import guided
+from response_cache import ResponseCache
+from checkpoint import JsonlCheckpoint
+from manifest import load_manifest, task_rows, task_values
+
+# one URL, or a list of URLs / (url, weight) pairs to spread the run over several replicas
 API_URL = "http://localhost:8000/v1/chat/completions"
 MODEL_NAME = "Qwen3-VL-4B-Instruct"
 ROOT_DIR = "/hd/images"
+CONCURRENCY = 32
+# "base64", "file" or "http", see processing/image_transport.py
+IMAGE_TRANSPORT = "base64"
+# None for online requests, "export" / "ingest" for offline `vllm run-batch`, see processing/batch_io.py
+BATCH_MODE = None
+# constrain decoding to a 4-digit year with a tight max_tokens (processing/guided.py)
+GUIDED = False
+RESPONSE_CACHE = ResponseCache()
 PROMPT = "In which year did this image first appear? Respond only with the 4-digit year (e.g., 2000) and nothing else."
-def encode_image(image_path, max_pixels=2800000):
-
-    try:
-        with Image.open(image_path) as img:
-
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-            
-            orig_w, orig_h = img.size
-            current_pixels = orig_w * orig_h
-            
-            target_w, target_h = orig_w, orig_h
-
-            if current_pixels > max_pixels:
-                scale = math.sqrt(max_pixels / current_pixels)
-                target_w = int(orig_w * scale)
-                target_h = int(orig_h * scale)
-
-            target_w = max(28, (target_w // 28) * 28)
-            target_h = max(28, (target_h // 28) * 28)
-
-            if (target_w, target_h) != (orig_w, orig_h):
-                img = img.resize((target_w, target_h), Image.Resampling.LANCZOS)
-
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=90)
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
-    except Exception as e:
-        print(f"image failed to prepare: {image_path}: {e}")
-        return None
-
-def query_internvl(image_path, prompt):
-    base64_image = encode_image(image_path)
-    
-    headers = {
-        "Content-Type": "application/json"
-    }
-
+def build_payload(base64_image, prompt):
     payload = {
         "model": MODEL_NAME,
         "messages": [
@@ -66,7 +40,7 @@ def query_internvl(image_path, prompt):
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
+                            "url": image_url(base64_image, IMAGE_TRANSPORT)
                         }
                     }
                 ]
@@ -74,50 +48,62 @@ def query_internvl(image_path, prompt):
         ],
         "temperature": 0.2
     }
+    if GUIDED:
+        guided.apply(payload, guided.regex(guided.YEAR_PATTERN, max_tokens=8))
+    return payload
 
-    try:
-        response = requests.post(API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        result = response.json()
-        return result['choices'][0]['message']['content']
-    except Exception as e:
-        return f"Error: {str(e)}"
+def parse_answer(result):
+    # failed requests never get here, dispatch_requests dead-letters them
+    return response_content(result)
 
 def run_test():
-    for folder_name in os.listdir(ROOT_DIR):
-        if not folder_name.endswith("_images"):
-            continue
-        abc_prefix = folder_name.replace("_images", "")
-        
+    manifest = load_manifest(images_dir=ROOT_DIR)
+    for abc_prefix in task_values(manifest, "years", "category"):
+        folder_name = f"{abc_prefix}_images"
         years_dir = os.path.join(ROOT_DIR, folder_name, "years")
-        if not os.path.exists(years_dir):
-            print(f" {folder_name}: can't find files")
-            continue
             
         print(f"\ncategory: {folder_name}")
 
-        image_extensions = ('.jpg', '.jpeg', '.png', '.webp')
-        image_files = [f for f in os.listdir(years_dir) if f.lower().endswith(image_extensions)]
-        image_files.sort(key=lambda x: int(os.path.splitext(x)[0]) if os.path.splitext(x)[0].isdigit() else x)
-
-        results = []
+        image_paths = {row["image_id"]: row["path"] for row in task_rows(manifest, "years", category=abc_prefix)}
+        image_files = list(image_paths)
 
-        for img_file in tqdm(image_files, desc=f"Testing {folder_name}"):
-            img_path = os.path.join(years_dir, img_file)
-
-            answer = query_internvl(img_path, PROMPT)
-            
-            results.append({
+        output_path = os.path.join(years_dir, f"{abc_prefix}_years_result.json")
+        checkpoint = JsonlCheckpoint(f"{output_path}l", key="image_id")
+        pending = [img_file for img_file in image_files if img_file not in checkpoint.done]
+        if len(pending) < len(image_files):
+            print(f"resuming: {len(image_files) - len(pending)} images already done")
+        batch_prefix = os.path.join(years_dir, f"{abc_prefix}_years")
+        pending = select_dead_letters(pending, batch_prefix)
+
+        def jobs():
+            images = ((img_file, [image_paths[img_file]]) for img_file in pending)
+            for img_file, b64_list in prefetch_images(images, transport=IMAGE_TRANSPORT):
+                if None in b64_list:
+                    yield img_file, unreadable([image_paths[img_file]], b64_list)
+                    continue
+                yield img_file, build_payload(b64_list[0], PROMPT)
+
+        def on_result(img_file, result):
+            checkpoint.append({
                 "image_id": img_file,
                 "prompt": PROMPT,
-                "model_answer": answer
+                "model_answer": parse_answer(result),
+                "telemetry": result.get("telemetry")
             })
 
-        output_path = os.path.join(years_dir, f"{abc_prefix}_years_result.json")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=4)
-            
-        print(f"saved at: {output_path}")
+        dispatch_requests(jobs(), API_URL, on_result, pending, batch_mode=BATCH_MODE,
+                          batch_prefix=batch_prefix,
+                          concurrency=CONCURRENCY, timeout=120, cache=RESPONSE_CACHE,
+                          desc=f"Testing {folder_name}", total=len(pending))
+
+        checkpoint.close()
+        # an export run (or an ingest before the batch output exists) leaves no records, keep any earlier results
+        if checkpoint.done:
+            checkpoint.compact(output_path, order=image_files)
+            print(f"saved at: {output_path}")
+
+    print(IMAGE_CACHE.stats())
+    print(RESPONSE_CACHE.stats())
 
 if __name__ == "__main__":
     run_test()
\ No newline at end of file
@@ -1,44 +1,37 @@
-import os
-import json
-from pathlib import Path
-
-BASE_DIR = "/hd/images"
-
-def main():
-    base_path = Path(BASE_DIR)
-    categories = sorted([d for d in base_path.iterdir() if d.is_dir() and d.name.endswith("_images")])
-    
-    print(f"{'name (Category)':<25} | {'num':<6} | {'correct':<6} | {'acc'}")
-    print("-" * 60)
-
-    total_all = 0
-    correct_all = 0
-
-    for cat in categories:
-        cat_name = cat.name
-        prefix = cat_name.replace("_images", "")
-        results_file = cat / "subtask1" / f"{prefix}_subtask1_result.json"
-
-        if not results_file.exists():
-            continue
-        
-        with open(results_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        total = len(data)
-        correct = sum(1 for item in data if item.get("is_correct") is True)
-        accuracy = (correct / total * 100) if total > 0 else 0
-        
-        total_all += total
-        correct_all += correct
-        
-        print(f"{cat.name:<25} | {total:<6} | {correct:<6} | {accuracy:.2f}%")
-
-    print("-" * 60)
-    if total_all > 0:
-        overall_acc = (correct_all / total_all) * 100
-        print(f"{' (Overall)':<25} | {total_all:<6} | {correct_all:<6} | {overall_acc:.2f}%")
-
-if __name__ == "__main__":
-
-    main()
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "processing"))
+from scoring import load_shortcut, score_shortcut, save_scores
+
+BASE_DIR = "/hd/images"
+# machine-readable copies of every metric, see processing/scoring.py
+JSON_OUTPUT = None
+CSV_OUTPUT = None
+
+def main():
+    cols = load_shortcut(BASE_DIR)
+    # the table covers the unperturbed runs, {category}_subtask1_result.json
+    color = cols["condition"] == "color"
+    categories, inverse = np.unique(cols["category"][color].astype(str), return_inverse=True)
+    totals = np.bincount(inverse, minlength=len(categories))
+    corrects = np.bincount(inverse, weights=cols["correct"][color].astype(float), minlength=len(categories))
+
+    print(f"{'name (Category)':<25} | {'num':<6} | {'correct':<6} | {'acc'}")
+    print("-" * 60)
+    for category, total, correct in zip(categories, totals, corrects.astype(int)):
+        print(f"{category + '_images':<25} | {total:<6} | {correct:<6} | {correct / total * 100:.2f}%")
+
+    print("-" * 60)
+    total_all, correct_all = int(totals.sum()), int(corrects.sum())
+    if total_all > 0:
+        print(f"{' (Overall)':<25} | {total_all:<6} | {correct_all:<6} | {correct_all / total_all * 100:.2f}%")
+
+    if len(cols["correct"]):
+        save_scores({"shortcut": score_shortcut(cols)}, JSON_OUTPUT, CSV_OUTPUT)
+
+if __name__ == "__main__":
+
+    main()
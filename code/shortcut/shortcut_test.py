@@ -1,51 +1,49 @@
 import os
+import sys
 import json
 import re
-import base64
-import requests
-import math
-import io
 from pathlib import Path
-from tqdm import tqdm
-from PIL import Image, ImageFile
-
-Image.MAX_IMAGE_PIXELS = None
-ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "processing"))
+from async_client import response_content
+from batch_io import dispatch_requests
+from dead_letter import select_dead_letters
+from encode_image import IMAGE_CACHE
+from prefetch import prefetch_images, unreadable
+from image_transport import image_url
+import guided
+from logprob_scoring import scoring_fields, prefill, option_probabilities, best_option, records_calibration, format_calibration
+from response_cache import ResponseCache
+from checkpoint import JsonlCheckpoint
+from manifest import load_manifest, task_rows, task_values
+
+# one URL, or a list of URLs / (url, weight) pairs to spread the run over several replicas
 API_URL = "http://localhost:8000/v1/chat/completions"
 MODEL_NAME = "Qwen3-VL-4B-Instruct"
 BASE_DIR = "/hd/images"
-
-def encode_image(image_path, max_pixels=2800000):
-
-    try:
-        with Image.open(image_path) as img:
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-            
-            orig_w, orig_h = img.size
-            current_pixels = orig_w * orig_h
-            target_w, target_h = orig_w, orig_h
-            
-            if current_pixels > max_pixels:
-                scale = math.sqrt(max_pixels / current_pixels)
-                target_w = int(orig_w * scale)
-                target_h = int(orig_h * scale)
-            
-            target_w = max(28, (target_w // 28) * 28)
-            target_h = max(28, (target_h // 28) * 28)
-            
-            if (target_w, target_h) != (orig_w, orig_h):
-                img = img.resize((target_w, target_h), Image.Resampling.LANCZOS)
-            
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=90)
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
-    except Exception as e:
-        print(f"image failed: {image_path}: {e}")
-        return None
-
-def query_vllm(image_base64_list):
+CONCURRENCY = 32
+# "base64", "file" or "http", see processing/image_transport.py
+IMAGE_TRANSPORT = "base64"
+# vision tokens per request, split over its images by processing/token_budget.py; None = 2.8 MP per image
+TOKEN_BUDGET = None
+# None for online requests, "export" / "ingest" for offline `vllm run-batch`, see processing/batch_io.py
+BATCH_MODE = None
+# constrain decoding to '1' or '2' (drops the JSON 'thinking' field) with a tight max_tokens (processing/guided.py)
+GUIDED = False
+# "generate" parses the generated answer; "logprobs" scores the options from one forward pass with max_tokens=1
+# and records a normalized probability per option plus calibration (processing/logprob_scoring.py)
+SCORING = "generate"
+# condition -> perturbation applied on the fly (processing/perturb.py), e.g. "sepia", "grayscale+grain:0.08"
+# "color" keeps the original files and output names; other conditions get their own result files,
+# e.g. {"color": None, "grayscale": "grayscale"} adds a grayscale pass next to the baseline
+CONDITIONS = {"color": None}
+# which image of each pair is perturbed: "newer", "older" or "both"
+PERTURB_TARGET = "newer"
+# tests prepared together, so perturbed images are transformed in batches
+PERTURB_BATCH = 8
+RESPONSE_CACHE = ResponseCache()
+
+def build_payload(image_base64_list):
     system_prompt = (
         "You are an expert in historical visual analysis. "
         "Analyze the provided images for chronological clues such as technology, fashion, architecture, and photo quality. "
@@ -67,8 +65,8 @@ def query_vllm(image_base64_list):
                 "role": "user",
                 "content": [
                     {"type": "text", "text": user_prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64_list[0]}"}},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64_list[1]}"}},
+                    {"type": "image_url", "image_url": {"url": image_url(image_base64_list[0], IMAGE_TRANSPORT)}},
+                    {"type": "image_url", "image_url": {"url": image_url(image_base64_list[1], IMAGE_TRANSPORT)}},
                 ],
             }
         ],
@@ -76,101 +74,124 @@ def query_vllm(image_base64_list):
         "max_tokens": 2048,
         "response_format": {"type": "json_object"}
     }
-    
-    try:
-        response = requests.post(API_URL, json=payload, timeout=120)
-        if response.status_code != 200:
-            return f"Error {response.status_code}"
-            
-        res_json = response.json()
-        raw_content = res_json['choices'][0]['message']['content'].strip()
-
-        try:
-            parsed = json.loads(raw_content)
-            final_ans = str(parsed.get("answer", "")).strip()
-            if "1" in final_ans: return "1"
-            if "2" in final_ans: return "2"
-            return final_ans
-        except json.JSONDecodeError:
-            match = re.search(r'"answer":\s*"(\d)"', raw_content)
-            return match.group(1) if match else raw_content
-            
-    except Exception as e:
-        return f"Exception: {e}"
-
-def extract_year_from_key(key_str):
+    if SCORING == "logprobs":
+        # the JSON prompt stays; the answer key is prefilled so the next token is '1' or '2'
+        payload.pop("response_format")
+        payload.update(scoring_fields())
+        prefill(payload, '{"answer": "')
+    elif GUIDED:
+        guided.apply(payload, guided.choice(["1", "2"], max_tokens=2))
+    return payload
+
+def parse_prediction(result):
+    # failed requests never get here, dispatch_requests dead-letters them
+    raw_content = response_content(result).strip()
+    if raw_content in ("1", "2"):
+        return raw_content
+
     try:
-        filename = os.path.basename(key_str)
-        first_underscore_idx = filename.find('_')
-        if first_underscore_idx != -1:
-            year_str = filename[first_underscore_idx + 1 : first_underscore_idx + 5]
-            if year_str.isdigit():
-                return int(year_str)
-        return None
-    except Exception:
-        return None
-
-def process_category(category_path):
-    cat_name = category_path.name
-    subtask_dir = category_path / "subtask1"
-    ans_path = category_path / "ans.json"
-    pic_map_path = category_path / "test.json"
-
-    if not (ans_path.exists() and pic_map_path.exists()):
+        parsed = json.loads(raw_content)
+        final_ans = str(parsed.get("answer", "")).strip()
+        if "1" in final_ans: return "1"
+        if "2" in final_ans: return "2"
+        return final_ans
+    except json.JSONDecodeError:
+        match = re.search(r'"answer":\s*"(\d)"', raw_content)
+        return match.group(1) if match else raw_content
+
+def perturbed_entries(test, transform):
+    if not transform:
+        return list(test['paths'])
+    # ground truth "1": image 1 is the earlier one, so image 2 is the newer one
+    newer = 1 if test['ground_truth'] == "1" else 0
+    targets = {0, 1} if PERTURB_TARGET == "both" else {newer if PERTURB_TARGET == "newer" else 1 - newer}
+    return [(path, transform) if i in targets else path for i, path in enumerate(test['paths'])]
+
+def result_name(category, condition, ext):
+    if condition == "color":
+        return f"{category}_subtask1_result.{ext}"
+    return f"{category}_subtask1_{condition}_result.{ext}"
+
+def process_category(category, rows):
+    cat_name = f"{category}_images"
+    subtask_dir = Path(BASE_DIR) / cat_name / "subtask1"
+    if not subtask_dir.exists():
         return
 
-    with open(ans_path, 'r') as f:
-        ground_truth = json.load(f)
-    with open(pic_map_path, 'r') as f:
-        name_mapping = json.load(f)
-
-    prefix = cat_name.replace("_images", "")
-    output_path = subtask_dir / f"{prefix}_subtask1_result.json"
-
-    results = []
-    all_tests = sorted(ground_truth.keys(), 
-                        key=lambda x: int(re.search(r'\d+', x).group()) if re.search(r'\d+', x) else 0)
-
-    for test_id in tqdm(all_tests, desc=f"Processing {cat_name}"):
-        current_test_files = []
-        for old_path_key, random_name_val in name_mapping.items():
-            if old_path_key.startswith(f"{test_id}/"):
-                year = extract_year_from_key(old_path_key)
-                full_path = subtask_dir / test_id / random_name_val
-                if full_path.exists() and year is not None:
-                    current_test_files.append({"year": year, "path": full_path, "orig_key": old_path_key})
-
-        if len(current_test_files) != 2:
-            continue
-
-        current_test_files.sort(key=lambda x: x['year'])
-        file_early = current_test_files[0]
-        file_late = current_test_files[1]
-
-        ans_val = str(ground_truth[test_id])
-        input_order = [file_early, file_late] if ans_val == "1" else [file_late, file_early]
-
-        b64_list = [encode_image(item['path']) for item in input_order]
-        if None in b64_list: continue
-            
-        prediction = query_vllm(b64_list)
-
-        results.append({
+    checkpoints = {condition: JsonlCheckpoint(subtask_dir / result_name(category, condition, "jsonl"), key="test_id")
+                   for condition in CONDITIONS}
+
+    # rows come from the compiled manifest with images already in input order
+    tests = {row["test_id"]: row for row in rows if None not in row["sizes"]}
+
+    # every condition of a pair is evaluated in the same pass, from images prepared in memory
+    pending = [(test_id, condition) for test_id in tests for condition in CONDITIONS
+               if test_id not in checkpoints[condition].done]
+    if len(pending) < len(tests) * len(CONDITIONS):
+        print(f"{cat_name}: resuming, {len(tests) * len(CONDITIONS) - len(pending)} (test, condition) pairs already done")
+    batch_prefix = subtask_dir / f"{category}_subtask1"
+    pending = select_dead_letters(pending, batch_prefix)
+
+    def jobs():
+        chunks = (pending[i:i + PERTURB_BATCH * len(CONDITIONS)]
+                  for i in range(0, len(pending), PERTURB_BATCH * len(CONDITIONS)))
+        images = ((tuple(chunk), [entry for test_id, condition in chunk
+                                  for entry in perturbed_entries(tests[test_id], CONDITIONS[condition])])
+                  for chunk in chunks)
+        for chunk, b64_list in prefetch_images(images, transport=IMAGE_TRANSPORT, token_budget=TOKEN_BUDGET, images_per_request=2):
+            for i, job_id in enumerate(chunk):
+                pair = b64_list[2 * i:2 * i + 2]
+                if None in pair:
+                    yield job_id, unreadable(tests[job_id[0]]["paths"], pair)
+                    continue
+                yield job_id, build_payload(pair)
+
+    def on_result(job_id, result):
+        test_id, condition = job_id
+        test = tests[test_id]
+        prediction = parse_prediction(result)
+        probs = option_probabilities(result, ["1", "2"]) if SCORING == "logprobs" else None
+        if probs is not None:
+            prediction = best_option(probs)
+
+        details = {
+            "years": test['years'],
+            "files": test['orig_keys']
+        }
+        if CONDITIONS[condition]:
+            details["transform"] = CONDITIONS[condition]
+            details["perturbed"] = PERTURB_TARGET
+
+        record = {
             "test_id": test_id,
-            "ground_truth": ans_val,
+            "ground_truth": test['ground_truth'],
             "prediction": prediction,
-            "is_correct": prediction == ans_val,
-            "details": {
-                "years": [item['year'] for item in input_order],
-                "files": [item['orig_key'] for item in input_order]
-            }
-        })
-
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=4, ensure_ascii=False)
+            "is_correct": prediction == test['ground_truth'],
+            "details": details,
+            "telemetry": result.get("telemetry")
+        }
+        if SCORING == "logprobs":
+            record["option_probs"] = probs
+            record["confidence"] = max(probs.values()) if probs else None
+        checkpoints[condition].append(record)
+
+    dispatch_requests(jobs(), API_URL, on_result, pending, batch_mode=BATCH_MODE,
+                      batch_prefix=batch_prefix,
+                      concurrency=CONCURRENCY, timeout=120, cache=RESPONSE_CACHE,
+                      desc=f"Processing {cat_name}", total=len(pending))
+
+    for condition, checkpoint in checkpoints.items():
+        checkpoint.close()
+        # an export run (or an ingest before the batch output exists) leaves no records, keep any earlier results
+        if not checkpoint.done:
+            continue
+        checkpoint.compact(subtask_dir / result_name(category, condition, "json"), order=list(tests))
+        if SCORING == "logprobs":
+            print(f"{cat_name} [{condition}] " + format_calibration(records_calibration(checkpoint.records())))
 
 if __name__ == "__main__":
-    base_path = Path(BASE_DIR)
-    categories = [d for d in base_path.iterdir() if d.is_dir()  and d.name.endswith("_images")]
-    for cat in categories:
-        process_category(cat)
+    manifest = load_manifest(images_dir=BASE_DIR)
+    for category in task_values(manifest, "shortcut", "category"):
+        process_category(category, task_rows(manifest, "shortcut", category=category))
+    print(IMAGE_CACHE.stats())
+    print(RESPONSE_CACHE.stats())
@@ -1,45 +1,40 @@
 import os
+import sys
 import json
 import re
-import base64
-import requests
-import math
-import io
 from pathlib import Path
-from tqdm import tqdm
-from PIL import Image, ImageFile
-
-Image.MAX_IMAGE_PIXELS = None
-ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "processing"))
+from async_client import response_content
+from streaming import EarlyStop
+from batch_io import dispatch_requests
+from dead_letter import select_dead_letters
+from encode_image import IMAGE_CACHE
+from prefetch import prefetch_images, unreadable
+from image_transport import image_url
+from response_cache import ResponseCache
+from checkpoint import JsonlCheckpoint
+from manifest import load_manifest, task_rows, task_values
+
+# one URL, or a list of URLs / (url, weight) pairs to spread the run over several replicas
 API_URL = "http://localhost:8000/v1/chat/completions"
 MODEL_NAME = "Qwen3-VL-4B-Instruct"
 BASE_DIR = "/hd/images"
-
-def encode_image(image_path, max_pixels=2800000):
-    try:
-        with Image.open(image_path) as img:
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-            orig_w, orig_h = img.size
-            current_pixels = orig_w * orig_h
-            target_w, target_h = orig_w, orig_h
-            if current_pixels > max_pixels:
-                scale = math.sqrt(max_pixels / current_pixels)
-                target_w = int(orig_w * scale)
-                target_h = int(orig_h * scale)
-            target_w = max(28, (target_w // 28) * 28)
-            target_h = max(28, (target_h // 28) * 28)
-            if (target_w, target_h) != (orig_w, orig_h):
-                img = img.resize((target_w, target_h), Image.Resampling.LANCZOS)
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=90)
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
-    except Exception as e:
-        print(f"image failed: {image_path}: {e}")
-        return None
-
-def query_vllm(image_base64_list):
+CONCURRENCY = 32
+# "base64", "file" or "http", see processing/image_transport.py
+IMAGE_TRANSPORT = "base64"
+# vision tokens per request, split over its images by processing/token_budget.py; None = 2.8 MP per image
+TOKEN_BUDGET = None
+# None for online requests, "export" / "ingest" for offline `vllm run-batch`, see processing/batch_io.py
+BATCH_MODE = None
+# stream responses and cut them once "answer" is complete or REASONING_BUDGET completion tokens are spent,
+# keeping the partial reasoning (processing/streaming.py); None (the default) keeps the full max_tokens,
+# a budget cuts long reasoning into "Truncated" answers and so changes the accuracy
+STREAM = True
+REASONING_BUDGET = None
+RESPONSE_CACHE = ResponseCache()
+
+def build_payload(image_base64_list):
     system_prompt = (
         "You are an expert in historical visual analysis and chronological reasoning. "
         "Your goal is to determine the temporal order of images by identifying intrinsic time anchors.\n\n"
@@ -68,8 +63,8 @@ def query_vllm(image_base64_list):
                 "role": "user",
                 "content": [
                     {"type": "text", "text": user_prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64_list[0]}"}},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64_list[1]}"}},
+                    {"type": "image_url", "image_url": {"url": image_url(image_base64_list[0], IMAGE_TRANSPORT)}},
+                    {"type": "image_url", "image_url": {"url": image_url(image_base64_list[1], IMAGE_TRANSPORT)}},
                 ],
             }
         ],
@@ -77,119 +72,106 @@ def query_vllm(image_base64_list):
         "max_tokens": 30000,
         "response_format": {"type": "json_object"}
     }
+    return payload
 
-    try:
-        response = requests.post(API_URL, json=payload, timeout=120)
-        if response.status_code != 200:
-            return "Error", {"error": response.text}
-
-        raw_content = response.json()['choices'][0]['message']['content'].strip()
-        
-        try:
-            parsed = json.loads(raw_content)
-            ans = str(parsed.get("answer", "")).strip()
-            match = re.search(r'[12]', ans)
-            clean_ans = match.group(0) if match else ans
-            thinking_data = {k: v for k, v in parsed.items() if k != "answer"}
-            
-            return clean_ans, thinking_data
-        except json.JSONDecodeError:
-            return "Parse Fail", {"raw_output": raw_content}
-
-    except Exception as e:
-        return "Exception", {"exception": str(e)}
-
-def extract_year_from_key(key_str):
-    try:
-        filename = os.path.basename(key_str)
-        idx = filename.find('_')
-        if idx != -1:
-            year_str = filename[idx + 1 : idx + 5]
-            if year_str.isdigit(): return int(year_str)
-        return None
-    except: return None
-
-def process_category(category_path):
-    cat_name = category_path.name
-    subtask_dir = category_path / "subtask1"
-    ans_path = category_path / "ans.json"
-    pic_map_path = category_path / "test.json"
-
-    if not (ans_path.exists() and pic_map_path.exists()): return
-
-    with open(ans_path, 'r') as f: ground_truth = json.load(f)
-    with open(pic_map_path, 'r') as f: name_mapping = json.load(f)
-
-    prefix = cat_name.replace("_images", "")
-    output_path = subtask_dir / f"{prefix}_subtask1_result.json"
-
-    results = []
-    correct_count = 0
-    total_processed = 0
+def parse_prediction(result):
+    # failed requests never get here, dispatch_requests dead-letters them
+    raw_content = response_content(result).strip()
+    early_stop = result["body"].get("early_stop") or {}
 
-    all_tests = sorted(ground_truth.keys(), 
-                        key=lambda x: int(re.search(r'\d+', x).group()) if re.search(r'\d+', x) else 0)
+    try:
+        parsed = json.loads(raw_content)
+        if "answer" not in parsed and early_stop.get("truncated"):
+            return "Truncated", parsed
+        ans = str(parsed.get("answer", "")).strip()
+        match = re.search(r'[12]', ans)
+        clean_ans = match.group(0) if match else ans
+        thinking_data = {k: v for k, v in parsed.items() if k != "answer"}
+
+        return clean_ans, thinking_data
+    except json.JSONDecodeError:
+        return "Parse Fail", {"raw_output": raw_content}
+
+def process_category(category, rows):
+    cat_name = f"{category}_images"
+    subtask_dir = Path(BASE_DIR) / cat_name / "subtask1"
+    if not subtask_dir.exists():
+        return
+
+    # its own result names, so a CoT run neither resumes from nor overwrites the plain shortcut results
+    output_path = subtask_dir / f"{category}_subtask1_cot_result.json"
+    checkpoint = JsonlCheckpoint(subtask_dir / f"{category}_subtask1_cot_result.jsonl", key="test_id")
 
     print(f"\nnow solving: {cat_name}")
 
-    for test_id in tqdm(all_tests, desc=f"Processing {cat_name}"):
-        current_test_files = []
-        for old_path_key, random_name_val in name_mapping.items():
-            if old_path_key.startswith(f"{test_id}/"):
-                year = extract_year_from_key(old_path_key)
-                full_path = subtask_dir / test_id / random_name_val
-                if full_path.exists() and year is not None:
-                    current_test_files.append({"year": year, "path": full_path, "orig_key": old_path_key})
-
-        if len(current_test_files) != 2: continue
+    # rows come from the compiled manifest with images already in input order
+    tests = {row["test_id"]: row for row in rows if None not in row["sizes"]}
 
-        current_test_files.sort(key=lambda x: x['year'])
-        ans_val = str(ground_truth[test_id])
-        input_order = [current_test_files[0], current_test_files[1]] if ans_val == "1" else [current_test_files[1], current_test_files[0]]
+    pending = [test_id for test_id in tests if test_id not in checkpoint.done]
+    if len(pending) < len(tests):
+        print(f"resuming: {len(tests) - len(pending)} tests already done")
+    batch_prefix = subtask_dir / f"{category}_subtask1_cot"
+    pending = select_dead_letters(pending, batch_prefix)
 
-        b64_list = [encode_image(item['path']) for item in input_order]
-        if None in b64_list: continue
+    def jobs():
+        images = ((test_id, tests[test_id]['paths']) for test_id in pending)
+        for test_id, b64_list in prefetch_images(images, transport=IMAGE_TRANSPORT, token_budget=TOKEN_BUDGET):
+            if None in b64_list:
+                yield test_id, unreadable(tests[test_id]['paths'], b64_list)
+                continue
+            yield test_id, build_payload(b64_list)
 
-        prediction, thinking_detail = query_vllm(b64_list)
+    def on_result(test_id, result):
+        test = tests[test_id]
+        prediction, thinking_detail = parse_prediction(result)
 
-        is_correct = (prediction == ans_val)
-        if is_correct: correct_count += 1
-        total_processed += 1
-
-        results.append({
+        checkpoint.append({
             "test_id": test_id,
-            "ground_truth": ans_val,
+            "ground_truth": test['ground_truth'],
             "prediction": prediction,
-            "is_correct": is_correct,
+            "is_correct": prediction == test['ground_truth'],
             "thinking_process": thinking_detail,
+            "truncated": (result["body"].get("early_stop") or {}).get("truncated", False),
             "details": {
-                "years": [item['year'] for item in input_order],
-                "files": [item['orig_key'] for item in input_order]
-            }
+                "years": test['years'],
+                "files": test['orig_keys']
+            },
+            "telemetry": result.get("telemetry")
         })
 
-        if total_processed % 5 == 0:
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(results, f, indent=4, ensure_ascii=False)
+    dispatch_requests(jobs(), API_URL, on_result, pending, batch_mode=BATCH_MODE,
+                      batch_prefix=batch_prefix,
+                      concurrency=CONCURRENCY, timeout=120, cache=RESPONSE_CACHE,
+                      stream=(lambda: EarlyStop(reasoning_budget=REASONING_BUDGET)) if STREAM else None,
+                      desc=f"Processing {cat_name}", total=len(pending))
+    checkpoint.close()
+    # an export run (or an ingest before the batch output exists) leaves no records, keep any earlier results
+    if not checkpoint.done:
+        return
+
+    correct_count = 0
+    total_processed = 0
+    truncated_count = 0
+    for record in checkpoint.records():
+        if record["is_correct"]: correct_count += 1
+        if record.get("truncated"): truncated_count += 1
+        total_processed += 1
 
     accuracy = (correct_count / total_processed * 100) if total_processed > 0 else 0
-    final_data = {
-        "summary": {
-            "category": cat_name,
-            "accuracy": f"{accuracy:.2f}%",
-            "correct": correct_count,
-            "total": total_processed
-        },
-        "results": results
+    summary = {
+        "category": cat_name,
+        "accuracy": f"{accuracy:.2f}%",
+        "correct": correct_count,
+        "total": total_processed,
+        "truncated": truncated_count
     }
-
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(final_data, f, indent=4, ensure_ascii=False)
+    checkpoint.compact(output_path, order=list(tests), header={"summary": summary})
     
     print(f" {cat_name} acc: {accuracy:.2f}%")
 
 if __name__ == "__main__":
-    base_path = Path(BASE_DIR)
-    categories = [d for d in base_path.iterdir() if d.is_dir() and d.name.endswith("_images")]
-    for cat in categories:
-        process_category(cat)
+    manifest = load_manifest(images_dir=BASE_DIR)
+    for category in task_values(manifest, "shortcut", "category"):
+        process_category(category, task_rows(manifest, "shortcut", category=category))
+    print(IMAGE_CACHE.stats())
+    print(RESPONSE_CACHE.stats())
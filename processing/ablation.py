@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import multiprocessing
+
+import numpy as np
+
+import encode_image as prep
+from image_cache import ImageCache
+from manifest import load_manifest, task_rows, IMAGES_DIR, CHA_DIR
+from scoring import load_task, unperturbed
+from load_test import run_task, build_dataset, start_mock, _free_port, _trim, RUNNERS
+
+TASKS = ("shortcut", "years", "mmt", "localization", "sort")
+# each task is subsampled per stratum so every category keeps its weight in the subset
+STRATA = {"shortcut": "category", "cot": "category", "years": "category", "mmt": "category",
+          "localization": "benchmark", "sort": "category"}
+PER_STRATUM = 20
+MAX_PIXELS = (2800000, 1003520, 401408)
+CODECS = ("jpeg", "webp", "png")
+QUALITIES = (90, 75)
+GRIDS = (prep.GRID, 1)
+BASELINE = {"max_pixels": prep.DEFAULT_MAX_PIXELS, "quality": prep.DEFAULT_QUALITY,
+            "codec": prep.DEFAULT_CODEC, "grid": prep.GRID}
+API_URL = "http://localhost:8000/v1/chat/completions"
+MODEL_NAME = "Qwen3-VL-4B-Instruct"
+
+
+def setting_name(s):
+    quality = "" if s["codec"] == "png" else f"-q{s['quality']}"
+    return f"{s['codec']}{quality}-{s['max_pixels'] / 1e6:.1f}MP-grid{s['grid']}"
+
+
+def sweep(max_pixels=MAX_PIXELS, codecs=CODECS, qualities=QUALITIES, grids=GRIDS, full=False):
+    # full: every combination; otherwise the baseline plus one factor changed at a time
+    if full:
+        combos = itertools.product(max_pixels, codecs, qualities, grids)
+        settings = [{"max_pixels": m, "codec": c, "quality": q, "grid": g} for m, c, q, g in combos]
+    else:
+        settings = [dict(BASELINE)]
+        for name, values in (("max_pixels", max_pixels), ("codec", codecs), ("quality", qualities), ("grid", grids)):
+            settings += [dict(BASELINE, **{name: value}) for value in values]
+    unique = {}
+    for s in settings:
+        if s["codec"] == "png":
+            s["quality"] = BASELINE["quality"]
+        unique.setdefault(setting_name(s), s)
+    return list(unique.values())
+
+
+def stratified_subset(manifest, tasks, per_stratum=PER_STRATUM, seed=0):
+    # the same rows for every setting, so accuracy differences come from the images alone
+    rng = np.random.default_rng(seed)
+    subset = {"tasks": dict(manifest["tasks"])}
+    for task in set(tasks) | ({"shortcut"} if "cot" in tasks else set()):
+        table = manifest["tasks"]["shortcut" if task == "cot" else task]
+        strata = np.asarray(table["columns"][STRATA[task]], dtype=object)
+        keep = []
+        for stratum in dict.fromkeys(strata.tolist()):
+            rows = np.flatnonzero(strata == stratum)
+            keep += sorted(rng.choice(rows, min(per_stratum, len(rows)), replace=False).tolist())
+        subset["tasks"]["shortcut" if task == "cot" else task] = _trim(table, sorted(keep))
+    return subset
+
+
+def _layout(manifest, tasks, images_dir, cha_dir):
+    # the output folders the runners expect; images are read from the manifest's paths wherever they live
+    os.makedirs(cha_dir, exist_ok=True)
+    for task, folder in (("shortcut", "subtask1"), ("years", "years"), ("mmt", "MMT-test")):
+        if task in tasks or (task == "shortcut" and "cot" in tasks):
+            for category in set(manifest["tasks"][task]["columns"]["category"]):
+                os.makedirs(os.path.join(images_dir, f"{category}_images", folder), exist_ok=True)
+
+
+def prep_cost(manifest, tasks, settings, cache_dir):
+    # single-process CPU seconds to prepare every subset image once; the cache is then reused by the run
+    prep.IMAGE_CACHE = ImageCache(cache_dir)
+    paths = set()
+    for task in tasks:
+        for row in task_rows(manifest, "shortcut" if task == "cot" else task):
+            paths.update(p for p in (row.get("paths") or [row.get("path")]) if p)
+    kwargs = {k: settings[k] for k in ("max_pixels", "quality", "codec", "grid")}
+    start = time.process_time()
+    encoded = sum(prep.encode_image(path, **kwargs) is not None for path in sorted(paths))
+    return time.process_time() - start, encoded
+
+
+def task_outcomes(task, manifest, images_dir, cha_dir, work_dir):
+    # (correct, telemetry) per answered item of one task's outputs, judged by processing/scoring.py
+    truth = None
+    if task == "years":
+        truth = {(row["category"], row["image_id"]): row["year"] for row in task_rows(manifest, "years")}
+    cols = load_task(task, images_dir, cha_dir,
+                     os.path.join(work_dir, "sort_ans.jsonl"), truth)
+    if task in ("shortcut", "cot"):
+        cols = unperturbed(cols)
+    return list(zip(cols["correct"].tolist(), cols["telemetry"].tolist()))
+
+
+def summarize(outcomes, prep_cpu, images, run_stats):
+    correct = np.asarray([c for c, _ in outcomes], dtype=float)
+    telemetry = [t or {} for _, t in outcomes]
+    payload = np.asarray([t.get("payload_bytes") or 0 for t in telemetry], dtype=float)
+    tokens = np.asarray([t.get("vision_tokens_est") or 0 for t in telemetry], dtype=float)
+    total = np.asarray([t["total"] for t in telemetry if t.get("total") is not None], dtype=float)
+    return {
+        "items": int(len(correct)),
+        "accuracy": float(correct.mean()) if len(correct) else None,
+        "payload_bytes": float(payload.mean()) if len(payload) else None,
+        "vision_tokens": float(tokens.mean()) if len(tokens) else None,
+        "prep_cpu_ms": 1000 * prep_cpu / images if images else None,
+        "latency_p50": float(np.percentile(total, 50)) if len(total) else None,
+        "latency_p95": float(np.percentile(total, 95)) if len(total) else None,
+        "wall_s": run_stats["wall_s"],
+    }
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return float(np.mean(values)) if values else None
+
+
+def overall(per_task):
+    return {key: _mean([m[key] for m in per_task.values()])
+            for key in ("accuracy", "payload_bytes", "vision_tokens", "prep_cpu_ms", "latency_p50")}
+
+
+COSTS = ("payload_bytes", "vision_tokens", "prep_cpu_ms", "latency_p50")
+
+
+def pareto(rows):
+    # a setting is on the front unless another is at least as accurate and no more expensive on every cost
+    values = np.asarray([[r["accuracy"] or 0.0] + [-(r[c] or 0.0) for c in COSTS] for r in rows])
+    dominated = ((values[None, :, :] >= values[:, None, :]).all(axis=2)
+                 & (values[None, :, :] > values[:, None, :]).any(axis=2)).any(axis=1)
+    return (~dominated).tolist()
+
+
+def run_ablation(settings, tasks, manifest, api_url, model, concurrency, transport, root):
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for s in settings:
+        name = setting_name(s)
+        setting_dir = os.path.join(root, name)
+        print(f"\n=== {name} ===")
+        per_task = {}
+        for task in tasks:
+            work_dir = os.path.join(setting_dir, task)
+            images_dir = os.path.join(work_dir, "images")
+            cha_dir = os.path.join(work_dir, "cha")
+            _layout(manifest, [task], images_dir, cha_dir)
+            prep_cpu, images = prep_cost(manifest, [task], s, os.path.join(work_dir, "image_cache"))
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_task, args=(task, manifest, images_dir, cha_dir, work_dir, api_url,
+                                                      concurrency, transport, queue),
+                               kwargs={"encode_settings": s, "model": model})
+            proc.start()
+            stats = queue.get()
+            proc.join()
+            outcomes = task_outcomes(task, manifest, images_dir, cha_dir, work_dir)
+            per_task[task] = summarize(outcomes, prep_cpu, images, stats)
+        results[name] = {"settings": s, "tasks": per_task, "overall": overall(per_task)}
+    return results
+
+
+def _fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def print_tables(report):
+    for model, results in report.items():
+        rows = [dict(r["overall"], name=name, tasks=r["tasks"]) for name, r in results.items()]
+        if not rows:
+            continue
+        front = pareto(rows)
+        base = results.get(setting_name(BASELINE), {}).get("overall", {}).get("accuracy")
+        tasks = list(dict.fromkeys(t for r in rows for t in r["tasks"]))
+        print(f"\n{model}  (* = Pareto front: no other setting is as accurate and cheaper on every cost)")
+        header = (f"  {'setting':<26} | {'acc':>6} | {'Δbase':>6} | " + " | ".join(f"{t[:6]:>6}" for t in tasks)
+                  + f" | {'KB/req':>7} | {'vtok/req':>8} | {'prep ms':>7} | {'p50 s':>6}")
+        print(header)
+        print("  " + "-" * (len(header) - 2))
+        order = sorted(range(len(rows)), key=lambda i: (-(rows[i]["accuracy"] or 0), rows[i]["vision_tokens"] or 0))
+        for i in order:
+            r = rows[i]
+            delta = None if base is None or r["accuracy"] is None else r["accuracy"] - base
+            task_acc = " | ".join(f"{_fmt(r['tasks'].get(t, {}).get('accuracy'), '>6.1%')}" for t in tasks)
+            kb = None if r["payload_bytes"] is None else r["payload_bytes"] / 1024
+            print(f"{'*' if front[i] else ' '} {r['name']:<26} | {_fmt(r['accuracy'], '>6.1%')} | "
+                  f"{_fmt(delta, '>+6.1%')} | {task_acc} | {_fmt(kb, '>7.0f')} | "
+                  f"{_fmt(r['vision_tokens'], '>8.0f')} | {_fmt(r['prep_cpu_ms'], '>7.1f')} | "
+                  f"{_fmt(r['latency_p50'], '>6.2f')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep image resolution, grid alignment, codec and quality over a "
+                                                 "stratified subset and report accuracy against cost per model.")
+    parser.add_argument("--tasks", nargs="+", choices=list(RUNNERS), default=list(TASKS))
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--images-dir", default=IMAGES_DIR)
+    parser.add_argument("--cha-dir", default=CHA_DIR)
+    parser.add_argument("--per-stratum", type=int, default=PER_STRATUM, help="items per category / benchmark")
+    parser.add_argument("--max-pixels", type=int, nargs="+", default=list(MAX_PIXELS))
+    parser.add_argument("--codecs", nargs="+", choices=CODECS, default=list(CODECS))
+    parser.add_argument("--qualities", type=int, nargs="+", default=list(QUALITIES))
+    parser.add_argument("--grids", type=int, nargs="+", default=list(GRIDS), help="28 aligns to the patch grid, 1 does not")
+    parser.add_argument("--full", action="store_true", help="every combination instead of one factor at a time")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--transport", choices=("base64", "file", "http"), default="base64")
+    parser.add_argument("--output", default="ablation.json", help="results accumulate here across models")
+    parser.add_argument("--report", action="store_true", help="only print the tables in --output")
+    parser.add_argument("--mock", action="store_true", help="dry run: synthetic images against a local mock server")
+    parser.add_argument("--keep", action="store_true", help="keep the per-setting outputs")
+    args = parser.parse_args()
+
+    report = {}
+    if os.path.exists(args.output):
+        with open(args.output, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    if not args.report:
+        root = tempfile.mkdtemp(prefix="chronovision_ablation_")
+        server = None
+        try:
+            if args.mock:
+                port = _free_port()
+                server = start_mock(port, "const:0.02", 0.0, 0)
+                args.api_url = f"http://127.0.0.1:{port}/v1/chat/completions"
+                manifest, _, _ = build_dataset(os.path.join(root, "data"), args.per_stratum * 4, (640, 480))
+            else:
+                manifest = load_manifest(images_dir=args.images_dir, cha_dir=args.cha_dir)
+            manifest = stratified_subset(manifest, args.tasks, args.per_stratum)
+            settings = sweep(args.max_pixels, args.codecs, args.qualities, args.grids, args.full)
+            print(f"{len(settings)} settings x {len(args.tasks)} tasks on {args.model}")
+            results = run_ablation(settings, args.tasks, manifest, args.api_url, args.model, args.concurrency,
+                                   args.transport, root)
+            report.setdefault(args.model, {}).update(results)
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=4)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+            if not args.keep:
+                shutil.rmtree(root, ignore_errors=True)
+    print_tables(report)
@@ -0,0 +1,290 @@
+import json
+import time
+import random
+import asyncio
+import aiohttp
+from tqdm import tqdm
+
+from response_cache import request_key
+from endpoint_pool import EndpointPool
+from telemetry import payload_images
+from streaming import STREAM_OPTIONS
+
+DEFAULT_CONCURRENCY = 32
+KEEPALIVE_TIMEOUT = 60
+# opt-in: let each endpoint's in-flight limit follow latency and back-pressure (processing/concurrency.py).
+# The concurrency passed in is then the starting point and, unless MAX_CONCURRENCY raises it, also the ceiling,
+# so adaptive mode only backs off from what the runner configured
+ADAPTIVE_CONCURRENCY = False
+MAX_CONCURRENCY = None
+# transient failures (timeouts, dropped connections, 429 and 5xx) are retried with full-jitter exponential backoff
+MAX_ATTEMPTS = 5
+RETRY_BASE = 1.0
+RETRY_CAP = 30.0
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+class FailedJob:
+    # yielded in place of a payload when a job could not be built, e.g. an image that failed to read or decode;
+    # nothing is sent, the job comes back as a failed result and is dead-lettered and counted like one
+    def __init__(self, reason):
+        self.reason = reason
+
+    def result(self):
+        return {"status": None, "body": None, "error": self.reason, "attempts": 0}
+
+
+def response_content(result):
+    return result["body"]['choices'][0]['message']['content']
+
+
+def failure_reason(result):
+    # None for a usable response; anything else is a failed request and must not be scored as an answer
+    if result["error"] is not None:
+        if result["status"] is not None:
+            return f"http {result['status']}: {result['error']}"
+        return result["error"]
+    try:
+        content = response_content(result)
+    except (KeyError, IndexError, TypeError):
+        return "malformed response body"
+    if content is None:
+        return "empty response"
+    return None
+
+
+def is_retryable(result):
+    return result["error"] is not None and (result["status"] is None or result["status"] in RETRY_STATUSES)
+
+
+def retry_delay(attempt, retry_after=None):
+    # full jitter: uniform over [0, base * 2^attempt], capped; a server's Retry-After is a lower bound
+    delay = random.uniform(0.0, min(RETRY_CAP, RETRY_BASE * 2 ** attempt))
+    return max(delay, retry_after or 0.0)
+
+
+def _retry_after(headers):
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+async def _read_stream(response, watcher, start):
+    # SSE chunks -> a regular chat.completion body; the watcher may end the stream early, closing the
+    # connection so the server aborts the rest of the generation
+    ttft, finish, usage = None, None, None
+    async for line in response.content:
+        line = line.strip()
+        if not line.startswith(b"data:"):
+            continue
+        data = line[len(b"data:"):].strip()
+        if data == b"[DONE]":
+            break
+        chunk = json.loads(data)
+        usage = chunk.get("usage") or usage
+        stop = False
+        for choice in chunk.get("choices") or []:
+            finish = choice.get("finish_reason") or finish
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                stop = watcher.feed(delta, (chunk.get("usage") or {}).get("completion_tokens")) or stop
+        if stop:
+            response.close()
+            break
+    content, early_stop = watcher.result(finish)
+    body = {"choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": finish or "abort"}],
+            "usage": usage, "early_stop": early_stop}
+    return body, ttft
+
+
+async def _post(session, api_url, body, timeout, stream=None):
+    # body: the request already serialized to JSON bytes; stream: None, or a factory of watchers
+    # (streaming.EarlyStop) for requests sent with "stream": true
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    start = time.perf_counter()
+    try:
+        async with session.post(api_url, data=body, headers=JSON_HEADERS, timeout=client_timeout) as response:
+            # without streaming the headers only arrive once generation is done, so this is an upper bound on TTFT
+            ttft = time.perf_counter() - start
+            if response.status != 200:
+                return {"status": response.status, "body": None, "error": await response.text(),
+                        "retry_after": _retry_after(response.headers), "ttft": ttft}
+            if stream is not None:
+                result_body, ttft = await _read_stream(response, stream(), start)
+                return {"status": 200, "body": result_body, "error": None, "ttft": ttft}
+            return {"status": 200, "body": await response.json(content_type=None), "error": None, "ttft": ttft}
+    except asyncio.TimeoutError as e:
+        return {"status": None, "body": None, "error": str(e) or type(e).__name__, "timeout": True}
+    except aiohttp.ClientConnectionError as e:
+        # the server is unreachable or went away mid-request; another endpoint may take the item
+        return {"status": None, "body": None, "error": str(e) or type(e).__name__, "connection_error": True}
+    except Exception as e:
+        return {"status": None, "body": None, "error": str(e) or type(e).__name__}
+
+
+async def _with_retries(send, payload, max_attempts):
+    for attempt in range(1, max_attempts + 1):
+        result = await send(payload)
+        result["attempts"] = attempt
+        if attempt == max_attempts or not is_retryable(result):
+            return result
+        await asyncio.sleep(retry_delay(attempt - 1, result.get("retry_after")))
+
+
+def _build_job(job_iter, stream, keyed=False):
+    # runs in a worker thread: prepares the next job (images come from the prefetch pool), serializes it and,
+    # with a response cache, computes its key (hashing every image), so none of that blocks the event loop
+    start = time.perf_counter()
+    job = next(job_iter, None)
+    if job is None:
+        return None
+    built = time.perf_counter()
+    idx, (job_id, payload) = job
+    if isinstance(payload, FailedJob):
+        return idx, job_id, payload, None, {"prep": built - start}, None
+    if stream is None:
+        body = json.dumps(payload).encode('utf-8')
+    else:
+        body = json.dumps(dict(payload, stream=True, stream_options=STREAM_OPTIONS)).encode('utf-8')
+        # early-stopped answers are only replayed for the same stopping rule
+        payload = dict(payload, early_stop=stream().spec())
+    telemetry = {"prep": built - start, "serialize": time.perf_counter() - built, "payload_bytes": len(body)}
+    telemetry.update(payload_images(payload))
+    key = request_key(payload) if keyed else None
+    return idx, job_id, payload, body, telemetry, key
+
+
+def _with_telemetry(result, telemetry, start):
+    # results can be shared between identical in-flight requests, so each job gets its own copy
+    result = dict(result)
+    body = result["body"] if isinstance(result["body"], dict) else {}
+    result["telemetry"] = dict(telemetry, ttft=result.get("ttft"), total=time.perf_counter() - start,
+                               attempts=result.get("attempts", 1), cached=result.get("cached", False),
+                               usage=body.get("usage"), early_stop=body.get("early_stop"))
+    return result
+
+
+async def _cached_post(send, payload, key, cache, inflight):
+    cached = cache.get(key)
+    if cached is not None:
+        return {"status": 200, "body": cached, "error": None, "cached": True}
+
+    # identical requests already on the wire share one response
+    if key in inflight:
+        return await asyncio.shield(inflight[key])
+
+    future = asyncio.get_running_loop().create_future()
+    inflight[key] = future
+    try:
+        result = await send()
+        if failure_reason(result) is None:
+            cache.put(key, payload.get("model"), result["body"])
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        del inflight[key]
+
+
+async def _run(jobs, api_url, concurrency, timeout, on_result, desc, total, cache, adaptive, max_attempts, stream,
+               max_concurrency):
+    results = {}
+    inflight = {}
+    job_iter = enumerate(jobs)
+    job_lock = asyncio.Lock()
+    loop = asyncio.get_running_loop()
+    pool = EndpointPool(api_url, concurrency, adaptive, max_concurrency)
+    connector = aiohttp.TCPConnector(limit=pool.max_capacity, keepalive_timeout=KEEPALIVE_TIMEOUT)
+
+    async def next_job():
+        # building a job may encode images or wait on a prefetch pool,
+        # so run it off the event loop to keep in-flight requests moving
+        async with job_lock:
+            return await loop.run_in_executor(None, _build_job, job_iter, stream, cache is not None)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        pool.start(session)
+
+        async def send(body):
+            return await _with_retries(lambda b: pool.post(lambda url, q: _post(session, url, q, timeout, stream), b),
+                                       body, max_attempts)
+
+        with tqdm(total=total, desc=desc) as pbar:
+
+            workers = []
+            exhausted = False
+
+            def grow():
+                # one worker per slot of the current limit; more are started only when an adaptive limit rises
+                while not exhausted and len(workers) < pool.capacity:
+                    workers.append(asyncio.ensure_future(worker()))
+
+            async def worker():
+                nonlocal exhausted
+                # all workers share one iterator, so jobs are only built when a slot frees up
+                while True:
+                    await pool.admit()
+                    try:
+                        job = await next_job()
+                        if job is None:
+                            exhausted = True
+                            break
+                        idx, job_id, payload, body, telemetry, key = job
+                        start = time.perf_counter()
+                        if isinstance(payload, FailedJob):
+                            result = payload.result()
+                        elif cache is None:
+                            result = await send(body)
+                        else:
+                            result = await _cached_post(lambda: send(body), payload, key, cache, inflight)
+                        result = _with_telemetry(result, telemetry, start)
+                    finally:
+                        await pool.leave()
+                    if on_result is not None:
+                        on_result(job_id, result)
+                    else:
+                        results[idx] = (job_id, result)
+                    pbar.update(1)
+                    grow()
+
+            grow()
+            try:
+                # workers started later are appended, so walk the list until every one has finished
+                i = 0
+                while i < len(workers):
+                    await workers[i]
+                    i += 1
+            finally:
+                for task in workers:
+                    task.cancel()
+                await pool.stop()
+
+    if pool.failover:
+        print(pool.stats())
+    if pool.adaptive:
+        print(pool.concurrency_summary())
+
+    return [results[idx] for idx in sorted(results)]
+
+
+def run_requests(jobs, api_url, concurrency=DEFAULT_CONCURRENCY, timeout=None, on_result=None, desc=None, total=None,
+                 cache=None, adaptive=ADAPTIVE_CONCURRENCY, max_attempts=MAX_ATTEMPTS, stream=None,
+                 max_concurrency=MAX_CONCURRENCY):
+    # jobs: iterable of (job_id, payload); returns [(job_id, result), ...] in job order,
+    # or hands each result to on_result as it completes (nothing is kept in memory then)
+    # cache: optional ResponseCache, successful responses are stored and replayed on later runs
+    # api_url: one URL, or a list of URLs / (url, weight) pairs served by replicas of the same model;
+    # concurrency then applies per endpoint (scaled by weight)
+    # adaptive: AIMD per-endpoint limits starting at concurrency and never above max_concurrency (default: concurrency)
+    # each result carries "attempts" and a "telemetry" block (prep, serialize, ttft, total seconds, payload bytes,
+    # estimated vision tokens, the server's usage); only the last attempt of a retried request is returned
+    # stream: e.g. lambda: EarlyStop(reasoning_budget=2048) to stream responses and cut them short (streaming.py)
+    return asyncio.run(_run(jobs, api_url, concurrency, timeout, on_result, desc, total, cache, adaptive,
+                            max_attempts, stream, max_concurrency))
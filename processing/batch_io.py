@@ -0,0 +1,143 @@
+import os
+import json
+from tqdm import tqdm
+
+from async_client import run_requests, failure_reason, FailedJob
+from dead_letter import DeadLetters, dead_letter_path
+from telemetry import RunTelemetry, telemetry_path, format_summary
+from server_metrics import scrape, prefix_cache_report
+
+BATCH_URL = "/v1/chat/completions"
+
+
+def custom_id(job_id):
+    # test ids, image ids and sort ids stay readable; tuples such as (test_id, condition) are joined with "/"
+    if isinstance(job_id, (tuple, list)):
+        return "/".join(str(part) for part in job_id)
+    return str(job_id)
+
+
+def batch_paths(prefix):
+    return f"{prefix}_batch_input.jsonl", f"{prefix}_batch_output.jsonl"
+
+
+def export_batch(jobs, path, total=None, desc=None, on_failed=None):
+    # jobs that could not be built (FailedJob) are not exported, on_failed(job_id, job) gets them instead
+    tmp_path = f"{path}.tmp"
+    count = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for job_id, payload in tqdm(jobs, total=total, desc=desc):
+            if isinstance(payload, FailedJob):
+                if on_failed is not None:
+                    on_failed(job_id, payload)
+                continue
+            f.write(json.dumps({
+                "custom_id": custom_id(job_id),
+                "method": "POST",
+                "url": BATCH_URL,
+                "body": payload,
+            }, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def batch_result(record):
+    # one output line -> the {"status", "body", "error"} dict run_requests produces
+    error = record.get("error")
+    response = record.get("response") or {}
+    status = response.get("status_code")
+    body = response.get("body")
+    if error:
+        return {"status": status, "body": None, "error": error.get("message") or json.dumps(error)}
+    if status != 200:
+        return {"status": status, "body": None, "error": json.dumps(body, ensure_ascii=False)}
+    return {"status": 200, "body": body, "error": None}
+
+
+def ingest_batch(path, on_result, job_ids):
+    # hands results to on_result under the original job ids; ids not pending any more are skipped
+    by_custom_id = {custom_id(job_id): job_id for job_id in job_ids}
+    ingested = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            job_id = by_custom_id.pop(record.get("custom_id"), None)
+            if job_id is None:
+                continue
+            on_result(job_id, batch_result(record))
+            ingested += 1
+    return ingested, len(by_custom_id)
+
+
+def _screen_failures(on_result, dead_letters, telemetry):
+    # failed requests go to the dead-letter file instead of on_result, so they are never scored as answers
+    def screened(job_id, result):
+        reason = failure_reason(result)
+        telemetry.add(job_id, result, failed=reason is not None)
+        if reason is None:
+            dead_letters.resolve(job_id)
+            on_result(job_id, result)
+        else:
+            dead_letters.add(job_id, result, reason)
+    return screened
+
+
+def dispatch_requests(jobs, api_url, on_result, job_ids, batch_mode=None, batch_prefix=None, desc=None, total=None,
+                      **run_kwargs):
+    # batch_mode None: online requests; "export": write an OpenAI Batch input file for `vllm run-batch`;
+    # "ingest": feed the matching output file through on_result as if the requests had just returned
+    # failures (after retries, online) and items whose images could not be read (prefetch.unreadable) are kept in
+    # {batch_prefix}_dead_letters.jsonl, see dead_letter.py
+    dead_letters = DeadLetters(dead_letter_path(batch_prefix))
+    if batch_mode == "export":
+        input_path, output_path = batch_paths(batch_prefix)
+        try:
+            count = export_batch(jobs, input_path, total=total, desc=desc,
+                                 on_failed=lambda job_id, job: dead_letters.add(job_id, job.result(), job.reason))
+        finally:
+            dead_letters.close()
+        report = dead_letters.report()
+        if report:
+            print(report)
+        print(f"exported {count} requests to {input_path}")
+        print(f"run: vllm run-batch -i {input_path} -o {output_path} --model <model>")
+        return []
+
+    telemetry = RunTelemetry(os.path.basename(str(batch_prefix)))
+    try:
+        return _dispatch(jobs, api_url, _screen_failures(on_result, dead_letters, telemetry), job_ids, batch_mode,
+                         batch_prefix, desc, total, **run_kwargs)
+    finally:
+        dead_letters.close()
+        report = dead_letters.report()
+        if report:
+            print(report)
+        # per task and category summary, kept next to the outputs for `python processing/telemetry.py`
+        summary = telemetry.summary()
+        if summary["requests"]:
+            print(format_summary(summary))
+            telemetry.save(telemetry_path(batch_prefix), summary)
+
+
+def _dispatch(jobs, api_url, on_result, job_ids, batch_mode, batch_prefix, desc, total, **run_kwargs):
+    if batch_mode is None:
+        before = scrape(api_url)
+        results = run_requests(jobs, api_url, on_result=on_result, desc=desc, total=total, **run_kwargs)
+        report = prefix_cache_report(before, scrape(api_url))
+        if report:
+            print(report)
+        return results
+
+    _, output_path = batch_paths(batch_prefix)
+    if batch_mode == "ingest":
+        if not os.path.exists(output_path):
+            print(f"no batch output at {output_path}, skipping")
+            return []
+        ingested, missing = ingest_batch(output_path, on_result, job_ids)
+        print(f"ingested {ingested} results from {output_path}, {missing} still pending")
+    else:
+        raise ValueError(f"unknown batch mode: {batch_mode}")
+    return []
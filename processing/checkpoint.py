@@ -0,0 +1,104 @@
+import os
+import json
+
+FSYNC_EVERY = 16
+
+
+def _dumps_indented(obj, level):
+    # json.dumps(indent=4) nested `level` spaces deep, first line left for the caller
+    return json.dumps(obj, indent=4, ensure_ascii=False).replace("\n", "\n" + " " * level)
+
+
+class JsonlCheckpoint:
+    def __init__(self, path, key="test_id", fsync_every=FSYNC_EVERY):
+        self.path = str(path)
+        self.key = key
+        self.fsync_every = fsync_every
+        self.done = set()
+        self._unsynced = 0
+        self._recover()
+        self.f = open(self.path, 'a', encoding='utf-8')
+
+    def _recover(self):
+        if not os.path.exists(self.path):
+            return
+        valid_end = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self.done.add(record.get(self.key))
+                valid_end += len(line)
+        # drop a half-written tail left by a crash so new records start on a clean line
+        if valid_end != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_end)
+
+    def append(self, record):
+        self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.done.add(record.get(self.key))
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        if not self.f.closed:
+            self.sync()
+            self.f.close()
+
+    def records(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def compact(self, output_path, order=(), header=None):
+        # write the classic *_result.json layout without holding every record in memory:
+        # index line offsets by key (last write wins), then copy records over in `order`
+        if not self.f.closed:
+            self.sync()
+        offsets = {}
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    offsets[json.loads(line).get(self.key)] = offset
+                offset += len(line)
+
+        ordered_keys = [k for k in order if k in offsets]
+        seen = set(ordered_keys)
+        ordered_keys += [k for k in offsets if k not in seen]
+
+        indent = 4 if header is None else 8
+        tmp_path = f"{output_path}.tmp"
+        with open(self.path, 'rb') as src, open(tmp_path, 'w', encoding='utf-8') as out:
+            if header is not None:
+                out.write("{\n")
+                for name, value in header.items():
+                    out.write(f"    {json.dumps(name)}: {_dumps_indented(value, 4)},\n")
+                out.write('    "results": ')
+
+            if not ordered_keys:
+                out.write("[]")
+            else:
+                out.write("[\n")
+                for i, key in enumerate(ordered_keys):
+                    src.seek(offsets[key])
+                    record = json.loads(src.readline())
+                    sep = ",\n" if i < len(ordered_keys) - 1 else "\n"
+                    out.write(" " * indent + _dumps_indented(record, indent) + sep)
+                out.write(" " * (indent - 4) + "]")
+
+            if header is not None:
+                out.write("\n}")
+        os.replace(tmp_path, output_path)
+        return len(ordered_keys)
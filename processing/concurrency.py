@@ -0,0 +1,111 @@
+import os
+import json
+import time
+from collections import deque, Counter
+
+import numpy as np
+
+MAX_CONCURRENCY = 256
+MIN_CONCURRENCY = 1
+# multiplicative decrease on 429/503/timeouts, gentler when only latency degrades
+BACKOFF = 0.5
+LATENCY_BACKOFF = 0.9
+# a round's p50 this many times the unloaded p50 means requests are queueing on the server
+LATENCY_TOLERANCE = 1.5
+LATENCY_WINDOW = 256
+MIN_SAMPLES = 16
+ADAPTIVE_LOG = os.path.join(os.path.expanduser("~"), ".cache", "chronovision", "concurrency_log.jsonl")
+
+
+class AimdController:
+    # additive increase / multiplicative decrease of one endpoint's in-flight limit
+    def __init__(self, name, initial, min_limit=MIN_CONCURRENCY, max_limit=MAX_CONCURRENCY, log_path=ADAPTIVE_LOG):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, initial)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.baseline = None
+        self.round_latencies = []
+        self.round_start = time.monotonic()
+        self.last_decrease = 0.0
+        self.decisions = Counter()
+        self.peak_limit = self.limit
+        self.best = (0.0, int(self.limit))
+        self.log_path = log_path
+        if log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+
+    @property
+    def current(self):
+        return int(self.limit)
+
+    def _percentiles(self, values):
+        if not values:
+            return None, None
+        p50, p95 = np.percentile(values, [50, 95])
+        return float(p50), float(p95)
+
+    def _log(self, old, reason, p50=None, p95=None, throughput=None):
+        self.decisions[reason] += 1
+        self.peak_limit = max(self.peak_limit, self.limit)
+        if not self.log_path:
+            return
+        record = {"time": time.time(), "endpoint": self.name, "from": round(old, 2), "to": round(self.limit, 2),
+                  "reason": reason, "p50": p50, "p95": p95, "throughput": throughput}
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _decrease(self, factor, reason, p50=None, p95=None, throughput=None):
+        now = time.monotonic()
+        # one back-off per latency period, a burst of 429s is a single congestion signal
+        cooldown = max(1.0, self.baseline or 0.0)
+        if now - self.last_decrease < cooldown:
+            return
+        old = self.limit
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        self.last_decrease = now
+        self.round_latencies = []
+        self.round_start = now
+        self._log(old, reason, p50, p95, throughput)
+
+    def observe(self, latency, status, timed_out):
+        if timed_out:
+            self._decrease(BACKOFF, "timeout")
+            return
+        if status in (429, 503):
+            self._decrease(BACKOFF, f"http {status}")
+            return
+        if status != 200:
+            return
+
+        self.latencies.append(latency)
+        self.round_latencies.append(latency)
+        # one round = as many completions as the current limit, roughly one latency period
+        if len(self.round_latencies) < max(self.current, MIN_SAMPLES // 2):
+            return
+
+        elapsed = time.monotonic() - self.round_start
+        throughput = len(self.round_latencies) / elapsed if elapsed > 0 else None
+        p50, p95 = self._percentiles(self.round_latencies)
+        if len(self.latencies) >= MIN_SAMPLES:
+            window_p50, _ = self._percentiles(list(self.latencies))
+            self.baseline = window_p50 if self.baseline is None else min(self.baseline, window_p50, p50)
+        if throughput is not None and throughput > self.best[0]:
+            self.best = (throughput, self.current)
+
+        if self.baseline is not None and p50 > LATENCY_TOLERANCE * self.baseline:
+            self._decrease(LATENCY_BACKOFF, "latency", p50, p95, throughput)
+        else:
+            old = self.limit
+            self.limit = min(float(self.max_limit), self.limit + 1)
+            if self.limit != old:
+                self._log(old, "increase", p50, p95, throughput)
+        self.round_latencies = []
+        self.round_start = time.monotonic()
+
+    def summary(self):
+        backoffs = ", ".join(f"{n} {reason}" for reason, n in self.decisions.items() if reason != "increase")
+        best_rate, best_limit = self.best
+        return (f"  {self.name}: limit now {self.current} (peak {int(self.peak_limit)}), "
+                f"backoffs: {backoffs or 'none'}, best {best_rate:.1f} req/s at limit {best_limit}")
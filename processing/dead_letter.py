@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import time
+import runpy
+import argparse
+from collections import Counter
+
+DEAD_LETTER_SUFFIX = "_dead_letters.jsonl"
+# set by `dead_letter.py rerun`: runners then only send the items listed in their dead-letter files
+RERUN_ONLY = False
+MAX_ERROR_CHARS = 500
+
+
+def dead_letter_path(prefix):
+    return f"{prefix}{DEAD_LETTER_SUFFIX}"
+
+
+def _key(job_id):
+    # tuples come back from JSON as lists, both serialize the same way
+    return json.dumps(job_id, ensure_ascii=False)
+
+
+def load_dead_letters(path):
+    # {key: record}, the last record per job id wins
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[_key(record["id"])] = record
+    return records
+
+
+class DeadLetters:
+    # requests that still failed after their retries; rewritten on close without the ones that have since succeeded
+    def __init__(self, path):
+        self.path = str(path)
+        self.records = load_dead_letters(self.path)
+        self.added = 0
+        self.resolved = 0
+        self.f = None
+
+    def add(self, job_id, result, reason):
+        record = {"id": job_id, "reason": reason[:MAX_ERROR_CHARS], "status": result["status"],
+                  "attempts": result.get("attempts", 1), "time": time.time()}
+        self.records[_key(job_id)] = record
+        self.added += 1
+        if self.f is None:
+            self.f = open(self.path, 'a', encoding='utf-8')
+        self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.f.flush()
+
+    def resolve(self, job_id):
+        if self.records.pop(_key(job_id), None) is not None:
+            self.resolved += 1
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        if not self.records:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in self.records.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def report(self):
+        if not self.added and not self.resolved:
+            return None
+        lines = [f"dead letters: {self.added} failed, {self.resolved} recovered, {len(self.records)} left in {self.path}"]
+        if self.records:
+            reasons = Counter(record["reason"].split("\n", 1)[0][:80] for record in self.records.values())
+            lines += [f"  {n:>6}  {reason}" for reason, n in reasons.most_common(3)]
+            lines.append(f"  re-run them with: python processing/dead_letter.py rerun {sys.argv[0]}")
+        return "\n".join(lines)
+
+
+def select_dead_letters(job_ids, prefix):
+    # with RERUN_ONLY, keep just the jobs listed in the prefix's dead-letter file
+    if not RERUN_ONLY:
+        return job_ids
+    dead = load_dead_letters(dead_letter_path(prefix))
+    selected = [job_id for job_id in job_ids if _key(job_id) in dead]
+    print(f"re-running {len(selected)} dead-lettered requests from {dead_letter_path(prefix)}")
+    return selected
+
+
+def list_dead_letters(root):
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in sorted(filenames):
+            if not name.endswith(DEAD_LETTER_SUFFIX):
+                continue
+            path = os.path.join(dirpath, name)
+            records = load_dead_letters(path)
+            total += len(records)
+            reasons = Counter(record["reason"].split("\n", 1)[0][:80] for record in records.values())
+            print(f"{path}: {len(records)}")
+            for reason, n in reasons.most_common(3):
+                print(f"  {n:>6}  {reason}")
+    print(f"{total} dead-lettered requests under {root}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect dead-lettered requests or re-run only those items.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    list_parser = sub.add_parser("list", help="summarize the dead-letter files under a directory")
+    list_parser.add_argument("root", nargs="?", default="/hd/images")
+    rerun_parser = sub.add_parser("rerun", help="run a task script on its dead-lettered items only")
+    rerun_parser.add_argument("script", help="e.g. code/shortcut/shortcut_test.py")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        list_dead_letters(args.root)
+    else:
+        # the runners import this module by name, so flip the flag there rather than on __main__
+        import dead_letter
+        dead_letter.RERUN_ONLY = True
+        script = os.path.abspath(args.script)
+        sys.argv = [script]
+        sys.path.insert(0, os.path.dirname(script))
+        runpy.run_path(script, run_name="__main__")
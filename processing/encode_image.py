@@ -1,28 +1,240 @@
-def encode_image(image_path, max_pixels=2800000):
-
-    try:
-        with Image.open(image_path) as img:
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-            
-            orig_w, orig_h = img.size
-            current_pixels = orig_w * orig_h
-            target_w, target_h = orig_w, orig_h
-            
-            if current_pixels > max_pixels:
-                scale = math.sqrt(max_pixels / current_pixels)
-                target_w = int(orig_w * scale)
-                target_h = int(orig_h * scale)
-            
-            target_w = max(28, (target_w // 28) * 28)
-            target_h = max(28, (target_h // 28) * 28)
-            
-            if (target_w, target_h) != (orig_w, orig_h):
-                img = img.resize((target_w, target_h), Image.Resampling.LANCZOS)
-            
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=90)
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
-    except Exception as e:
-        print(f"image failed: {image_path}: {e}")
-        return None
\ No newline at end of file
+import os
+import io
+import math
+import base64
+import numpy as np
+from PIL import Image, ImageFile
+
+import perturb
+from image_cache import ImageCache
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+Image.MAX_IMAGE_PIXELS = None
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+DEFAULT_MAX_PIXELS = 2800000
+DEFAULT_QUALITY = 90
+# "jpeg", "webp" or "png" (lossless, quality is ignored)
+DEFAULT_CODEC = "jpeg"
+# sizes are floored to multiples of the 28 px vision grid; 1 leaves the resize to the server
+GRID = 28
+PIL_FORMATS = {"jpeg": "JPEG", "webp": "WEBP", "png": "PNG"}
+# "pil" or "cv2" (OpenCV is built on libjpeg-turbo and is usually faster for large JPEGs)
+BACKEND = "pil"
+EXIF_ORIENTATION = 0x0112
+# pre-encoded payloads packed by processing/image_shard.py, used whenever the file exists
+SHARD_PATH = "/hd/images/chronovision_images.shard"
+
+IMAGE_CACHE = ImageCache()
+_shard = None
+
+
+def get_shard():
+    global _shard
+    if _shard is None:
+        _shard = False
+        if SHARD_PATH and os.path.exists(SHARD_PATH):
+            from image_shard import ImageShard
+            _shard = ImageShard(SHARD_PATH)
+    return _shard or None
+
+
+def target_size(orig_w, orig_h, max_pixels=DEFAULT_MAX_PIXELS, grid=GRID):
+    target_w, target_h = orig_w, orig_h
+    current_pixels = orig_w * orig_h
+
+    if current_pixels > max_pixels:
+        scale = math.sqrt(max_pixels / current_pixels)
+        target_w = int(orig_w * scale)
+        target_h = int(orig_h * scale)
+
+    target_w = max(grid, (target_w // grid) * grid)
+    target_h = max(grid, (target_h // grid) * grid)
+    return target_w, target_h
+
+
+def can_passthrough(img, max_pixels=DEFAULT_MAX_PIXELS, codec=DEFAULT_CODEC, grid=GRID):
+    # a JPEG that is already within budget and on the grid would only lose quality by re-encoding
+    if codec != "jpeg" or img.format != "JPEG" or img.mode not in ("RGB", "L"):
+        return False
+    if img.getexif().get(EXIF_ORIENTATION, 1) != 1:
+        return False
+    return target_size(*img.size, max_pixels, grid) == img.size
+
+
+def _save_pil(img, codec, quality):
+    buffer = io.BytesIO()
+    if codec == "png":
+        img.save(buffer, format="PNG")
+    else:
+        img.save(buffer, format=PIL_FORMATS[codec], quality=quality)
+    return buffer.getvalue()
+
+
+def _resized_pil(img, max_pixels, grid=GRID):
+    target = target_size(*img.size, max_pixels, grid)
+
+    if img.format == "JPEG" and target != img.size:
+        # let libjpeg decode at 1/2, 1/4 or 1/8 scale, never below the target size
+        img.draft(None, target)
+
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    if img.size != target:
+        img = img.resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    return img
+
+
+def _prepare_pil(image_path, max_pixels, quality, codec=DEFAULT_CODEC, grid=GRID):
+    with Image.open(image_path) as img:
+        return _save_pil(_resized_pil(img, max_pixels, grid), codec, quality)
+
+
+def _resized_cv2(image_path, max_pixels, grid=GRID):
+    with Image.open(image_path) as img:
+        orig_w, orig_h = img.size
+    target_w, target_h = target_size(orig_w, orig_h, max_pixels, grid)
+
+    flags = cv2.IMREAD_COLOR
+    for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                            (4, cv2.IMREAD_REDUCED_COLOR_4),
+                            (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if orig_w // factor >= target_w and orig_h // factor >= target_h:
+            flags = reduced
+            break
+
+    raw_data = np.fromfile(image_path, dtype=np.uint8)
+    # PIL ignores EXIF orientation, keep both backends producing the same pixels
+    img = cv2.imdecode(raw_data, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is None:
+        raise ValueError("cv2 could not decode the image")
+
+    if (img.shape[1], img.shape[0]) != (target_w, target_h):
+        img = cv2.resize(img, (target_w, target_h), interpolation=cv2.INTER_AREA)
+    return img
+
+
+def _prepare_cv2(image_path, max_pixels, quality, codec=DEFAULT_CODEC, grid=GRID):
+    img = _resized_cv2(image_path, max_pixels, grid)
+    if codec == "webp":
+        success, enc_data = cv2.imencode(".webp", img, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    elif codec == "png":
+        success, enc_data = cv2.imencode(".png", img)
+    else:
+        success, enc_data = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        raise ValueError("cv2 could not encode the image")
+    return enc_data.tobytes()
+
+
+def load_pixels(image_path, max_pixels=DEFAULT_MAX_PIXELS, backend=BACKEND, grid=GRID):
+    # the RGB array encode_image would compress, as uint8 HxWx3
+    if _resolve_backend(backend) == "cv2":
+        return cv2.cvtColor(_resized_cv2(image_path, max_pixels, grid), cv2.COLOR_BGR2RGB)
+    with Image.open(image_path) as img:
+        return np.asarray(_resized_pil(img, max_pixels, grid))
+
+
+def _resolve_backend(backend):
+    return "pil" if backend == "cv2" and cv2 is None else backend
+
+
+def _cache_key(image_path, max_pixels, quality, backend, transform=None, codec=DEFAULT_CODEC, grid=GRID):
+    name = f"{codec}-{backend}" if grid == GRID else f"{codec}-{backend}-grid{grid}"
+    if transform:
+        name = f"{name}|{transform}"
+    return IMAGE_CACHE.key(image_path, max_pixels, quality, name)
+
+
+def encode_image_bytes(image_path, max_pixels=DEFAULT_MAX_PIXELS, quality=DEFAULT_QUALITY, backend=BACKEND,
+                       codec=DEFAULT_CODEC, grid=GRID):
+    backend = _resolve_backend(backend)
+
+    with Image.open(image_path) as img:
+        if can_passthrough(img, max_pixels, codec, grid):
+            with open(image_path, 'rb') as f:
+                return f.read()
+
+    cache_key = _cache_key(image_path, max_pixels, quality, backend, codec=codec, grid=grid)
+    cached = IMAGE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    if backend == "cv2":
+        data = _prepare_cv2(image_path, max_pixels, quality, codec, grid)
+    else:
+        data = _prepare_pil(image_path, max_pixels, quality, codec, grid)
+    IMAGE_CACHE.put(cache_key, data)
+    return data
+
+
+def encode_perturbed_batch(image_paths, transform, max_pixels=DEFAULT_MAX_PIXELS, quality=DEFAULT_QUALITY,
+                           backend=BACKEND, codec=DEFAULT_CODEC, grid=GRID):
+    # one (cache key, encoded bytes) per path, or None on failure; cache misses are perturbed together
+    backend = _resolve_backend(backend)
+    results = [None] * len(image_paths)
+    missing = []
+    for i, image_path in enumerate(image_paths):
+        try:
+            cache_key = _cache_key(image_path, max_pixels, quality, backend, transform, codec, grid)
+            cached = IMAGE_CACHE.get(cache_key)
+            if cached is not None:
+                results[i] = (cache_key, cached)
+            else:
+                missing.append((i, cache_key, load_pixels(image_path, max_pixels, backend, grid)))
+        except Exception as e:
+            print(f"image failed: {image_path}: {e}")
+
+    if missing:
+        perturbed = perturb.apply_batch([pixels for _, _, pixels in missing], transform,
+                                        keys=[cache_key for _, cache_key, _ in missing])
+        for (i, cache_key, _), pixels in zip(missing, perturbed):
+            data = _save_pil(Image.fromarray(pixels), codec, quality)
+            IMAGE_CACHE.put(cache_key, data)
+            results[i] = (cache_key, data)
+    return results
+
+
+def encode_image(image_path, max_pixels=DEFAULT_MAX_PIXELS, quality=DEFAULT_QUALITY, backend=BACKEND, transform=None,
+                 codec=DEFAULT_CODEC, grid=GRID):
+    try:
+        if transform:
+            result = encode_perturbed_batch([image_path], transform, max_pixels, quality, backend, codec, grid)[0]
+            return None if result is None else base64.b64encode(result[1]).decode('utf-8')
+
+        # the shard only holds grid-aligned JPEGs
+        shard = get_shard() if codec == "jpeg" and grid == GRID else None
+        if shard is not None:
+            view = shard.get(image_path, max_pixels, quality)
+            if view is not None:
+                return base64.b64encode(view).decode('utf-8')
+
+        data = encode_image_bytes(image_path, max_pixels, quality, backend, codec, grid)
+        return base64.b64encode(data).decode('utf-8')
+    except Exception as e:
+        print(f"image failed: {image_path}: {e}")
+        return None
+
+
+def prepared_image_path(image_path, max_pixels=DEFAULT_MAX_PIXELS, quality=DEFAULT_QUALITY, backend=BACKEND,
+                        transform=None, codec=DEFAULT_CODEC, grid=GRID):
+    # an image file on disk holding exactly the payload encode_image would send
+    try:
+        if transform:
+            result = encode_perturbed_batch([image_path], transform, max_pixels, quality, backend, codec, grid)[0]
+            return None if result is None else IMAGE_CACHE.path(result[0])
+
+        backend = _resolve_backend(backend)
+        with Image.open(image_path) as img:
+            if can_passthrough(img, max_pixels, codec, grid):
+                return os.path.abspath(image_path)
+        encode_image_bytes(image_path, max_pixels, quality, backend, codec, grid)
+        return IMAGE_CACHE.path(_cache_key(image_path, max_pixels, quality, backend, codec=codec, grid=grid))
+    except Exception as e:
+        print(f"image failed: {image_path}: {e}")
+        return None
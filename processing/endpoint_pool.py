@@ -0,0 +1,202 @@
+import time
+import asyncio
+import aiohttp
+from urllib.parse import urlsplit
+
+from concurrency import AimdController, MAX_CONCURRENCY
+
+HEALTH_INTERVAL = 5
+HEALTH_TIMEOUT = 5
+# consecutive failed health checks before an endpoint stops receiving work
+HEALTH_FAILURES = 2
+
+
+def parse_endpoints(api_url):
+    # "http://a:8000/v1/chat/completions", a list of such URLs, or a list of (url, weight) pairs
+    if isinstance(api_url, str):
+        return [(api_url, 1.0)]
+    return [(e, 1.0) if isinstance(e, str) else (e[0], float(e[1])) for e in api_url]
+
+
+def health_url(api_url):
+    parts = urlsplit(api_url)
+    return f"{parts.scheme}://{parts.netloc}/health"
+
+
+class Endpoint:
+    def __init__(self, url, weight, limit, adaptive=False, max_limit=None):
+        self.url = url
+        self.weight = weight
+        self.fixed_limit = limit
+        # with adaptive concurrency the limit follows an AIMD controller instead of staying fixed,
+        # never above max_limit (the configured limit unless the caller raised it)
+        self.controller = AimdController(url, limit, max_limit=max(limit, max_limit or limit)) if adaptive else None
+        self.outstanding = 0
+        self.healthy = True
+        self.failed_checks = 0
+        self.down = asyncio.Event()
+        self.completed = 0
+        self.failures = 0
+        self.drained = 0
+
+    @property
+    def limit(self):
+        return self.controller.current if self.controller else self.fixed_limit
+
+    @property
+    def max_limit(self):
+        return self.controller.max_limit if self.controller else self.fixed_limit
+
+
+class EndpointPool:
+    def __init__(self, api_url, concurrency, adaptive=False, max_concurrency=None):
+        # concurrency is per endpoint at weight 1 (the starting point when adaptive), so adding replicas adds capacity;
+        # max_concurrency, also per endpoint at weight 1, is the adaptive ceiling (capped at MAX_CONCURRENCY)
+        ceiling = min(max_concurrency, MAX_CONCURRENCY) if max_concurrency else None
+        self.endpoints = [Endpoint(url, weight, max(1, round(concurrency * weight)), adaptive,
+                                   max(1, round(ceiling * weight)) if ceiling else None)
+                          for url, weight in parse_endpoints(api_url)]
+        self.adaptive = adaptive
+        self.changed = asyncio.Condition()
+        self.admitted = 0
+        self._health_task = None
+
+    @property
+    def capacity(self):
+        return sum(e.limit for e in self.endpoints)
+
+    @property
+    def max_capacity(self):
+        return sum(e.max_limit for e in self.endpoints)
+
+    async def admit(self):
+        # callers wait here before building a request, so payloads are not prepared for slots that do not exist yet
+        async with self.changed:
+            while self.admitted >= self.capacity:
+                await self.changed.wait()
+            self.admitted += 1
+
+    async def leave(self):
+        async with self.changed:
+            self.admitted -= 1
+            self.changed.notify_all()
+
+    @property
+    def failover(self):
+        # a lone endpoint is never taken out of rotation, there is nowhere to drain to
+        return len(self.endpoints) > 1
+
+    async def acquire(self):
+        # None when every endpoint is down: the caller fails the attempt, so the item goes through retry and
+        # dead-letter handling while the health loop keeps probing the downed endpoints
+        async with self.changed:
+            while True:
+                if not any(e.healthy for e in self.endpoints):
+                    return None
+                candidates = [e for e in self.endpoints if e.healthy and e.outstanding < e.limit]
+                if candidates:
+                    # least outstanding requests relative to weight
+                    endpoint = min(candidates, key=lambda e: (e.outstanding + 1) / e.weight)
+                    endpoint.outstanding += 1
+                    return endpoint
+                await self.changed.wait()
+
+    async def release(self, endpoint):
+        async with self.changed:
+            endpoint.outstanding -= 1
+            self.changed.notify_all()
+
+    async def mark_down(self, endpoint, reason):
+        if not self.failover or not endpoint.healthy:
+            return
+        async with self.changed:
+            endpoint.healthy = False
+            endpoint.down.set()
+            self.changed.notify_all()
+        print(f"\nendpoint down: {endpoint.url} ({reason}), draining to the others")
+
+    async def mark_up(self, endpoint):
+        if endpoint.healthy:
+            return
+        async with self.changed:
+            endpoint.healthy = True
+            endpoint.failed_checks = 0
+            endpoint.down = asyncio.Event()
+            self.changed.notify_all()
+        print(f"\nendpoint back up: {endpoint.url}")
+
+    async def _check(self, session, endpoint):
+        try:
+            timeout = aiohttp.ClientTimeout(total=HEALTH_TIMEOUT)
+            async with session.get(health_url(endpoint.url), timeout=timeout) as response:
+                ok = response.status == 200
+        except Exception:
+            ok = False
+        if ok:
+            await self.mark_up(endpoint)
+            return
+        endpoint.failed_checks += 1
+        if endpoint.failed_checks >= HEALTH_FAILURES:
+            await self.mark_down(endpoint, "health check failed")
+
+    async def _health_loop(self, session):
+        while True:
+            await asyncio.gather(*(self._check(session, e) for e in self.endpoints))
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+    def start(self, session):
+        if self.failover:
+            self._health_task = asyncio.ensure_future(self._health_loop(session))
+
+    async def stop(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+
+    async def post(self, send, payload):
+        # send(url, payload) -> result dict; requests stuck on an endpoint that goes down are re-sent elsewhere
+        attempts = 0
+        while True:
+            attempts += 1
+            endpoint = await self.acquire()
+            if endpoint is None:
+                return {"status": None, "body": None, "error": "no healthy endpoint", "connection_error": True}
+            start = time.monotonic()
+            request = asyncio.ensure_future(send(endpoint.url, payload))
+            down = asyncio.ensure_future(endpoint.down.wait())
+            try:
+                await asyncio.wait({request, down}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                down.cancel()
+                drained = not request.done()
+                if drained:
+                    request.cancel()
+                elif endpoint.controller is not None and not request.cancelled():
+                    result = request.result()
+                    endpoint.controller.observe(time.monotonic() - start, result["status"], result.get("timeout", False))
+                await self.release(endpoint)
+
+            if drained:
+                endpoint.drained += 1
+                continue
+            result = request.result()
+            if result.get("connection_error") and self.failover and attempts < 3 * len(self.endpoints):
+                endpoint.failures += 1
+                await self.mark_down(endpoint, result["error"])
+                continue
+            endpoint.completed += 1
+            return result
+
+    def stats(self):
+        lines = []
+        for e in self.endpoints:
+            state = "up" if e.healthy else "down"
+            lines.append(f"  {e.url} (weight {e.weight:g}, {state}): {e.completed} done, "
+                         f"{e.failures} connection failures, {e.drained} drained")
+        return "endpoint pool:\n" + "\n".join(lines)
+
+    def concurrency_summary(self):
+        return "adaptive concurrency:\n" + "\n".join(e.controller.summary() for e in self.endpoints if e.controller)
@@ -1,55 +1,177 @@
-import cv2
-import os
-import numpy as np
-from tqdm import tqdm
-
-def cv2_imread_safe(file_path):
-    raw_data = np.fromfile(file_path, dtype=np.uint8)
-    img = cv2.imdecode(raw_data, cv2.IMREAD_COLOR)
-    return img
-
-def cv2_imwrite_safe(file_path, img):
-    file_ext = os.path.splitext(file_path)[1]
-    success, enc_data = cv2.imencode(file_ext, img)
-
-    if success:
-        enc_data.tofile(file_path)
-    else:
-        print(f"保存失败: {file_path}")
-
-def convert_specific_folder():
-    input_folder = r"your subfolder with color images"
-    output_folder = r"your final subfolder with greyscale images"
-
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    valid_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff')
-    file_list = [f for f in os.listdir(input_folder) if f.lower().endswith(valid_extensions)]
-
-    print(f"tot: {len(file_list)} images")
-
-    for filename in tqdm(file_list, desc="now"):
-        src_path = os.path.join(input_folder, filename)
-        dst_path = os.path.join(output_folder, filename)
-        img = cv2_imread_safe(src_path)
-
-        if img is None:
-            print(f"failed to open the image: {filename}")
-            continue
-
-        try:
-            img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            img_bw_3ch = cv2.cvtColor(img_gray, cv2.COLOR_GRAY2BGR)
-
-            cv2_imwrite_safe(dst_path, img_bw_3ch)
-
-        except Exception as e:
-            print(f"failed: {filename}: {e}")
-
-    print("-" * 30)
-    print("OK!")
-
-
-if __name__ == "__main__":
-    convert_specific_folder()
\ No newline at end of file
+import cv2
+import os
+import json
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from PIL import Image
+
+from image_cache import file_digest
+from encode_image import target_size
+
+VALID_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff')
+INDEX_NAME = ".greyscale_index.json"
+WORKERS = max(1, (os.cpu_count() or 2) - 1)
+REDUCED_GRAYSCALE = ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+                     (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                     (2, cv2.IMREAD_REDUCED_GRAYSCALE_2))
+
+
+def cv2_imread_safe(file_path, flags=cv2.IMREAD_COLOR):
+    raw_data = np.fromfile(file_path, dtype=np.uint8)
+    img = cv2.imdecode(raw_data, flags)
+    return img
+
+
+def cv2_imwrite_safe(file_path, img):
+    file_ext = os.path.splitext(file_path)[1]
+    success, enc_data = cv2.imencode(file_ext, img)
+
+    if success:
+        enc_data.tofile(file_path)
+    else:
+        print(f"保存失败: {file_path}")
+    return success
+
+
+def read_greyscale(file_path, max_pixels=None):
+    # decode straight to one channel; when the output is downscaled anyway let libjpeg skip the detail
+    if not max_pixels:
+        return cv2_imread_safe(file_path, cv2.IMREAD_GRAYSCALE)
+
+    with Image.open(file_path) as header:
+        orig_w, orig_h = header.size
+    target_w, target_h = target_size(orig_w, orig_h, max_pixels)
+
+    flags = cv2.IMREAD_GRAYSCALE
+    for factor, reduced in REDUCED_GRAYSCALE:
+        if orig_w // factor >= target_w and orig_h // factor >= target_h:
+            flags = reduced
+            break
+    img = cv2_imread_safe(file_path, flags)
+    if img is None:
+        return None
+
+    # OpenCV applies the EXIF rotation, the header size does not
+    if (img.shape[1] > img.shape[0]) != (target_w > target_h):
+        target_w, target_h = target_h, target_w
+    if (img.shape[1], img.shape[0]) != (target_w, target_h):
+        img = cv2.resize(img, (target_w, target_h), interpolation=cv2.INTER_AREA)
+    return img
+
+
+def _signature(src_path, check, max_pixels, single_channel):
+    if check == "hash":
+        source = file_digest(src_path)
+    else:
+        stat = os.stat(src_path)
+        source = f"{stat.st_size}:{stat.st_mtime_ns}"
+    return f"{source}|{max_pixels or 0}|{'1ch' if single_channel else '3ch'}"
+
+
+def _convert(job):
+    rel_path, src_path, dst_path, known, check, max_pixels, single_channel = job
+    try:
+        signature = _signature(src_path, check, max_pixels, single_channel)
+        if known == signature and os.path.exists(dst_path):
+            return rel_path, signature, "skipped"
+
+        img_gray = read_greyscale(src_path, max_pixels)
+        if img_gray is None:
+            print(f"failed to open the image: {src_path}")
+            return rel_path, None, "failed"
+
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        out = img_gray if single_channel else cv2.cvtColor(img_gray, cv2.COLOR_GRAY2BGR)
+        if not cv2_imwrite_safe(dst_path, out):
+            return rel_path, None, "failed"
+        return rel_path, signature, "converted"
+    except Exception as e:
+        print(f"failed: {src_path}: {e}")
+        return rel_path, None, "failed"
+
+
+def _init_worker():
+    # one decode per process, OpenCV's own thread pool would only oversubscribe the cores
+    cv2.setNumThreads(1)
+
+
+def _load_index(index_path):
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def _save_index(index_path, index):
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, index_path)
+
+
+def find_images(input_root):
+    file_list = []
+    for root, dirs, files in os.walk(input_root):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(VALID_EXTENSIONS):
+                file_list.append(os.path.relpath(os.path.join(root, name), input_root))
+    return file_list
+
+
+def build_greyscale(input_root, output_root, max_pixels=None, single_channel=False, check="mtime",
+                    workers=WORKERS, force=False):
+    os.makedirs(output_root, exist_ok=True)
+    index_path = os.path.join(output_root, INDEX_NAME)
+    index = {} if force else _load_index(index_path)
+
+    file_list = find_images(input_root)
+    print(f"tot: {len(file_list)} images")
+
+    jobs = [(rel, os.path.join(input_root, rel), os.path.join(output_root, rel), index.get(rel),
+             check, max_pixels, single_channel) for rel in file_list]
+    counts = {"converted": 0, "skipped": 0, "failed": 0}
+    start = time.time()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            results = pool.map(_convert, jobs, chunksize=16)
+            for rel_path, signature, status in tqdm(results, total=len(jobs), desc="now"):
+                counts[status] += 1
+                if signature is None:
+                    index.pop(rel_path, None)
+                else:
+                    index[rel_path] = signature
+    finally:
+        _save_index(index_path, index)
+
+    elapsed = time.time() - start
+    print("-" * 30)
+    print(f"converted {counts['converted']}, up to date {counts['skipped']}, failed {counts['failed']}")
+    print(f"{elapsed:.1f}s, {counts['converted'] / elapsed if elapsed else 0:.1f} images/s converted, "
+          f"{len(jobs) / elapsed if elapsed else 0:.1f} images/s scanned")
+    print("OK!")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mirror a tree of color images as grayscale, in parallel and incrementally.")
+    parser.add_argument("input", help="color image tree, e.g. the SPEED images directory")
+    parser.add_argument("output", help="grayscale tree, created with the same layout")
+    parser.add_argument("--max-pixels", type=int, default=None,
+                        help="downscale like processing/encode_image.py (e.g. 2800000) and decode at reduced size")
+    parser.add_argument("--single-channel", action="store_true",
+                        help="write 1-channel images instead of gray replicated over 3 channels")
+    parser.add_argument("--check", choices=("mtime", "hash"), default="mtime",
+                        help="how to decide that an existing output is up to date")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--force", action="store_true", help="ignore the index and rebuild everything")
+    args = parser.parse_args()
+
+    build_greyscale(args.input, args.output, args.max_pixels, args.single_channel, args.check,
+                    args.workers, args.force)
@@ -0,0 +1,49 @@
+# vLLM constrained decoding fields: "structured_outputs" for vLLM >= 0.10.2 (which Qwen3-VL needs anyway),
+# "guided" for the older top-level guided_choice / guided_regex / guided_json
+GUIDED_API = "structured_outputs"
+# 1900-2025, the range get_acc_news.py accepts
+YEAR_PATTERN = r"(19[0-9]{2}|20[01][0-9]|202[0-5])"
+
+
+def _constraint(kind, value, max_tokens, api):
+    if api == "guided":
+        fields = {f"guided_{kind}": value}
+    elif api == "structured_outputs":
+        fields = {"structured_outputs": {kind: value}}
+    else:
+        raise ValueError(f"unknown guided decoding api: {api}")
+    # the constraint leaves a handful of legal tokens, a tight cap stops anything past them
+    fields["max_tokens"] = max_tokens
+    return fields
+
+
+def choice(options, max_tokens=16, api=GUIDED_API):
+    return _constraint("choice", list(options), max_tokens, api)
+
+
+def regex(pattern, max_tokens=8, api=GUIDED_API):
+    return _constraint("regex", pattern, max_tokens, api)
+
+
+def json_schema(schema, max_tokens=64, api=GUIDED_API):
+    return _constraint("json", schema, max_tokens, api)
+
+
+def order_schema(n):
+    # {"ans": "1, 2, 0, 3, 4"}: n 0-based image indices separated by ", ", as the sort prompt asks
+    # (a permutation is checked when scoring)
+    item = f"[0-{n - 1}]" if n <= 10 else "[0-9]+"
+    return {
+        "type": "object",
+        "properties": {"ans": {"type": "string", "pattern": f"^{item}(, {item}){{{n - 1}}}$"}},
+        "required": ["ans"],
+        "additionalProperties": False,
+    }
+
+
+def apply(payload, constraint):
+    # constrained decoding replaces free-form JSON mode, vLLM rejects requests that ask for both
+    payload.pop("response_format", None)
+    payload.update(constraint)
+    return payload
+
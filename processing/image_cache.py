@@ -0,0 +1,108 @@
+import os
+import hashlib
+import tempfile
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "chronovision", "images")
+MAX_CACHE_BYTES = 20 * 1024 ** 3
+# bump when the encoding pipeline changes so stale payloads are not reused
+CACHE_VERSION = 1
+
+
+def file_digest(image_path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ImageCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._digests = {}
+        self._size = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def digest(self, image_path):
+        # hashing is much cheaper than decoding, but still skip it when the file is unchanged
+        st = os.stat(image_path)
+        stat_key = (os.path.abspath(image_path), st.st_size, st.st_mtime_ns)
+        if stat_key not in self._digests:
+            self._digests[stat_key] = file_digest(image_path)
+        return self._digests[stat_key]
+
+    def key(self, image_path, max_pixels, quality, codec):
+        raw = f"v{CACHE_VERSION}|{self.digest(image_path)}|{max_pixels}|{quality}|{codec.lower()}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        # mtime doubles as the LRU timestamp
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write-then-rename so concurrent workers never read a partial payload
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        if self._size is None:
+            self._size = self._scan_size()
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, target_ratio=0.9):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * target_ratio
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+        self._size = total
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0
+        return f"image cache: {self.hits} hits / {self.misses} misses ({rate:.1%} hit rate)"
@@ -0,0 +1,145 @@
+import os
+import json
+import mmap
+import time
+import struct
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import encode_image as prep
+from manifest import load_manifest, IMAGES_DIR, CHA_DIR
+
+SHARD_NAME = "chronovision_images.shard"
+MAGIC = b"CVSHARD1"
+# footer: index offset, index length, magic
+FOOTER = struct.Struct("<QQ8s")
+# parallel stat calls when a shard is opened, so a network mount's round trips overlap
+VALIDATE_WORKERS = 32
+
+
+def shard_key(image_path, max_pixels, quality):
+    return f"{os.path.abspath(image_path)}|{max_pixels}|{quality}"
+
+
+def _file_state(image_path):
+    # size and mtime of the source image; an entry is only served while they still match
+    try:
+        st = os.stat(image_path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def manifest_image_paths(manifest):
+    paths = []
+    for table in manifest["tasks"].values():
+        columns = table["columns"]
+        if "paths" in columns:
+            paths.extend(p for row in columns["paths"] for p in row if p)
+        elif "path" in columns:
+            paths.extend(p for p in columns["path"] if p)
+    return sorted({p for p in paths if os.path.exists(p)})
+
+
+def _encode(job):
+    path, max_pixels, quality = job
+    try:
+        # stat first, so an image replaced while it is being encoded reads as stale rather than current
+        state = _file_state(path)
+        if state is None:
+            raise OSError("cannot stat")
+        return prep.encode_image_bytes(path, max_pixels, quality), state
+    except Exception as e:
+        print(f"image failed: {path}: {e}")
+        return None, None
+
+
+def build_shard(image_paths, output_path, levels=(prep.DEFAULT_MAX_PIXELS,), quality=prep.DEFAULT_QUALITY,
+                workers=None):
+    jobs = [(path, max_pixels, quality) for path in image_paths for max_pixels in levels]
+    index = {}
+    tmp_path = f"{output_path}.tmp"
+    start = time.time()
+    with open(tmp_path, 'wb') as out, ProcessPoolExecutor(max_workers=workers) as pool:
+        out.write(MAGIC)
+        for job, (data, state) in zip(jobs, pool.map(_encode, jobs, chunksize=8)):
+            if data is None:
+                continue
+            index[shard_key(*job)] = [out.tell(), len(data)] + state
+            out.write(data)
+
+        index_bytes = json.dumps({"quality": quality, "levels": list(levels), "entries": index}).encode('utf-8')
+        index_offset = out.tell()
+        out.write(index_bytes)
+        out.write(FOOTER.pack(index_offset, len(index_bytes), MAGIC))
+    os.replace(tmp_path, output_path)
+    print(f"packed {len(index)} payloads from {len(image_paths)} images "
+          f"into {output_path} ({os.path.getsize(output_path) / 1024 ** 2:.1f} MB, {time.time() - start:.1f}s)")
+
+
+class ImageShard:
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'rb')
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        index_offset, index_length, magic = FOOTER.unpack(self.mm[-FOOTER.size:])
+        if magic != MAGIC or self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not an image shard")
+        index = json.loads(self.mm[index_offset:index_offset + index_length])
+        self.levels = index["levels"]
+        self.quality = index["quality"]
+        self.entries, self.stale = self._validate(index["entries"])
+        if self.stale:
+            print(f"image shard {path}: {self.stale} entries skipped, their source images changed since packing")
+        self.view = memoryview(self.mm)
+
+    @staticmethod
+    def _validate(entries):
+        # one stat per source image, once when the shard is opened, instead of one per lookup; entries whose image
+        # changed since packing (or from shards built without size/mtime) are dropped and re-encoded on demand
+        sources = {}
+        for key, entry in entries.items():
+            sources.setdefault(key.rsplit("|", 2)[0], []).append(key)
+        with ThreadPoolExecutor(max_workers=VALIDATE_WORKERS) as pool:
+            states = dict(zip(sources, pool.map(_file_state, sources)))
+        valid, stale = {}, 0
+        for source, keys in sources.items():
+            for key in keys:
+                entry = entries[key]
+                if len(entry) >= 4 and states[source] == entry[2:4]:
+                    valid[key] = entry
+                else:
+                    stale += 1
+        return valid, stale
+
+    def get(self, image_path, max_pixels=prep.DEFAULT_MAX_PIXELS, quality=prep.DEFAULT_QUALITY):
+        # zero-copy slice of the mapped file, or None if this image/level was not packed or was found stale on open
+        entry = self.entries.get(shard_key(image_path, max_pixels, quality))
+        if entry is None:
+            return None
+        offset, length = entry[:2]
+        return self.view[offset:offset + length]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        self.view.release()
+        self.mm.close()
+        self.f.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack every benchmark image, pre-encoded, into one memory-mappable shard.")
+    parser.add_argument("--images-dir", default=IMAGES_DIR)
+    parser.add_argument("--cha-dir", default=CHA_DIR)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--levels", type=int, nargs="+", default=[prep.DEFAULT_MAX_PIXELS],
+                        help="max_pixels for each resolution level to pack")
+    parser.add_argument("--quality", type=int, default=prep.DEFAULT_QUALITY)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    manifest = load_manifest(images_dir=args.images_dir, cha_dir=args.cha_dir)
+    output = args.output or os.path.join(args.images_dir, SHARD_NAME)
+    build_shard(manifest_image_paths(manifest), output, args.levels, args.quality, args.workers)
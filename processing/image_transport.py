@@ -0,0 +1,160 @@
+import os
+import base64
+import hashlib
+import threading
+from io import BytesIO
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import quote, unquote, urlsplit
+
+from PIL import Image
+
+import encode_image as prep
+
+# "base64": inline data URLs (works everywhere, ~33% larger payloads)
+# "file":   file:// URLs, needs `vllm serve --allowed-local-media-path` covering the images and the image cache
+# "http":   URLs served by a small static server started inside this process
+TRANSPORT = "base64"
+# loopback only by default; for a vLLM server on another machine set HTTP_BIND = "0.0.0.0" (or that interface's
+# address) and HTTP_PUBLIC_HOST to the address it reaches this machine on
+HTTP_BIND = "127.0.0.1"
+HTTP_PORT = 0
+# host name the vLLM server uses to reach this machine
+HTTP_PUBLIC_HOST = "127.0.0.1"
+# base64 characters decoded to find a JPEG's size; the SOF marker sits well inside this unless EXIF is huge
+HEADER_CHARS = 64 * 1024
+
+_server = None
+_server_lock = threading.Lock()
+_served_files = {}
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        token = self.path.lstrip('/').split('/', 1)[0]
+        path = _served_files.get(token)
+        if path is None or not os.path.exists(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", media_type(data[:16]))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_image_server(bind=HTTP_BIND, port=HTTP_PORT):
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((bind, port), _ImageHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+            print(f"serving benchmark images on port {_server.server_address[1]}")
+    return _server
+
+
+def stop_image_server():
+    global _server
+    with _server_lock:
+        if _server is not None:
+            _server.shutdown()
+            _server.server_close()
+            _server = None
+
+
+def prepare_image(image_path, transport=TRANSPORT, **encode_kwargs):
+    # runs in prefetch workers: base64 text for inline transport, otherwise a prepared JPEG on disk
+    if transport == "base64":
+        return prep.encode_image(image_path, **encode_kwargs)
+    return prep.prepared_image_path(image_path, **encode_kwargs)
+
+
+def prepare_images(entries, transport=TRANSPORT, **encode_kwargs):
+    # entries: image paths, or (path, transform) pairs for perturbed copies (see processing/perturb.py),
+    # optionally (path, transform, max_pixels) with a per-image cap (see processing/token_budget.py);
+    # images sharing a transform and cap are perturbed as one batch
+    results = [None] * len(entries)
+    groups = {}
+    for i, entry in enumerate(entries):
+        kwargs = encode_kwargs
+        if isinstance(entry, (tuple, list)) and len(entry) > 2 and entry[2]:
+            kwargs = dict(encode_kwargs, max_pixels=entry[2])
+        if isinstance(entry, (tuple, list)) and entry[1]:
+            groups.setdefault((entry[1], kwargs.get("max_pixels")), []).append(i)
+        else:
+            path = entry[0] if isinstance(entry, (tuple, list)) else entry
+            results[i] = prepare_image(path, transport, **kwargs)
+
+    for (transform, max_pixels), indices in groups.items():
+        kwargs = dict(encode_kwargs, max_pixels=max_pixels) if max_pixels else encode_kwargs
+        batch = prep.encode_perturbed_batch([entries[i][0] for i in indices], transform, **kwargs)
+        for i, result in zip(indices, batch):
+            if result is None:
+                continue
+            cache_key, data = result
+            if transport == "base64":
+                results[i] = base64.b64encode(data).decode('utf-8')
+            else:
+                results[i] = prep.IMAGE_CACHE.path(cache_key)
+    return results
+
+
+def media_type(head):
+    # the codec from the first bytes of the file signature
+    if head.startswith(b"\x89PNG"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def _mime(encoded):
+    return media_type(base64.b64decode(encoded[:16]))
+
+
+def image_url(prepared, transport=TRANSPORT):
+    if prepared is None:
+        # prepare_images gives None for an unreadable image, runners skip those items
+        raise ValueError("image_url: no prepared image (unreadable source)")
+    if transport == "base64":
+        return f"data:{_mime(prepared)};base64,{prepared}"
+    if transport == "file":
+        return f"file://{quote(os.path.abspath(prepared))}"
+    if transport == "http":
+        server = start_image_server()
+        # only registered files are reachable, the server never lists or walks directories
+        token = hashlib.sha1(prepared.encode('utf-8')).hexdigest()[:20]
+        _served_files[token] = prepared
+        return f"http://{HTTP_PUBLIC_HOST}:{server.server_address[1]}/{token}/{quote(os.path.basename(prepared))}"
+    raise ValueError(f"unknown image transport: {transport}")
+
+
+def local_path(url):
+    # the file behind a file:// URL or one served by this process, None for inline or foreign URLs
+    if url.startswith("file://"):
+        return unquote(url[len("file://"):])
+    if url.startswith("http://") or url.startswith("https://"):
+        return _served_files.get(urlsplit(url).path.lstrip('/').split('/', 1)[0])
+    return None
+
+
+def image_dimensions(url):
+    # (width, height) of an image referenced by a request, reading only its header where possible
+    try:
+        if url.startswith("data:"):
+            encoded = url.split(",", 1)[1]
+            try:
+                with Image.open(BytesIO(base64.b64decode(encoded[:HEADER_CHARS]))) as img:
+                    return img.size
+            except Exception:
+                with Image.open(BytesIO(base64.b64decode(encoded))) as img:
+                    return img.size
+        with Image.open(local_path(url)) as img:
+            return img.size
+    except Exception:
+        return None
@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import resource
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+import multiprocessing
+import urllib.request
+import numpy as np
+from PIL import Image
+
+from manifest import compile_manifest, task_rows, SPEC_DIR
+from server_metrics import parse_metrics
+
+PROCESSING_DIR = os.path.dirname(os.path.abspath(__file__))
+CODE_DIR = os.path.join(os.path.dirname(PROCESSING_DIR), "code")
+RUNNERS = {
+    "shortcut": os.path.join(CODE_DIR, "shortcut", "shortcut_test.py"),
+    "cot": os.path.join(CODE_DIR, "shortcut_with_CoT", "shortcut_with_CoT.py"),
+    "years": os.path.join(CODE_DIR, "news", "years_subtask_test.py"),
+    "mmt": os.path.join(CODE_DIR, "news", "multimodal_subtask_test.py"),
+    "localization": os.path.join(CODE_DIR, "artifacts", "artifacts-localization.py"),
+    "sort": os.path.join(CODE_DIR, "artifacts", "artifacts-sort.py"),
+}
+DEFAULT_ITEMS = 64
+DEFAULT_IMAGE_SIZE = (1024, 768)
+DEFAULT_LATENCY = "const:0.05"
+YEARS_CATEGORY = "diversity"
+
+
+def _write_image(path, size, rng):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    w, h = size
+    # a noisy gradient compresses like a photo, unlike a flat color
+    base = np.linspace(0, 255, w, dtype=np.float32)[None, :, None] * rng.uniform(0.3, 1.0, 3)
+    noise = rng.normal(0, 20, (h, w, 3))
+    Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)).save(path, format="JPEG", quality=90)
+
+
+def _row_paths(task, row, images_dir):
+    paths = row["paths"] if "paths" in row else [row["path"]]
+    if task == "mmt":
+        folder = os.path.join(images_dir, f"{row['category']}_images", "MMT-test", row["test_id"])
+        paths = [p or os.path.join(folder, f"{i}.jpg") for i, p in enumerate(paths, 1)]
+    return paths
+
+
+def _trim(table, keep):
+    columns = {name: [values[i] for i in keep] for name, values in table["columns"].items()}
+    return {"length": len(keep), "columns": columns}
+
+
+def build_dataset(root, items, image_size, seed=0):
+    # a synthetic copy of the benchmark layout: the real test specs, small generated images
+    rng = np.random.default_rng(seed)
+    images_dir = os.path.join(root, "images")
+    cha_dir = os.path.join(root, "cha")
+
+    years_dir = os.path.join(images_dir, f"{YEARS_CATEGORY}_images", "years")
+    os.makedirs(years_dir, exist_ok=True)
+    with open(os.path.join(years_dir, "year_name.json"), 'w', encoding='utf-8') as f:
+        json.dump({f"{i}.jpg": f"{1950 + i % 75}_synthetic.jpg" for i in range(1, items + 1)}, f)
+    for i in range(1, items + 1):
+        _write_image(os.path.join(years_dir, f"{i}.jpg"), image_size, rng)
+
+    draft = compile_manifest(SPEC_DIR, images_dir, cha_dir, with_hash=False)
+    for task, table in draft["tasks"].items():
+        if task == "years":
+            continue
+        for i in range(min(items, table["length"])):
+            row = {name: values[i] for name, values in table["columns"].items()}
+            for path in _row_paths(task, row, images_dir):
+                if not os.path.exists(path):
+                    _write_image(path, image_size, rng)
+
+    manifest = compile_manifest(SPEC_DIR, images_dir, cha_dir, with_hash=False)
+    for task, table in manifest["tasks"].items():
+        columns = table["columns"]
+        sizes = columns["sizes"] if "sizes" in columns else [[s] for s in columns["size"]]
+        keep = [i for i in range(table["length"]) if None not in sizes[i]][:items]
+        manifest["tasks"][task] = _trim(table, keep)
+    return manifest, images_dir, cha_dir
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock(port, latency, error_rate, capacity):
+    cmd = [sys.executable, os.path.join(PROCESSING_DIR, "mock_server.py"), "--port", str(port),
+           "--latency", latency, "--error-rate", str(error_rate), "--capacity", str(capacity), "--seed", "0"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1)
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("mock server did not start")
+
+
+def served_requests(ports):
+    total = 0
+    for port in ports:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            total += parse_metrics(response.read().decode('utf-8')).get("mock_requests_total", 0)
+    return total
+
+
+def _load_runner(path):
+    spec = importlib.util.spec_from_file_location(f"runner_{os.path.basename(path)[:-3].replace('-', '_')}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _drive(task, module, manifest):
+    if task in ("shortcut", "cot"):
+        categories = list(dict.fromkeys(manifest["tasks"]["shortcut"]["columns"]["category"]))
+        for category in categories:
+            module.process_category(category, task_rows(manifest, "shortcut", category=category))
+    elif task == "years":
+        module.run_test()
+    elif task == "mmt":
+        module.run_mmt_test_aggregated()
+    elif task == "localization":
+        module.main()
+    elif task == "sort":
+        module.process_sort_test()
+
+
+def run_task(task, manifest, images_dir, cha_dir, work_dir, api_url, concurrency, transport, queue, guided=False,
+             scoring="generate", token_budget=None, encode_settings=None, model=None):
+    # runs in a fresh process so CPU time and peak RSS belong to this task alone
+    import image_cache
+    import encode_image
+    import prefetch
+    encode_image.IMAGE_CACHE = image_cache.ImageCache(os.path.join(work_dir, "image_cache"))
+    prefetch.ENCODE_SETTINGS = dict(encode_settings or {})
+
+    module = _load_runner(RUNNERS[task])
+    from response_cache import ResponseCache
+    module.RESPONSE_CACHE = ResponseCache(os.path.join(work_dir, f"{task}_responses.sqlite"))
+    module.IMAGE_CACHE = encode_image.IMAGE_CACHE
+    module.load_manifest = lambda *args, **kwargs: manifest
+    module.API_URL = api_url
+    if model:
+        module.MODEL_NAME = model
+    module.CONCURRENCY = concurrency
+    module.IMAGE_TRANSPORT = transport
+    if hasattr(module, "GUIDED"):
+        module.GUIDED = guided
+    if hasattr(module, "SCORING"):
+        module.SCORING = scoring
+    if hasattr(module, "TOKEN_BUDGET"):
+        module.TOKEN_BUDGET = token_budget
+    for name in ("BASE_DIR", "ROOT_DIR"):
+        if hasattr(module, name):
+            setattr(module, name, cha_dir if task == "localization" else images_dir)
+    if task == "sort":
+        module.BASE_DIR_LINUX = cha_dir
+        module.OUTPUT_FILE = os.path.join(work_dir, "sort_ans.jsonl")
+
+    before_self = resource.getrusage(resource.RUSAGE_SELF)
+    before_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    _drive(task, module, manifest)
+    wall = time.perf_counter() - start
+    after_self = resource.getrusage(resource.RUSAGE_SELF)
+    after_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpu = ((after_self.ru_utime + after_self.ru_stime) - (before_self.ru_utime + before_self.ru_stime)
+           + (after_children.ru_utime + after_children.ru_stime)
+           - (before_children.ru_utime + before_children.ru_stime))
+    queue.put({
+        "wall_s": wall,
+        "cpu_s": cpu,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": after_self.ru_maxrss / 1024,
+        "peak_child_rss_mb": after_children.ru_maxrss / 1024,
+    })
+
+
+def run_load_test(tasks, items=DEFAULT_ITEMS, image_size=DEFAULT_IMAGE_SIZE, latency=DEFAULT_LATENCY, error_rate=0.0,
+                  capacity=0, concurrency=32, transport="base64", keep=False, replicas=1, guided=False,
+                  scoring="generate", token_budget=None):
+    root = tempfile.mkdtemp(prefix="chronovision_load_")
+    ports = [_free_port() for _ in range(replicas)]
+    urls = [f"http://127.0.0.1:{port}/v1/chat/completions" for port in ports]
+    api_url = urls[0] if replicas == 1 else urls
+    servers = [start_mock(port, latency, error_rate, capacity) for port in ports]
+    ctx = multiprocessing.get_context("spawn")
+    report = {}
+    try:
+        print(f"building synthetic dataset ({items} items per task) in {root}")
+        manifest, images_dir, cha_dir = build_dataset(root, items, image_size)
+        for task in tasks:
+            work_dir = os.path.join(root, f"work_{task}")
+            os.makedirs(work_dir, exist_ok=True)
+            served = served_requests(ports)
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_task, args=(task, manifest, images_dir, cha_dir, work_dir, api_url,
+                                                      concurrency, transport, queue, guided, scoring,
+                                                      token_budget))
+            proc.start()
+            stats = queue.get()
+            proc.join()
+            requests = served_requests(ports) - served
+            stats["requests"] = int(requests)
+            stats["req_per_s"] = requests / stats["wall_s"] if stats["wall_s"] else 0.0
+            stats["cpu_ms_per_request"] = 1000 * stats["cpu_s"] / requests if requests else 0.0
+            report[task] = stats
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+        if not keep:
+            shutil.rmtree(root, ignore_errors=True)
+    return report
+
+
+def print_report(report):
+    print(f"\n{'task':<14} | {'requests':>8} | {'wall s':>7} | {'req/s':>8} | {'CPU ms/req':>10} | {'peak RSS MB':>11}")
+    print("-" * 75)
+    for task, s in report.items():
+        print(f"{task:<14} | {s['requests']:>8} | {s['wall_s']:>7.2f} | {s['req_per_s']:>8.1f} | "
+              f"{s['cpu_ms_per_request']:>10.2f} | {max(s['peak_rss_mb'], s['peak_child_rss_mb']):>11.1f}")
+
+
+def compare_baseline(report, baseline, tolerance):
+    # a regression is lower throughput or more client CPU per request than the baseline allows
+    failures = []
+    for task, s in report.items():
+        base = baseline.get(task)
+        if not base:
+            continue
+        if s["req_per_s"] < base["req_per_s"] * (1 - tolerance):
+            failures.append(f"{task}: {s['req_per_s']:.1f} req/s vs baseline {base['req_per_s']:.1f}")
+        if s["cpu_ms_per_request"] > base["cpu_ms_per_request"] * (1 + tolerance):
+            failures.append(f"{task}: {s['cpu_ms_per_request']:.2f} CPU ms/req vs baseline {base['cpu_ms_per_request']:.2f}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive the real task runners against the mock server and measure the client harness.")
+    parser.add_argument("--tasks", nargs="+", choices=list(RUNNERS), default=list(RUNNERS))
+    parser.add_argument("--items", type=int, default=DEFAULT_ITEMS, help="items per task")
+    parser.add_argument("--image-size", type=int, nargs=2, default=list(DEFAULT_IMAGE_SIZE), metavar=("W", "H"))
+    parser.add_argument("--latency", default=DEFAULT_LATENCY, help="mock server latency, see mock_server.py")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--capacity", type=int, default=0, help="requests each mock replica serves at once")
+    parser.add_argument("--replicas", type=int, default=1, help="mock servers behind one endpoint pool")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--transport", choices=("base64", "file", "http"), default="base64")
+    parser.add_argument("--guided", action="store_true", help="run with GUIDED = True (constrained decoding)")
+    parser.add_argument("--scoring", choices=("generate", "logprobs"), default="generate",
+                        help="SCORING mode of the multiple-choice runners")
+    parser.add_argument("--token-budget", type=int, default=None,
+                        help="TOKEN_BUDGET of the multi-image runners (vision tokens per request)")
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    parser.add_argument("--baseline", default=None, help="JSON report to compare against; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic dataset and outputs")
+    args = parser.parse_args()
+
+    report = run_load_test(args.tasks, args.items, tuple(args.image_size), args.latency, args.error_rate,
+                           args.capacity, args.concurrency, args.transport, args.keep, args.replicas, args.guided,
+                           args.scoring, args.token_budget)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            failures = compare_baseline(report, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        sys.exit(1 if failures else 0)
@@ -0,0 +1,101 @@
+import sys
+import argparse
+
+import numpy as np
+
+from scoring import load_records
+
+# vLLM returns at most this many alternatives per position (--max-logprobs, 20 by default)
+TOP_LOGPROBS = 20
+CALIBRATION_BINS = 10
+
+
+def scoring_fields(top_logprobs=TOP_LOGPROBS):
+    # one forward pass: a single sampled token plus the distribution it was drawn from
+    return {"max_tokens": 1, "temperature": 0.0, "logprobs": True, "top_logprobs": top_logprobs}
+
+
+def prefill(payload, text):
+    # make the model continue an assistant message, so the next token is the answer itself
+    # (e.g. '{"answer": "' for a prompt that asks for JSON); vLLM's continue_final_message
+    payload["messages"].append({"role": "assistant", "content": text})
+    payload["continue_final_message"] = True
+    payload["add_generation_prompt"] = False
+    return payload
+
+
+def option_probabilities(result, options):
+    # {option: probability} renormalized over the options, from the first generated token's top logprobs;
+    # tokens that only differ by whitespace (" 1", "1") count for the same option
+    try:
+        top = result["body"]["choices"][0]["logprobs"]["content"][0]["top_logprobs"]
+    except (KeyError, IndexError, TypeError):
+        return None
+    mass = dict.fromkeys(options, 0.0)
+    for entry in top:
+        token = entry["token"].strip()
+        if token in mass:
+            mass[token] += float(np.exp(entry["logprob"]))
+    total = sum(mass.values())
+    if total <= 0:
+        return None
+    return {option: p / total for option, p in mass.items()}
+
+
+def best_option(probs):
+    return max(probs, key=probs.get) if probs else None
+
+
+def calibration(confidences, correct, bins=CALIBRATION_BINS):
+    # expected calibration error over equal-width confidence bins, with the per-bin histogram behind it
+    confidences = np.asarray(confidences, dtype=float)
+    correct = np.asarray(correct, dtype=float)
+    if not len(confidences):
+        return None
+    index = np.minimum((confidences * bins).astype(int), bins - 1)
+    counts = np.bincount(index, minlength=bins)
+    conf_sum = np.bincount(index, weights=confidences, minlength=bins)
+    correct_sum = np.bincount(index, weights=correct, minlength=bins)
+    nonzero = counts > 0
+    mean_conf = np.divide(conf_sum, counts, out=np.zeros(bins), where=nonzero)
+    accuracy = np.divide(correct_sum, counts, out=np.zeros(bins), where=nonzero)
+    ece = float(np.sum(counts * np.abs(accuracy - mean_conf)) / len(confidences))
+    return {
+        "items": int(len(confidences)),
+        "accuracy": float(correct.mean()),
+        "mean_confidence": float(confidences.mean()),
+        "ece": ece,
+        "bins": [{"low": i / bins, "high": (i + 1) / bins, "count": int(counts[i]),
+                  "confidence": float(mean_conf[i]), "accuracy": float(accuracy[i])} for i in range(bins)],
+    }
+
+
+def format_calibration(cal, width=30):
+    if cal is None:
+        return "calibration: no scored items"
+    lines = [f"calibration: {cal['items']} items, accuracy {cal['accuracy']:.2%}, "
+             f"mean confidence {cal['mean_confidence']:.2%}, ECE {cal['ece']:.4f}"]
+    peak = max(b["count"] for b in cal["bins"]) or 1
+    for b in cal["bins"]:
+        if not b["count"]:
+            continue
+        bar = "#" * max(1, round(width * b["count"] / peak))
+        lines.append(f"  {b['low']:.1f}-{b['high']:.1f} | {b['count']:>6} | acc {b['accuracy']:.2f} | {bar}")
+    return "\n".join(lines)
+
+
+def records_calibration(records, bins=CALIBRATION_BINS):
+    # records carrying "confidence" and "is_correct", as written by the runners in logprob mode
+    scored = [r for r in records if r.get("confidence") is not None]
+    return calibration([r["confidence"] for r in scored], [bool(r.get("is_correct")) for r in scored], bins)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ECE and confidence histogram of logprob-scored result files.")
+    parser.add_argument("results", nargs="+", help="*_result.json / *_result.jsonl files written in logprob mode")
+    parser.add_argument("--bins", type=int, default=CALIBRATION_BINS)
+    args = parser.parse_args()
+    records = [record for path in args.results for record in load_records(path)]
+    cal = records_calibration(records, args.bins)
+    print(format_calibration(cal))
+    sys.exit(0 if cal else 1)
@@ -0,0 +1,356 @@
+import os
+import re
+import json
+import glob
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from image_cache import file_digest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPEC_DIR = os.path.join(REPO_DIR, "test & ans")
+IMAGES_DIR = "/hd/images"
+CHA_DIR = "/hd/Images_dynasty"
+MANIFEST_NAME = "chronovision_manifest.json"
+MANIFEST_VERSION = 3
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.JPG', '.JPEG', '.PNG')
+YEARS_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+KEY_YEAR_RE = re.compile(r'^[^_]*_(\d{4})')
+YEAR_RE = re.compile(r'(\d{4})')
+WIN_PATH_RE = re.compile(r'^[A-Za-z]:[\\/]+[^\\/]+[\\/]+')
+
+
+def _numeric_key(text):
+    match = re.search(r'\d+', text)
+    return int(match.group()) if match else 0
+
+
+def resolve_cha_path(win_path, cha_dir=CHA_DIR):
+    # "E:\CHA\Song\coin\1.jpg" or "E:\Images_dynasty\..." -> <cha_dir>/Song/coin/1.jpg
+    rel = WIN_PATH_RE.sub('', win_path).replace('\\', '/')
+    return os.path.join(cha_dir, rel)
+
+
+def _find_image(folder, stem, preferred=None):
+    if preferred and os.path.exists(os.path.join(folder, preferred)):
+        return os.path.join(folder, preferred)
+    for ext in IMAGE_EXTS:
+        path = os.path.join(folder, f"{stem}{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _spec_files(spec_dir):
+    return sorted(glob.glob(os.path.join(spec_dir, "**", "*.json*"), recursive=True))
+
+
+def _spec_mtime(spec_dir):
+    return max((os.path.getmtime(p) for p in _spec_files(spec_dir)), default=0)
+
+
+def _years_state(spec_dir, images_dir):
+    # the years task is a directory listing plus year_name.json rather than a spec file: their mtimes
+    # tell load_manifest when images or years were added or removed
+    state = {}
+    for category_dir in sorted(glob.glob(os.path.join(spec_dir, "news", "*"))):
+        years_dir = os.path.join(images_dir, f"{os.path.basename(category_dir)}_images", "years")
+        year_map_path = os.path.join(years_dir, "year_name.json")
+        state[years_dir] = [os.path.getmtime(years_dir) if os.path.isdir(years_dir) else None,
+                            os.path.getmtime(year_map_path) if os.path.exists(year_map_path) else None]
+    return state
+
+
+def _shortcut_rows(spec_dir, images_dir):
+    rows = []
+    for cat_dir in sorted(glob.glob(os.path.join(spec_dir, "shortcut", "*"))):
+        category = os.path.basename(cat_dir)
+        ans_path = os.path.join(cat_dir, "ans.json")
+        pic_map_path = os.path.join(cat_dir, "test.json")
+        if not (os.path.exists(ans_path) and os.path.exists(pic_map_path)):
+            continue
+        with open(ans_path, 'r', encoding='utf-8') as f:
+            ground_truth = json.load(f)
+        with open(pic_map_path, 'r', encoding='utf-8') as f:
+            name_mapping = json.load(f)
+
+        # one pass over the mapping instead of one scan per test id
+        files_by_test = {}
+        for old_path_key, random_name_val in name_mapping.items():
+            test_id, _, filename = old_path_key.partition('/')
+            match = KEY_YEAR_RE.match(filename)
+            if match:
+                files_by_test.setdefault(test_id, []).append((int(match.group(1)), old_path_key, random_name_val))
+
+        subtask_dir = os.path.join(images_dir, f"{category}_images", "subtask1")
+        for test_id in sorted(ground_truth, key=_numeric_key):
+            files = sorted(files_by_test.get(test_id, []))
+            # as before the manifest: the two mapped images that exist on disk, extra missing entries are ignored.
+            # A test mapping exactly two images keeps them even if missing, so refresh_missing can find them later
+            present = [f for f in files if os.path.exists(os.path.join(subtask_dir, test_id, f[2]))]
+            if len(present) == 2:
+                files = present
+            elif len(files) != 2:
+                continue
+            ans_val = str(ground_truth[test_id])
+            # ans "1": the earlier image is shown first
+            input_order = files if ans_val == "1" else files[::-1]
+            rows.append({
+                "category": category,
+                "test_id": test_id,
+                "ground_truth": ans_val,
+                "paths": [os.path.join(subtask_dir, test_id, name) for _, _, name in input_order],
+                "years": [year for year, _, _ in input_order],
+                "orig_keys": [key for _, key, _ in input_order],
+            })
+    return rows
+
+
+def _mmt_rows(spec_dir, images_dir):
+    rows = []
+    for info_path in sorted(glob.glob(os.path.join(spec_dir, "news", "*", "*-MMT-test-information.json"))):
+        category = os.path.basename(os.path.dirname(info_path))
+        with open(info_path, 'r', encoding='utf-8') as f:
+            test_data_list = json.load(f)
+        if isinstance(test_data_list, dict):
+            test_data_list = [test_data_list]
+
+        mmt_test_root = os.path.join(images_dir, f"{category}_images", "MMT-test")
+        for test_item in test_data_list:
+            test_id = test_item.get("test_id")
+            test_folder = os.path.join(mmt_test_root, test_id)
+            images = {img.get("index"): img for img in test_item.get("images", [])}
+            paths = []
+            for i in range(1, 5):
+                new_name = images.get(i, {}).get("new_name")
+                # a missing image keeps its expected path, so load_manifest can pick it up once it is restored
+                paths.append(_find_image(test_folder, str(i), new_name)
+                             or os.path.join(test_folder, new_name or f"{i}.jpg"))
+            rows.append({
+                "category": category,
+                "test_id": test_id,
+                "event": test_item.get("news", {}).get("description", "N/A"),
+                "ground_truth": test_item.get("correct_answer"),
+                "paths": paths,
+                "years": [images.get(i, {}).get("year") for i in range(1, 5)],
+            })
+    return rows
+
+
+def _years_rows(spec_dir, images_dir):
+    rows = []
+    categories = sorted(os.path.basename(d) for d in glob.glob(os.path.join(spec_dir, "news", "*")))
+    for category in categories:
+        years_dir = os.path.join(images_dir, f"{category}_images", "years")
+        if not os.path.isdir(years_dir):
+            continue
+        year_map = {}
+        year_map_path = os.path.join(years_dir, "year_name.json")
+        if os.path.exists(year_map_path):
+            with open(year_map_path, 'r', encoding='utf-8') as f:
+                year_map = json.load(f)
+
+        image_files = [f for f in os.listdir(years_dir) if f.lower().endswith(YEARS_EXTS)]
+        image_files.sort(key=lambda x: int(os.path.splitext(x)[0]) if os.path.splitext(x)[0].isdigit() else x)
+        for img_file in image_files:
+            match = YEAR_RE.search(year_map.get(img_file) or "")
+            rows.append({
+                "category": category,
+                "image_id": img_file,
+                "path": os.path.join(years_dir, img_file),
+                "year": int(match.group(1)) if match else None,
+            })
+    return rows
+
+
+def _localization_rows(spec_dir, cha_dir):
+    rows = []
+    for bench_path in sorted(glob.glob(os.path.join(spec_dir, "artifacts", "localization", "*.jsonl"))):
+        benchmark = os.path.splitext(os.path.basename(bench_path))[0]
+        with open(bench_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                rows.append({
+                    "benchmark": benchmark,
+                    "id": data.get("id"),
+                    "path": resolve_cha_path(data.get("image", ""), cha_dir),
+                    "dynasty": data.get("dynasty"),
+                    "category": data.get("category"),
+                    "record": data,
+                })
+    return rows
+
+
+def _sort_rows(spec_dir, cha_dir):
+    rows = []
+    for sort_path in sorted(glob.glob(os.path.join(spec_dir, "artifacts", "sort", "*.jsonl"))):
+        with open(sort_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                rows.append({
+                    "id": int(data.get("id", 0)),
+                    "category": data.get("category", ""),
+                    "paths": [resolve_cha_path(p, cha_dir) for p in data.get("images", [])],
+                    "ground_truth": data.get("ground_truth", []),
+                    "dynasty_sequence": data.get("dynasty_sequence", []),
+                    "prompt": data.get("prompt", ""),
+                })
+    return rows
+
+
+def _file_info(path, with_hash):
+    try:
+        size = os.path.getsize(path)
+    except (OSError, TypeError):
+        return None, None
+    return size, (file_digest(path) if with_hash else None)
+
+
+def _add_file_columns(rows, with_hash, workers=16):
+    paths = sorted({p for row in rows for p in (row["paths"] if "paths" in row else [row["path"]]) if p})
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        info = dict(zip(paths, pool.map(lambda p: _file_info(p, with_hash), paths)))
+    for row in rows:
+        if "paths" in row:
+            row["sizes"] = [info.get(p, (None, None))[0] for p in row["paths"]]
+            row["sha256"] = [info.get(p, (None, None))[1] for p in row["paths"]]
+        else:
+            row["size"], row["sha256"] = info.get(row["path"], (None, None))
+
+
+def _columnar(rows):
+    columns = {}
+    for i, row in enumerate(rows):
+        for name, value in row.items():
+            columns.setdefault(name, [None] * i).append(value)
+        for name in columns.keys() - row.keys():
+            columns[name].append(None)
+    return {"length": len(rows), "columns": columns}
+
+
+def compile_manifest(spec_dir=SPEC_DIR, images_dir=IMAGES_DIR, cha_dir=CHA_DIR, with_hash=True):
+    tasks = {
+        "shortcut": _shortcut_rows(spec_dir, images_dir),
+        "mmt": _mmt_rows(spec_dir, images_dir),
+        "years": _years_rows(spec_dir, images_dir),
+        "localization": _localization_rows(spec_dir, cha_dir),
+        "sort": _sort_rows(spec_dir, cha_dir),
+    }
+    for rows in tasks.values():
+        _add_file_columns(rows, with_hash)
+    return {
+        "version": MANIFEST_VERSION,
+        "created": time.time(),
+        "spec_dir": os.path.abspath(spec_dir),
+        "spec_mtime": _spec_mtime(spec_dir),
+        "years_state": _years_state(spec_dir, images_dir),
+        "images_dir": images_dir,
+        "cha_dir": cha_dir,
+        "tasks": {name: _columnar(rows) for name, rows in tasks.items()},
+    }
+
+
+def save_manifest(manifest, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def default_manifest_path(images_dir=IMAGES_DIR):
+    return os.path.join(images_dir, MANIFEST_NAME)
+
+
+def refresh_missing(manifest):
+    # images that were missing at compile time are looked up again (any known extension), so files restored
+    # later are no longer skipped; returns how many were found
+    found = 0
+    for table in manifest["tasks"].values():
+        columns = table["columns"]
+        multi = "paths" in columns
+        for i in range(table["length"]):
+            paths = columns["paths"][i] if multi else [columns["path"][i]]
+            sizes = columns["sizes"][i] if multi else [columns["size"][i]]
+            for j, (path, size) in enumerate(zip(paths, sizes)):
+                if size is not None or not path:
+                    continue
+                name = os.path.basename(path)
+                located = _find_image(os.path.dirname(path), os.path.splitext(name)[0], name)
+                size, _ = _file_info(located, False) if located else (None, None)
+                if size is None:
+                    continue
+                if multi:
+                    paths[j], sizes[j] = located, size
+                else:
+                    columns["path"][i], columns["size"][i] = located, size
+                found += 1
+    return found
+
+
+def load_manifest(images_dir=IMAGES_DIR, cha_dir=CHA_DIR, spec_dir=SPEC_DIR, path=None):
+    path = path or default_manifest_path(images_dir)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if (manifest.get("version") == MANIFEST_VERSION
+                and manifest.get("images_dir") == images_dir
+                and manifest.get("cha_dir") == cha_dir
+                and manifest.get("spec_mtime", 0) >= _spec_mtime(spec_dir)
+                and manifest.get("years_state") == _years_state(spec_dir, images_dir)):
+            found = refresh_missing(manifest)
+            if found:
+                print(f"manifest {path}: {found} previously missing images found")
+                try:
+                    save_manifest(manifest, path)
+                except OSError as e:
+                    print(f"could not save manifest to {path}: {e}")
+            return manifest
+        print(f"manifest {path} is stale, recompiling")
+
+    # compile without hashes so a first run does not read every image twice
+    manifest = compile_manifest(spec_dir, images_dir, cha_dir, with_hash=False)
+    try:
+        save_manifest(manifest, path)
+    except OSError as e:
+        print(f"could not save manifest to {path}: {e}")
+    return manifest
+
+
+def task_rows(manifest, task, **filters):
+    table = manifest["tasks"][task]
+    columns = table["columns"]
+    names = list(columns)
+    rows = []
+    for i in range(table["length"]):
+        if any(columns[k][i] != v for k, v in filters.items()):
+            continue
+        rows.append({name: columns[name][i] for name in names})
+    return rows
+
+
+def task_values(manifest, task, column):
+    return list(dict.fromkeys(manifest["tasks"][task]["columns"].get(column, [])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile test & ans into one indexed benchmark manifest.")
+    parser.add_argument("--spec-dir", default=SPEC_DIR)
+    parser.add_argument("--images-dir", default=IMAGES_DIR)
+    parser.add_argument("--cha-dir", default=CHA_DIR)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--no-hash", action="store_true", help="skip sha256 of every image")
+    args = parser.parse_args()
+
+    start = time.time()
+    manifest = compile_manifest(args.spec_dir, args.images_dir, args.cha_dir, with_hash=not args.no_hash)
+    output = args.output or default_manifest_path(args.images_dir)
+    save_manifest(manifest, output)
+    for name, table in manifest["tasks"].items():
+        print(f"{name:<14} {table['length']:>6} rows")
+    print(f"saved at: {output} ({time.time() - start:.1f}s)")
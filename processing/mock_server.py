@@ -0,0 +1,281 @@
+import re
+import math
+import json
+import hashlib
+import time
+import random
+import asyncio
+import argparse
+from aiohttp import web
+
+DEFAULT_PORT = 8000
+# latency specs: "const:S", "uniform:LO:HI", "exp:MEAN", "lognormal:MEDIAN:SIGMA" (seconds)
+DEFAULT_LATENCY = "lognormal:0.5:0.4"
+# rough token estimates for the usage block
+CHARS_PER_TOKEN = 4
+TOKENS_PER_IMAGE = 1024
+# simulated automatic prefix caching, in blocks of this many tokens like vLLM's KV-cache blocks
+PREFIX_BLOCK = 16
+MAX_PREFIX_BLOCKS = 1_000_000
+
+OPTION_RE = re.compile(r"^([A-E])\. .+$", re.M)
+YEAR_RANGE = (1946, 2025)
+# labels a logprobs request spreads probability over besides the sampled one
+LOGPROB_LABELS = ["1", "2", "3", "4", "A", "B", "C", "D", "E"]
+
+
+def parse_latency(spec):
+    name, *params = spec.split(":")
+    params = [float(p) for p in params]
+    if name == "const":
+        return lambda rng: params[0]
+    if name == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1])
+    if name == "exp":
+        return lambda rng: rng.expovariate(1.0 / params[0]) if params[0] > 0 else 0.0
+    if name == "lognormal":
+        return lambda rng: params[0] * rng.lognormvariate(0.0, params[1])
+    raise ValueError(f"unknown latency distribution: {spec}")
+
+
+def _request_text(payload):
+    texts, images = [], 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                texts.append(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                images += 1
+    return "\n".join(texts), images
+
+
+def _prompt_units(payload):
+    # pseudo tokens in prompt order: 4-character text pieces, a fixed run per image
+    units = []
+    for message in payload.get("messages", []):
+        units.append(f"<{message.get('role')}>")
+        content = message.get("content")
+        parts = [{"type": "text", "text": content}] if isinstance(content, str) else content or []
+        for part in parts:
+            if part.get("type") == "text":
+                text = part.get("text", "")
+                units.extend(text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN))
+            elif part.get("type") == "image_url":
+                digest = hashlib.sha1(part["image_url"]["url"].encode('utf-8')).hexdigest()
+                units.extend(f"<img {digest} {i}>" for i in range(TOKENS_PER_IMAGE))
+    return units
+
+
+def _rambling(tokens):
+    sentence = "The clothing, the cars and the grain of the print all point to a similar decade. "
+    text = sentence * (tokens * CHARS_PER_TOKEN // len(sentence) + 1)
+    return text[:tokens * CHARS_PER_TOKEN]
+
+
+def canned_answer(payload, rng, reasoning_tokens=0):
+    # a plausible answer in the format each ChronoVision runner parses;
+    # reasoning_tokens pads the JSON "thinking" field to mimic long chain-of-thought outputs
+    text, images = _request_text(payload)
+    wants_json = (payload.get("response_format") or {}).get("type") == "json_object"
+    choices = payload.get("guided_choice") or (payload.get("structured_outputs") or {}).get("choice")
+    if choices:
+        return rng.choice(choices)
+
+    options = OPTION_RE.findall(text)
+    if options and "Options:" in text:
+        letter = rng.choice(options)
+        return re.search(rf"^{letter}\. .+$", text, re.M).group(0).strip()
+    if "sort them in chronological order" in text or '"ans"' in text:
+        order = list(range(images))
+        rng.shuffle(order)
+        return json.dumps({"ans": ", ".join(str(i) for i in order)})
+    if "EARLIER" in text or "earlier" in text:
+        answer = rng.choice(["1", "2"])
+        if wants_json:
+            thinking = f"Image {answer} shows older technology and photo quality. " + _rambling(reasoning_tokens)
+            return json.dumps({"thinking": thinking.strip(), "answer": answer})
+        return answer
+    if "4-digit year" in text:
+        return str(rng.randint(*YEAR_RANGE))
+    if "Respond ONLY with the digit" in text:
+        return str(rng.randint(1, max(1, images)))
+    return json.dumps({"answer": "1"}) if wants_json else "1"
+
+
+def first_token_logprobs(payload, answer, rng):
+    # the first answer token plus a random top_logprobs list in which it is the most likely label;
+    # with an assistant prefill (continue_final_message) the answer is the value after it
+    if payload.get("continue_final_message") and answer.startswith("{"):
+        answer = str(json.loads(answer).get("answer", "1"))
+    match = re.match(r"\w+", answer)
+    token = match.group(0) if match else answer[:1]
+    weights = {label: rng.random() for label in LOGPROB_LABELS if label != token}
+    weights[token] = max(weights.values()) + rng.random()
+    total = sum(weights.values())
+    top = sorted(({"token": label, "logprob": math.log(w / total)} for label, w in weights.items()),
+                 key=lambda entry: -entry["logprob"])[:payload.get("top_logprobs") or 1]
+    return token, {"content": [{"token": token, "logprob": top[0]["logprob"], "top_logprobs": top}]}
+
+
+class MockServer:
+    def __init__(self, latency=DEFAULT_LATENCY, error_rate=0.0, rate_limit_rate=0.0, timeout_rate=0.0,
+                 hang_seconds=600.0, capacity=0, seed=None, reasoning_tokens=0, token_interval=0.0):
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        # capacity > 0 caps concurrently "running" requests, the rest queue like on a saturated GPU
+        self.slots = asyncio.Semaphore(capacity) if capacity > 0 else None
+        self.rng = random.Random(seed)
+        # streamed responses: the latency is the time to first token, then one token per token_interval
+        self.reasoning_tokens = reasoning_tokens
+        self.token_interval = token_interval
+        self.counters = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0, "hung": 0, "aborted": 0,
+                         "completion_tokens": 0}
+        self.running = 0
+        self.prefix_blocks = set()
+        self.prefix_queries = 0
+        self.prefix_hits = 0
+
+    def prefix_lookup(self, units):
+        # chained block hashes: a block only hits when everything before it matched too
+        h = hashlib.sha1()
+        matching = True
+        full_blocks = len(units) // PREFIX_BLOCK
+        for b in range(full_blocks):
+            h.update("\x00".join(units[b * PREFIX_BLOCK:(b + 1) * PREFIX_BLOCK]).encode('utf-8'))
+            block = h.digest()
+            if matching and block in self.prefix_blocks:
+                self.prefix_hits += PREFIX_BLOCK
+            else:
+                matching = False
+                if len(self.prefix_blocks) >= MAX_PREFIX_BLOCKS:
+                    self.prefix_blocks.clear()
+                self.prefix_blocks.add(block)
+        self.prefix_queries += len(units)
+
+    async def chat_completions(self, request):
+        payload = await request.json()
+        self.counters["requests"] += 1
+
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            self.counters["rate_limited"] += 1
+            return web.json_response({"error": {"message": "rate limited", "type": "rate_limit"}}, status=429)
+        roll -= self.rate_limit_rate
+        if roll < self.timeout_rate:
+            self.counters["hung"] += 1
+            await asyncio.sleep(self.hang_seconds)
+            return web.json_response({"error": {"message": "hung"}}, status=504)
+        roll -= self.timeout_rate
+
+        if self.slots is not None:
+            await self.slots.acquire()
+        self.running += 1
+        try:
+            await asyncio.sleep(max(0.0, self.latency(self.rng)))
+        finally:
+            self.running -= 1
+            if self.slots is not None:
+                self.slots.release()
+
+        if roll < self.error_rate:
+            self.counters["errors"] += 1
+            return web.json_response({"error": {"message": "internal error", "type": "server_error"}}, status=500)
+
+        answer = canned_answer(payload, self.rng, self.reasoning_tokens)
+        units = _prompt_units(payload)
+        self.prefix_lookup(units)
+        prompt_tokens = len(units)
+        if payload.get("stream"):
+            return await self.stream_answer(request, payload, answer, prompt_tokens)
+        finish_reason = "stop"
+        logprobs = None
+        if payload.get("logprobs"):
+            answer, logprobs = first_token_logprobs(payload, answer, self.rng)
+        max_tokens = payload.get("max_tokens")
+        if max_tokens and len(answer) > max_tokens * CHARS_PER_TOKEN:
+            answer, finish_reason = answer[:max_tokens * CHARS_PER_TOKEN], "length"
+        completion_tokens = max(1, len(answer) // CHARS_PER_TOKEN)
+        self.counters["ok"] += 1
+        self.counters["completion_tokens"] += completion_tokens
+        return web.json_response({
+            "id": f"chatcmpl-mock-{self.counters['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "logprobs": logprobs,
+                         "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    async def stream_answer(self, request, payload, answer, prompt_tokens):
+        # OpenAI-style SSE, one chunk per pseudo token; a client hanging up aborts the generation like vLLM does
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        continuous = (payload.get("stream_options") or {}).get("continuous_usage_stats")
+        pieces = [answer[i:i + CHARS_PER_TOKEN] for i in range(0, len(answer), CHARS_PER_TOKEN)]
+        chunk_id = f"chatcmpl-mock-{self.counters['requests']}"
+        try:
+            for n, piece in enumerate(pieces, 1):
+                chunk = {"id": chunk_id, "object": "chat.completion.chunk", "model": payload.get("model", "mock"),
+                         "choices": [{"index": 0, "delta": {"content": piece},
+                                      "finish_reason": "stop" if n == len(pieces) else None}]}
+                if continuous:
+                    chunk["usage"] = {"prompt_tokens": prompt_tokens, "completion_tokens": n,
+                                      "total_tokens": prompt_tokens + n}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.counters["completion_tokens"] += 1
+                if self.token_interval:
+                    await asyncio.sleep(self.token_interval)
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except (ConnectionResetError, asyncio.CancelledError):
+            self.counters["aborted"] += 1
+            raise
+        self.counters["ok"] += 1
+        return response
+
+    async def metrics(self, request):
+        lines = [f"mock_{name}_total {value}" for name, value in self.counters.items()]
+        lines.append(f"mock_running {self.running}")
+        lines.append(f'vllm:prefix_cache_queries_total{{model_name="mock"}} {self.prefix_queries}')
+        lines.append(f'vllm:prefix_cache_hits_total{{model_name="mock"}} {self.prefix_hits}')
+        return web.Response(text="\n".join(lines) + "\n", content_type="text/plain")
+
+    async def health(self, request):
+        return web.Response(text="ok")
+
+    def app(self):
+        app = web.Application(client_max_size=256 * 1024 ** 2)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/metrics", self.metrics)
+        app.router.add_get("/health", self.health)
+        return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stand-in for the vLLM server, with canned ChronoVision answers.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", default=DEFAULT_LATENCY, help="e.g. const:0.2, uniform:0.1:0.8, exp:0.5, lognormal:0.5:0.4")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="fraction of requests that hang")
+    parser.add_argument("--hang-seconds", type=float, default=600.0)
+    parser.add_argument("--capacity", type=int, default=0, help="max requests served at once, 0 = unlimited")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--reasoning-tokens", type=int, default=0, help="pad JSON 'thinking' answers to this length")
+    parser.add_argument("--token-interval", type=float, default=0.0, help="seconds per streamed token")
+    args = parser.parse_args()
+
+    server = MockServer(args.latency, args.error_rate, args.rate_limit_rate, args.timeout_rate,
+                        args.hang_seconds, args.capacity, args.seed, args.reasoning_tokens, args.token_interval)
+    print(f"mock server on http://{args.host}:{args.port}/v1/chat/completions")
+    web.run_app(server.app(), host=args.host, port=args.port, print=None)
@@ -0,0 +1,123 @@
+import io
+import hashlib
+import numpy as np
+from PIL import Image
+
+# transforms are written as "name" or "name:strength", chained with "+", e.g. "grayscale+grain:0.06"
+DEFAULT_STRENGTH = {
+    "grayscale": 1.0,
+    "sepia": 1.0,
+    "grain": 0.06,
+    "blur": 2.0,
+    "jpeg": 15,
+    "fade": 0.35,
+}
+# same weights as cv2.COLOR_BGR2GRAY, so results match get_greyscale_by_OpenCV.py
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+SEPIA = np.array([[0.393, 0.769, 0.189],
+                  [0.349, 0.686, 0.168],
+                  [0.272, 0.534, 0.131]], dtype=np.float32)
+PAPER = np.array([238, 228, 205], dtype=np.float32)
+
+
+def parse_transform(spec):
+    steps = []
+    for part in spec.split("+"):
+        name, _, value = part.strip().partition(":")
+        if name not in DEFAULT_STRENGTH:
+            raise ValueError(f"unknown perturbation: {name}")
+        steps.append((name, float(value) if value else DEFAULT_STRENGTH[name]))
+    return steps
+
+
+def _grayscale(batch, strength, seeds):
+    gray = (batch @ LUMA)[..., None]
+    return batch + strength * (gray - batch)
+
+
+def _sepia(batch, strength, seeds):
+    toned = batch @ SEPIA.T
+    return batch + strength * (toned - batch)
+
+
+def _grain(batch, strength, seeds):
+    # luminance noise, seeded per image so a cached result is reproducible
+    noise = np.stack([np.random.default_rng(seed).standard_normal(batch.shape[1:3], dtype=np.float32)
+                      for seed in seeds])
+    return batch + (strength * 255.0) * noise[..., None]
+
+
+def _box_blur(batch, radius, axis):
+    # running sum along one axis with edge padding: O(pixels) for any radius
+    pad = [(0, 0)] * batch.ndim
+    pad[axis] = (radius + 1, radius)
+    padded = np.pad(batch, pad, mode="edge")
+    csum = np.cumsum(padded, axis=axis, dtype=np.float32)
+    n = batch.shape[axis]
+    upper = [slice(None)] * batch.ndim
+    lower = [slice(None)] * batch.ndim
+    upper[axis] = slice(2 * radius + 1, 2 * radius + 1 + n)
+    lower[axis] = slice(0, n)
+    return (csum[tuple(upper)] - csum[tuple(lower)]) / (2 * radius + 1)
+
+
+def _blur(batch, sigma, seeds):
+    # three box passes per axis approximate a Gaussian of the given sigma
+    radius = max(1, int(round(np.sqrt(4 * sigma * sigma + 1) / 2 - 0.5)))
+    for _ in range(3):
+        batch = _box_blur(batch, radius, axis=1)
+        batch = _box_blur(batch, radius, axis=2)
+    return batch
+
+
+def _jpeg(batch, quality, seeds):
+    out = np.empty_like(batch)
+    for i, img in enumerate(np.clip(batch, 0, 255).astype(np.uint8)):
+        buffer = io.BytesIO()
+        Image.fromarray(img).save(buffer, format="JPEG", quality=int(quality))
+        buffer.seek(0)
+        out[i] = np.asarray(Image.open(buffer).convert("RGB"), dtype=np.float32)
+    return out
+
+
+def _fade(batch, strength, seeds):
+    # washed-out print: lifted blacks, lower contrast, drift toward yellowed paper
+    return batch + strength * (PAPER - batch)
+
+
+TRANSFORMS = {
+    "grayscale": _grayscale,
+    "sepia": _sepia,
+    "grain": _grain,
+    "blur": _blur,
+    "jpeg": _jpeg,
+    "fade": _fade,
+}
+
+
+def image_seed(key):
+    return int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:8], "little")
+
+
+def apply_batch(images, spec, keys=None):
+    # images: list of HxWx3 uint8 arrays; same-sized images are stacked and transformed together
+    steps = parse_transform(spec)
+    keys = keys if keys is not None else [str(i) for i in range(len(images))]
+    results = [None] * len(images)
+    groups = {}
+    for i, img in enumerate(images):
+        groups.setdefault(img.shape, []).append(i)
+
+    for indices in groups.values():
+        batch = np.stack([images[i] for i in indices]).astype(np.float32)
+        for step, (name, strength) in enumerate(steps):
+            seeds = [image_seed(f"{keys[i]}|{spec}|{step}") for i in indices]
+            batch = TRANSFORMS[name](batch, strength, seeds)
+        batch = np.clip(batch + 0.5, 0, 255).astype(np.uint8)
+        for j, i in enumerate(indices):
+            results[i] = batch[j]
+    return results
+
+
+def apply(image, spec, key=None):
+    return apply_batch([image], spec, None if key is None else [key])[0]
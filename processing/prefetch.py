@@ -0,0 +1,94 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import encode_image as prep
+from async_client import FailedJob
+from image_transport import prepare_images, TRANSPORT
+from token_budget import budget_entries, PlanLog, WEIGHTING
+
+PREFETCH_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# upper bound on base64 payload bytes that are prepared but not yet consumed
+PREFETCH_MAX_BYTES = 512 * 1024 ** 2
+# a prepared image is at most ~2.8 MP of JPEG, so huge source files should not block the queue
+ESTIMATE_CAP = 2 * 1024 ** 2
+# encode_image keyword arguments (max_pixels, quality, codec, grid, ...) applied to every prefetch
+# unless the caller passes its own; processing/ablation.py sets these to sweep the image settings
+ENCODE_SETTINGS = {}
+
+
+def _estimate_bytes(paths):
+    total = 0
+    for path in paths:
+        if isinstance(path, (tuple, list)):
+            path = path[0]
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        total += min(size, ESTIMATE_CAP) * 4 // 3
+    return total
+
+
+def unreadable(entries, prepared):
+    # stands in for the payload of an item with images that failed to read or decode, so the runner's
+    # dispatch_requests dead-letters it (naming the images) instead of the item silently going missing
+    paths = [entry[0] if isinstance(entry, (tuple, list)) else entry
+             for entry, data in zip(entries, prepared) if data is None]
+    return FailedJob("unreadable image: " + ", ".join(str(path) for path in paths))
+
+
+def _prepare(paths, transport, encode_kwargs, budget=None):
+    hits, misses = prep.IMAGE_CACHE.hits, prep.IMAGE_CACHE.misses
+    plans = None
+    if budget is not None:
+        # image headers are read here, in the worker, not on the event loop
+        paths, plans = budget_entries(paths, budget["tokens"], budget["weighting"],
+                                      encode_kwargs.get("max_pixels", prep.DEFAULT_MAX_PIXELS), budget["group"])
+    prepared = prepare_images(paths, transport, **encode_kwargs)
+    return prepared, prep.IMAGE_CACHE.hits - hits, prep.IMAGE_CACHE.misses - misses, plans
+
+
+def prefetch_images(items, workers=PREFETCH_WORKERS, max_bytes=PREFETCH_MAX_BYTES, transport=TRANSPORT,
+                    token_budget=None, weighting=WEIGHTING, images_per_request=None, **encode_kwargs):
+    # items: iterable of (key, [image paths or (path, transform)]); yields (key, [base64 or None, ...]) in input order,
+    # or prepared file paths instead of base64 when images are sent by reference.
+    # token_budget splits that many vision tokens over the images of each request (processing/token_budget.py);
+    # an item holds one request unless images_per_request says how to cut it up
+    encode_kwargs = {**ENCODE_SETTINGS, **encode_kwargs}
+    item_iter = iter(items)
+    pending = deque()
+    pending_bytes = 0
+    exhausted = False
+    budget = None
+    plan_log = None
+    if token_budget is not None:
+        budget = {"tokens": token_budget, "weighting": weighting, "group": images_per_request}
+        plan_log = PlanLog(token_budget, weighting)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            while not exhausted and (not pending or pending_bytes < max_bytes):
+                try:
+                    key, paths = next(item_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                estimate = _estimate_bytes(paths)
+                pending.append((key, pool.submit(_prepare, list(paths), transport, encode_kwargs, budget), estimate))
+                pending_bytes += estimate
+
+            if not pending:
+                break
+
+            key, future, estimate = pending.popleft()
+            prepared, hits, misses, plans = future.result()
+            pending_bytes -= estimate
+            prep.IMAGE_CACHE.hits += hits
+            prep.IMAGE_CACHE.misses += misses
+            for i, plan in enumerate(plans or []):
+                # a chunked item (e.g. shortcut's test batches) has one key per request
+                plan_log.add(key[i] if len(plans) > 1 else key, plan)
+            yield key, prepared
+    if plan_log is not None:
+        print(plan_log.summary())
@@ -0,0 +1,85 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+
+from image_cache import file_digest
+from image_transport import local_path
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "chronovision", "responses.sqlite")
+DATA_URL_RE = re.compile(r"^data:([^;,]+);base64,(.*)$", re.S)
+
+_file_digests = {}
+
+
+def _content_digest(path):
+    # sha256 of the file's bytes, recomputed only when its size or mtime changes
+    st = os.stat(path)
+    stat_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if stat_key not in _file_digests:
+        _file_digests[stat_key] = file_digest(path)
+    return _file_digests[stat_key]
+
+
+def _digest_images(obj):
+    # replace every image with the digest of its content: inline data, or the file a file:// / http URL points to.
+    # Keys stay small, do not depend on the per-run http port, and change when an image file is replaced
+    if isinstance(obj, dict):
+        return {k: _digest_images(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_digest_images(v) for v in obj]
+    if isinstance(obj, str):
+        match = DATA_URL_RE.match(obj)
+        if match:
+            return f"{match.group(1)};sha256={hashlib.sha256(match.group(2).encode('ascii')).hexdigest()}"
+        path = local_path(obj)
+        if path is not None and os.path.isfile(path):
+            return f"file;sha256={_content_digest(path)}"
+    return obj
+
+
+def request_key(payload):
+    # model, messages, temperature, response_format, max_tokens, ... all take part in the key
+    fields = {k: v for k, v in payload.items() if k != "stream"}
+    canonical = json.dumps(_digest_images(fields), sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, body TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT body FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, model, body):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, model, body, created) VALUES (?, ?, ?, ?)",
+            (key, model, json.dumps(body, ensure_ascii=False), time.time())
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0
+        return f"response cache: {self.hits} hits / {self.misses} misses ({rate:.1%} hit rate)"
@@ -0,0 +1,422 @@
+import os
+import re
+import csv
+import sys
+import glob
+import json
+import argparse
+
+import numpy as np
+
+IMAGES_DIR = "/hd/images"
+CHA_DIR = "/hd/Images_dynasty"
+SORT_FILE = "/hd/images/sort_ans.jsonl"
+# artifacts-localization.py writes <prefix><benchmark>_ans.jsonl
+LOCALIZATION_PREFIX = "qwen3_4B_"
+TASKS = ("shortcut", "years", "mmt", "localization", "sort")
+MIN_YEAR = 1900
+MAX_YEAR = 2025
+WITHIN_K = (1, 5, 10)
+DYNASTIES = ("Tang", "Song", "Yuan", "Ming", "Qing")
+DYNASTY_CHARS = {"唐": "Tang", "宋": "Song", "元": "Yuan", "明": "Ming", "清": "Qing"}
+# confusion-matrix column for answers that name no dynasty
+NO_ANSWER = "none"
+
+YEAR_RE = re.compile(r'(\d{4})')
+DIGIT_RE = re.compile(r'[1-9]')
+LETTER_RE = re.compile(r'^\W*([A-E])\b')
+DYNASTY_RE = re.compile(r'\b(Tang|Song|Yuan|Ming|Qing)\b|([唐宋元明清])')
+# {category}_subtask1[_cot][_{condition}]_result.json
+SHORTCUT_RE = re.compile(r'^(.+)_subtask1(_cot)?(?:_(.+))?_result\.jsonl?$')
+
+
+def load_records(path):
+    # *_result.json (a list, or {"summary": ..., "results": [...]}) or a *.jsonl checkpoint
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        data = json.load(f)
+    return data["results"] if isinstance(data, dict) else data
+
+
+def _result_files(pattern):
+    # the compacted *_result.json where a run finished, its *_result.jsonl checkpoint where it did not
+    files = {}
+    for path in sorted(glob.glob(pattern)):
+        base = path[:-1] if path.endswith(".jsonl") else path
+        if base not in files or path == base:
+            files[base] = path
+    return sorted(files.values())
+
+
+def _columns(rows, names):
+    return {name: np.asarray([row[name] for row in rows], dtype=object) for name in names}
+
+
+def _is_failed(answer):
+    # results written before failed requests were dead-lettered carry the error as the answer
+    return isinstance(answer, str) and answer.startswith(("Error", "Exception"))
+
+
+def _first_year(answer):
+    if not isinstance(answer, str):
+        return None
+    for match in YEAR_RE.findall(answer):
+        if MIN_YEAR <= int(match) <= MAX_YEAR:
+            return int(match)
+    return None
+
+
+def _dynasty(text):
+    match = DYNASTY_RE.search(text or "")
+    if not match:
+        return NO_ANSWER
+    return match.group(1) or DYNASTY_CHARS[match.group(2)]
+
+
+# ---- loaders: one columnar table per task ----
+
+def load_shortcut(images_dir=IMAGES_DIR, cot=False):
+    # the plain shortcut runs, or with cot=True those of shortcut_with_CoT.py
+    rows = []
+    for path in _result_files(os.path.join(images_dir, "*_images", "subtask1", "*_result.json*")):
+        match = SHORTCUT_RE.match(os.path.basename(path))
+        if not match or bool(match.group(2)) != cot:
+            continue
+        for r in load_records(path):
+            prediction = str(r.get("prediction", ""))
+            if _is_failed(prediction):
+                continue
+            rows.append({"category": match.group(1), "condition": match.group(3) or "color",
+                         "test_id": r.get("test_id"), "ground_truth": str(r.get("ground_truth")),
+                         "prediction": prediction, "telemetry": r.get("telemetry")})
+    cols = _columns(rows, ("category", "condition", "test_id", "ground_truth", "prediction", "telemetry"))
+    cols["correct"] = cols["prediction"] == cols["ground_truth"]
+    return cols
+
+
+def load_years(images_dir=IMAGES_DIR, truth=None):
+    # truth: {(category, image_id): year}, by default read from each folder's year_name.json
+    rows = []
+    for path in _result_files(os.path.join(images_dir, "*_images", "years", "*_years_result.json*")):
+        category = os.path.basename(path).split("_years_result")[0]
+        year_map = {}
+        year_map_path = os.path.join(os.path.dirname(path), "year_name.json")
+        if truth is None and os.path.exists(year_map_path):
+            with open(year_map_path, 'r', encoding='utf-8') as f:
+                year_map = json.load(f)
+        for r in load_records(path):
+            answer = r.get("model_answer")
+            if _is_failed(answer):
+                continue
+            image_id = r.get("image_id")
+            if truth is not None:
+                gt = truth.get((category, image_id))
+            else:
+                match = YEAR_RE.search(year_map.get(image_id) or "")
+                gt = int(match.group(1)) if match else None
+            if gt is None:
+                continue
+            pred = _first_year(answer)
+            rows.append({"category": category, "image_id": image_id, "ground_truth": gt,
+                         "prediction": -1 if pred is None else pred, "telemetry": r.get("telemetry")})
+    cols = _columns(rows, ("category", "image_id", "telemetry"))
+    cols["ground_truth"] = np.asarray([row["ground_truth"] for row in rows], dtype=np.int64)
+    cols["prediction"] = np.asarray([row["prediction"] for row in rows], dtype=np.int64)
+    cols["valid"] = cols["prediction"] >= 0
+    cols["error"] = np.abs(cols["prediction"] - cols["ground_truth"])
+    cols["correct"] = cols["valid"] & (cols["error"] == 0)
+    return cols
+
+
+def mmt_prediction(response):
+    # the first image number in the answer, not any substring match of the ground truth ("1 or 3" answers 1)
+    match = DIGIT_RE.search(str(response))
+    return match.group(0) if match else ""
+
+
+def load_mmt(images_dir=IMAGES_DIR):
+    rows = []
+    for path in _result_files(os.path.join(images_dir, "*_images", "MMT-test", "*_MMT_result.json*")):
+        category = os.path.basename(path).split("_MMT_result")[0]
+        for r in load_records(path):
+            response = str(r.get("model_response", ""))
+            if _is_failed(response):
+                continue
+            rows.append({"category": category, "test_id": r.get("test_id"),
+                         "ground_truth": str(r.get("ground_truth")), "prediction": mmt_prediction(response),
+                         "telemetry": r.get("telemetry")})
+    cols = _columns(rows, ("category", "test_id", "ground_truth", "prediction", "telemetry"))
+    cols["correct"] = cols["prediction"] == cols["ground_truth"]
+    return cols
+
+
+def load_localization(cha_dir=CHA_DIR):
+    rows = []
+    for path in sorted(glob.glob(os.path.join(cha_dir, "*_ans.jsonl"))):
+        name = os.path.basename(path)[:-len("_ans.jsonl")]
+        if name == "sort":
+            continue
+        if name.startswith(LOCALIZATION_PREFIX):
+            name = name[len(LOCALIZATION_PREFIX):]
+        for r in load_records(path):
+            response = str(r.get("model_response", ""))
+            if _is_failed(response):
+                continue
+            # "B. 明(Ming Dynasty)" or a bare "B": the letter decides through this item's shuffled options
+            letter = LETTER_RE.match(response)
+            option = (r.get("option_mapping") or {}).get(letter.group(1)) if letter else None
+            rows.append({"benchmark": name, "category": r.get("category") or "", "id": r.get("id"),
+                         "ground_truth": r.get("dynasty"), "prediction": _dynasty(option or response),
+                         "telemetry": r.get("telemetry")})
+    cols = _columns(rows, ("benchmark", "category", "id", "ground_truth", "prediction", "telemetry"))
+    cols["correct"] = cols["prediction"] == cols["ground_truth"]
+    return cols
+
+
+def _ranks(orders, k):
+    # orders: (n, k) image indices from oldest to newest -> (n, k) rank of every image
+    ranks = np.empty_like(orders)
+    np.put_along_axis(ranks, orders, np.broadcast_to(np.arange(k), orders.shape), axis=1)
+    return ranks
+
+
+def load_sort(sort_file=SORT_FILE):
+    rows = []
+    if os.path.exists(sort_file):
+        for r in load_records(sort_file):
+            answer = str(r.get("ans", ""))
+            if _is_failed(answer):
+                continue
+            gt = [int(i) for i in r.get("ground_truth") or []]
+            # "1, 2, 0, 3": the prompt asks for 0-based image indices from oldest to newest, like the ground truth;
+            # a reply that numbers the images 1..k instead is shifted down
+            pred = [int(d) for d in re.findall(r'\d+', answer)]
+            if pred and sorted(pred) == list(range(1, len(gt) + 1)):
+                pred = [i - 1 for i in pred]
+            rows.append({"category": r.get("category") or "", "id": r.get("id"), "ground_truth": gt,
+                         "prediction": pred, "telemetry": r.get("telemetry")})
+    cols = _columns(rows, ("category", "id", "telemetry"))
+    n = len(rows)
+    cols["k"] = np.asarray([len(row["ground_truth"]) for row in rows], dtype=np.int64)
+    cols["valid"] = np.asarray([sorted(row["prediction"]) == list(range(len(row["ground_truth"])))
+                                for row in rows], dtype=bool)
+    cols["correct"] = np.asarray([row["prediction"] == row["ground_truth"] for row in rows], dtype=bool)
+    cols["kendall_tau"] = np.full(n, np.nan)
+    cols["spearman"] = np.full(n, np.nan)
+    # one vectorized pass per list length over the items whose answer is a permutation
+    for k in np.unique(cols["k"][cols["valid"]]):
+        index = np.flatnonzero(cols["valid"] & (cols["k"] == k))
+        if k < 2:
+            continue
+        truth = _ranks(np.asarray([rows[i]["ground_truth"] for i in index]), k)
+        pred = _ranks(np.asarray([rows[i]["prediction"] for i in index]), k)
+        upper = np.triu(np.ones((k, k), dtype=bool), 1)
+        concordance = (np.sign(truth[:, :, None] - truth[:, None, :])
+                       * np.sign(pred[:, :, None] - pred[:, None, :]))[:, upper]
+        cols["kendall_tau"][index] = concordance.sum(axis=1) / upper.sum()
+        cols["spearman"][index] = 1 - 6 * ((truth - pred) ** 2).sum(axis=1) / (k * (k * k - 1))
+    return cols
+
+
+LOADERS = {"shortcut": load_shortcut, "years": load_years, "mmt": load_mmt,
+           "localization": load_localization, "sort": load_sort}
+
+
+# ---- vectorized metrics ----
+
+def _summaries(keys, metrics):
+    # metrics: {name: (values, mask)}; the mean of each over its mask, overall and per group of `keys`
+    keys = np.asarray(keys, dtype=str)
+    labels, inverse = np.unique(keys, return_inverse=True)
+    groups = len(labels)
+    out = {"overall": {"n": int(len(keys))}, "groups": {label: {"n": 0} for label in labels.tolist()}}
+    counts = np.bincount(inverse, minlength=groups)
+    for i, label in enumerate(labels.tolist()):
+        out["groups"][label]["n"] = int(counts[i])
+    for name, (values, mask) in metrics.items():
+        values = np.where(mask, np.asarray(values, dtype=float), 0.0)
+        mask = np.asarray(mask, dtype=float)
+        total = mask.sum()
+        out["overall"][name] = float(values.sum() / total) if total else None
+        sums = np.bincount(inverse, weights=values, minlength=groups)
+        dens = np.bincount(inverse, weights=mask, minlength=groups)
+        for i, label in enumerate(labels.tolist()):
+            out["groups"][label][name] = float(sums[i] / dens[i]) if dens[i] else None
+    return out
+
+
+def _all(cols):
+    return np.ones(len(cols["correct"]), dtype=bool)
+
+
+def unperturbed(cols):
+    # shortcut accuracy is reported on the original images; perturbed conditions only get their own breakdown
+    keep = cols["condition"] == "color"
+    return {name: values[keep] for name, values in cols.items()}
+
+
+def score_shortcut(cols):
+    color = unperturbed(cols)
+    result = _summaries(color["category"], {"accuracy": (color["correct"], _all(color))})
+    result["conditions"] = _summaries(cols["condition"], {"accuracy": (cols["correct"], _all(cols))})["groups"]
+    return result
+
+
+def score_years(cols):
+    everything = _all(cols)
+    metrics = {"accuracy": (cols["correct"], everything),
+               "mae": (cols["error"], cols["valid"]),
+               "invalid": (~cols["valid"], everything)}
+    for k in WITHIN_K:
+        metrics[f"within_{k}"] = (cols["valid"] & (cols["error"] <= k), everything)
+    return _summaries(cols["category"], metrics)
+
+
+def score_mmt(cols):
+    return _summaries(cols["category"], {"accuracy": (cols["correct"], _all(cols))})
+
+
+def confusion(truth, pred, labels=DYNASTIES):
+    # rows: true dynasty, columns: predicted dynasty plus NO_ANSWER
+    columns = list(labels) + [NO_ANSWER]
+    index = {label: i for i, label in enumerate(columns)}
+    t = np.asarray([index.get(x, -1) for x in truth], dtype=np.int64)
+    p = np.asarray([index.get(x, len(labels)) for x in pred], dtype=np.int64)
+    keep = (t >= 0) & (t < len(labels))
+    matrix = np.bincount(t[keep] * len(columns) + p[keep], minlength=len(labels) * len(columns))
+    return {"labels": list(labels), "columns": columns,
+            "matrix": matrix.reshape(len(labels), len(columns)).tolist()}
+
+
+def score_localization(cols):
+    everything = _all(cols)
+    metrics = {"accuracy": (cols["correct"], everything), "invalid": (cols["prediction"] == NO_ANSWER, everything)}
+    result = _summaries(cols["benchmark"], metrics)
+    result["dynasties"] = _summaries(cols["ground_truth"], metrics)["groups"]
+    result["confusion"] = {"overall": confusion(cols["ground_truth"], cols["prediction"])}
+    for benchmark in dict.fromkeys(cols["benchmark"].tolist()):
+        mask = cols["benchmark"] == benchmark
+        result["confusion"][benchmark] = confusion(cols["ground_truth"][mask], cols["prediction"][mask])
+    return result
+
+
+def score_sort(cols):
+    everything = _all(cols)
+    return _summaries(cols["category"], {"accuracy": (cols["correct"], everything),
+                                         "kendall_tau": (np.nan_to_num(cols["kendall_tau"]), cols["valid"]),
+                                         "spearman": (np.nan_to_num(cols["spearman"]), cols["valid"]),
+                                         "invalid": (~cols["valid"], everything)})
+
+
+SCORERS = {"shortcut": score_shortcut, "years": score_years, "mmt": score_mmt,
+           "localization": score_localization, "sort": score_sort}
+
+
+def load_task(task, images_dir=IMAGES_DIR, cha_dir=CHA_DIR, sort_file=SORT_FILE, year_truth=None):
+    if task == "years":
+        return load_years(images_dir, year_truth)
+    if task == "localization":
+        return load_localization(cha_dir)
+    if task == "sort":
+        return load_sort(sort_file)
+    if task == "cot":
+        return load_shortcut(images_dir, cot=True)
+    return LOADERS[task](images_dir)
+
+
+def score_all(tasks=TASKS, images_dir=IMAGES_DIR, cha_dir=CHA_DIR, sort_file=SORT_FILE):
+    scores = {}
+    for task in tasks:
+        cols = load_task(task, images_dir, cha_dir, sort_file)
+        if len(cols["correct"]):
+            scores[task] = SCORERS[task](cols)
+    return scores
+
+
+# ---- output ----
+
+TABLE_METRICS = {
+    "shortcut": ("accuracy",),
+    "years": ("accuracy", "mae") + tuple(f"within_{k}" for k in WITHIN_K) + ("invalid",),
+    "mmt": ("accuracy",),
+    "localization": ("accuracy", "invalid"),
+    "sort": ("accuracy", "kendall_tau", "spearman", "invalid"),
+}
+# metrics that are not rates
+PLAIN_METRICS = ("mae", "kendall_tau", "spearman")
+
+
+def _cell(name, value):
+    width = max(9, len(name))
+    if value is None:
+        return f"{'-':>{width}}"
+    return f"{value:>{width}.3f}" if name in PLAIN_METRICS else f"{value:>{width}.2%}"
+
+
+def print_scores(scores):
+    for task, result in scores.items():
+        metrics = TABLE_METRICS[task]
+        print(f"\n{task.upper()}")
+        header = f"{'group':<28} | {'n':>6} | " + " | ".join(f"{m:>{max(9, len(m))}}" for m in metrics)
+        print(header)
+        print("-" * len(header))
+        sections = [("", result["groups"])]
+        if "conditions" in result:
+            sections.append(("condition: ", result["conditions"]))
+        if "dynasties" in result:
+            sections.append(("dynasty: ", result["dynasties"]))
+        for prefix, groups in sections:
+            for group, row in groups.items():
+                print(f"{prefix + group:<28} | {row['n']:>6} | " + " | ".join(_cell(m, row.get(m)) for m in metrics))
+        row = result["overall"]
+        print("-" * len(header))
+        print(f"{'(Overall)':<28} | {row['n']:>6} | " + " | ".join(_cell(m, row.get(m)) for m in metrics))
+        if "confusion" in result:
+            cm = result["confusion"]["overall"]
+            print(f"\n  confusion (rows: truth, columns: prediction)")
+            print(f"  {'':<6}" + "".join(f"{c:>7}" for c in cm["columns"]))
+            for label, counts in zip(cm["labels"], cm["matrix"]):
+                print(f"  {label:<6}" + "".join(f"{c:>7}" for c in counts))
+
+
+def csv_rows(scores):
+    # long format: task, section, group, metric, value
+    rows = []
+    for task, result in scores.items():
+        for section in ("groups", "conditions", "dynasties"):
+            for group, metrics in result.get(section, {}).items():
+                rows += [(task, section, group, name, value) for name, value in metrics.items()]
+        rows += [(task, "overall", "", name, value) for name, value in result["overall"].items()]
+        for group, cm in result.get("confusion", {}).items():
+            for label, counts in zip(cm["labels"], cm["matrix"]):
+                rows += [(task, "confusion", group, f"{label}->{column}", count)
+                         for column, count in zip(cm["columns"], counts)]
+    return rows
+
+
+def save_scores(scores, json_path=None, csv_path=None):
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(scores, f, indent=4, ensure_ascii=False)
+    if csv_path:
+        with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(("task", "section", "group", "metric", "value"))
+            writer.writerows(csv_rows(scores))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score every ChronoVision result set.")
+    parser.add_argument("--tasks", nargs="+", choices=TASKS, default=list(TASKS))
+    parser.add_argument("--images-dir", default=IMAGES_DIR)
+    parser.add_argument("--cha-dir", default=CHA_DIR)
+    parser.add_argument("--sort-file", default=SORT_FILE)
+    parser.add_argument("--json", default=None, help="write all metrics as JSON")
+    parser.add_argument("--csv", default=None, help="write all metrics as long-format CSV")
+    args = parser.parse_args()
+
+    scores = score_all(args.tasks, args.images_dir, args.cha_dir, args.sort_file)
+    print_scores(scores)
+    save_scores(scores, args.json, args.csv)
+    sys.exit(0 if scores else 1)
@@ -0,0 +1,79 @@
+import urllib.request
+from urllib.parse import urlsplit
+
+from endpoint_pool import parse_endpoints
+
+# vLLM V1 counts prefix-cache lookups and hits in tokens; V0 only exposes a running hit rate
+PREFIX_QUERIES = ("vllm:prefix_cache_queries_total", "vllm:prefix_cache_queries")
+PREFIX_HITS = ("vllm:prefix_cache_hits_total", "vllm:prefix_cache_hits")
+PREFIX_HIT_RATE_V0 = "vllm:gpu_prefix_cache_hit_rate"
+
+
+def metrics_url(api_url):
+    parts = urlsplit(api_url)
+    return f"{parts.scheme}://{parts.netloc}/metrics"
+
+
+def parse_metrics(text):
+    # Prometheus text format, summed over label sets: {"name": value}
+    values = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name_labels, _, value = line.rpartition(" ")
+        name = name_labels.split("{", 1)[0]
+        try:
+            values[name] = values.get(name, 0.0) + float(value)
+        except ValueError:
+            continue
+    return values
+
+
+def _scrape_one(api_url, timeout):
+    try:
+        with urllib.request.urlopen(metrics_url(api_url), timeout=timeout) as response:
+            return parse_metrics(response.read().decode('utf-8'))
+    except Exception:
+        return None
+
+
+def scrape(api_url, timeout=5):
+    # api_url may be a list of endpoints (see endpoint_pool.py); their counters are summed
+    values = None
+    for url, _ in parse_endpoints(api_url):
+        one = _scrape_one(url, timeout)
+        if one is None:
+            continue
+        values = values or {}
+        for name, value in one.items():
+            values[name] = values.get(name, 0.0) + value
+    return values
+
+
+def _first(values, names):
+    for name in names:
+        if name in values:
+            return values[name]
+    return None
+
+
+def prefix_cache_delta(before, after):
+    # (hit tokens, queried tokens) between two scrapes, or None if the server does not report them
+    if not before or not after:
+        return None
+    hits = (_first(after, PREFIX_HITS), _first(before, PREFIX_HITS))
+    queries = (_first(after, PREFIX_QUERIES), _first(before, PREFIX_QUERIES))
+    if None in hits or None in queries:
+        return None
+    return hits[0] - hits[1], queries[0] - queries[1]
+
+
+def prefix_cache_report(before, after):
+    delta = prefix_cache_delta(before, after)
+    if delta is not None:
+        hits, queries = delta
+        rate = hits / queries * 100 if queries else 0.0
+        return f"prefix cache: {rate:.1f}% of prompt tokens reused ({int(hits)} / {int(queries)})"
+    if after and PREFIX_HIT_RATE_V0 in after:
+        return f"prefix cache: {after[PREFIX_HIT_RATE_V0] * 100:.1f}% hit rate (server lifetime)"
+    return None
@@ -0,0 +1,268 @@
+import sys
+import json
+import time
+import argparse
+import itertools
+
+import numpy as np
+
+from scoring import load_task, unperturbed, TASKS, IMAGES_DIR, CHA_DIR, SORT_FILE
+
+RESAMPLES = 10000
+PERMUTATIONS = 10000
+ALPHA = 0.05
+# bootstrap resamples / permutations materialized at once: CHUNK x items weights and
+# CHUNK x CHUNK binomial draws stay a few tens of MB
+CHUNK = 1000
+SEED = 0
+# columns that identify one test item across models
+ITEM_KEYS = {
+    "shortcut": ("category", "condition", "test_id"),
+    "years": ("category", "image_id"),
+    "mmt": ("category", "test_id"),
+    "localization": ("benchmark", "id"),
+    "sort": ("id",),
+}
+
+
+def item_keys(task, cols):
+    parts = [cols[name].astype(str) for name in ITEM_KEYS[task]]
+    keys = parts[0]
+    for part in parts[1:]:
+        keys = np.char.add(np.char.add(keys, "/"), part)
+    return keys
+
+
+def correctness_matrix(models, task):
+    # (items, models) 0/1 matrix over the items every model answered, with their keys
+    per_model = []
+    for name, dirs in models.items():
+        cols = load_task(task, dirs.get("images_dir", IMAGES_DIR), dirs.get("cha_dir", CHA_DIR),
+                         dirs.get("sort_file", SORT_FILE))
+        if task == "shortcut":
+            cols = unperturbed(cols)
+        # a rerun item appears once per attempt, the last one wins
+        keys, last = np.unique(item_keys(task, cols)[::-1], return_index=True)
+        per_model.append((keys, cols["correct"][::-1][last].astype(np.float32)))
+    shared = per_model[0][0]
+    for keys, _ in per_model[1:]:
+        shared = np.intersect1d(shared, keys)
+    matrix = np.empty((len(shared), len(per_model)), dtype=np.float32)
+    for j, (keys, correct) in enumerate(per_model):
+        matrix[:, j] = correct[np.searchsorted(keys, shared)]
+    return shared, matrix
+
+
+def resample_weights(n, resamples, rng, chunk=CHUNK):
+    # bootstrap resamples as (chunk, n) multiplicity matrices: row b counts how often item i was drawn
+    for start in range(0, resamples, chunk):
+        rows = min(chunk, resamples - start)
+        index = rng.integers(0, n, size=(rows, n))
+        flat = (index + (np.arange(rows) * n)[:, None]).ravel()
+        yield np.bincount(flat, minlength=rows * n).reshape(rows, n).astype(np.float32)
+
+
+def bootstrap_means(matrix, resamples=RESAMPLES, rng=None, chunk=CHUNK):
+    # (resamples, models) means; every model sees the same resamples, so differences are paired
+    rng = rng or np.random.default_rng(SEED)
+    n = len(matrix)
+    if n == 0:
+        return np.full((resamples, matrix.shape[1]), np.nan)
+    return np.vstack([weights @ matrix / n for weights in resample_weights(n, resamples, rng, chunk)])
+
+
+def interval(samples, alpha=ALPHA):
+    # tasks without shared items never get here, so plain percentile (one partition for all columns) is safe
+    low, high = np.percentile(samples, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return low, high
+
+
+def mcnemar_p(only_a, only_b):
+    # exact two-sided McNemar: a binomial test on the discordant pairs
+    n = int(only_a + only_b)
+    if n == 0:
+        return 1.0
+    i = np.arange(1, int(min(only_a, only_b)) + 1)
+    log_comb = np.concatenate([[0.0], np.cumsum(np.log(n - i + 1) - np.log(i))])
+    tail = np.exp(log_comb - n * np.log(2)).sum()
+    return float(min(1.0, 2 * tail))
+
+
+def mcnemar(a, b):
+    only_a = int(np.sum((a == 1) & (b == 0)))
+    only_b = int(np.sum((a == 0) & (b == 1)))
+    return {"only_a": only_a, "only_b": only_b, "p": mcnemar_p(only_a, only_b)}
+
+
+def permutation_test(counts, magnitudes, observed, permutations=PERMUTATIONS, rng=None, chunk=CHUNK):
+    # two-sided paired permutation tests, one per row of `counts`: each item's two outcomes are swapped at random.
+    # Items with the same |diff| are exchangeable, so how many of them end up positive is Binomial(count, 1/2);
+    # counts[k, g] items of magnitude magnitudes[g] replace a permutations x items sign matrix per test
+    # draws are made CHUNK permutations x rows x groups at a time (a few MB), exceedances are summed over chunks
+    rng = rng or np.random.default_rng(SEED + 1)
+    counts = np.atleast_2d(counts)
+    magnitudes = np.asarray(magnitudes, dtype=np.float64)
+    observed = np.abs(np.atleast_1d(observed)) * (1 - 1e-9)
+    extreme = np.zeros(len(counts), dtype=np.int64)
+    rows = max(1, chunk // max(1, counts.shape[1]))
+    for start in range(0, len(counts), rows):
+        block = counts[start:start + rows]
+        for done in range(0, permutations, chunk):
+            positive = rng.binomial(block, 0.5, size=(min(chunk, permutations - done),) + block.shape)
+            stats = (2 * positive - block) @ magnitudes
+            extreme[start:start + rows] += np.sum(np.abs(stats) >= observed[start:start + rows], axis=0)
+    return (extreme + 1) / (permutations + 1)
+
+
+def permutation_p(diffs, permutations=PERMUTATIONS, rng=None):
+    diffs = np.asarray(diffs, dtype=np.float64)
+    magnitudes, counts = np.unique(np.abs(diffs[diffs != 0]), return_counts=True)
+    if not len(counts):
+        return 1.0
+    return float(permutation_test(counts, magnitudes, diffs.sum(), permutations, rng)[0])
+
+
+def analyze(models, tasks=TASKS, resamples=RESAMPLES, permutations=PERMUTATIONS, alpha=ALPHA, pairs="adjacent",
+            seed=SEED):
+    names = list(models)
+    rng = np.random.default_rng(seed)
+    flip_rng = np.random.default_rng(seed + 1)
+    report = {"models": names, "resamples": resamples, "permutations": permutations, "alpha": alpha,
+              "tasks": {}, "overall": {}, "comparisons": []}
+    matrices, samples = {}, {}
+    for task in tasks:
+        keys, matrix = correctness_matrix(models, task)
+        if not len(keys):
+            continue
+        matrices[task] = matrix
+        samples[task] = bootstrap_means(matrix, resamples, rng)
+        low, high = interval(samples[task], alpha)
+        report["tasks"][task] = {"items": int(len(keys)), "scores": {
+            name: {"accuracy": float(matrix[:, j].mean()), "low": float(low[j]), "high": float(high[j])}
+            for j, name in enumerate(names)}}
+    if not matrices:
+        return report
+
+    # overall: the unweighted mean of the task accuracies, resampled within each task
+    overall_samples = np.mean([samples[task] for task in matrices], axis=0)
+    point = np.mean([matrices[task].mean(axis=0) for task in matrices], axis=0)
+    low, high = interval(overall_samples, alpha)
+    report["overall"] = {name: {"accuracy": float(point[j]), "low": float(low[j]), "high": float(high[j])}
+                         for j, name in enumerate(names)}
+
+    ranked = sorted(range(len(names)), key=lambda j: -point[j])
+    if pairs == "all":
+        compared = list(itertools.combinations(ranked, 2))
+    else:
+        compared = list(zip(ranked, ranked[1:]))
+    if not compared:
+        return report
+    a, b = np.array(compared).T
+
+    # every pair at once: (resamples, pairs) differences, (pairs,) discordant counts per task
+    diff_low, diff_high = interval(overall_samples[:, a] - overall_samples[:, b], alpha)
+    per_task = {}
+    for task, matrix in matrices.items():
+        task_low, task_high = interval(samples[task][:, a] - samples[task][:, b], alpha)
+        only_a = ((matrix[:, a] == 1) & (matrix[:, b] == 0)).sum(axis=0)
+        only_b = ((matrix[:, a] == 0) & (matrix[:, b] == 1)).sum(axis=0)
+        # within one task every discordant item has the same |diff|, so the exact permutation
+        # distribution is the McNemar binomial; only the pooled test below needs sampling
+        per_task[task] = {"low": task_low, "high": task_high, "only_a": only_a, "only_b": only_b}
+    # overall: a sum over pooled items whose weight 1 / (items * tasks) turns it into the difference of
+    # task-averaged accuracies, so each task contributes one magnitude
+    weights = np.array([1 / (len(matrices[task]) * len(matrices)) for task in matrices])
+    only_a = np.stack([per_task[task]["only_a"] for task in matrices], axis=1)
+    only_b = np.stack([per_task[task]["only_b"] for task in matrices], axis=1)
+    overall_p = permutation_test(only_a + only_b, weights, (only_a - only_b) @ weights, permutations, flip_rng)
+
+    for k, (j, i) in enumerate(compared):
+        pooled_a, pooled_b = int(only_a[k].sum()), int(only_b[k].sum())
+        comparison = {
+            "a": names[j], "b": names[i], "difference": float(point[j] - point[i]),
+            "low": float(diff_low[k]), "high": float(diff_high[k]),
+            "permutation_p": float(overall_p[k]),
+            "mcnemar": {"only_a": pooled_a, "only_b": pooled_b, "p": mcnemar_p(pooled_a, pooled_b)},
+            "tasks": {},
+        }
+        for task, matrix in matrices.items():
+            stats = per_task[task]
+            comparison["tasks"][task] = {
+                "difference": float(matrix[:, j].mean() - matrix[:, i].mean()),
+                "low": float(stats["low"][k]), "high": float(stats["high"][k]),
+                "mcnemar_p": mcnemar_p(stats["only_a"][k], stats["only_b"][k]),
+            }
+        report["comparisons"].append(comparison)
+    return report
+
+
+def _ci(score):
+    return f"{100 * score['accuracy']:6.2f} [{100 * score['low']:6.2f}, {100 * score['high']:6.2f}]"
+
+
+def print_report(report):
+    level = f"{1 - report['alpha']:.0%}"
+    tasks = list(report["tasks"])
+    if not tasks:
+        print("no items shared by all models")
+        return
+    print(f"\naccuracy with {level} bootstrap intervals ({report['resamples']} resamples, items shared by all models)")
+    header = f"{'model':<32} | " + " | ".join(f"{t + ' (' + str(report['tasks'][t]['items']) + ')':^24}"
+                                              for t in tasks) + f" | {'overall':^24}"
+    print(header)
+    print("-" * len(header))
+    for name in sorted(report["overall"], key=lambda n: -report["overall"][n]["accuracy"]):
+        cells = " | ".join(_ci(report["tasks"][t]["scores"][name]) for t in tasks)
+        print(f"{name:<32} | {cells} | {_ci(report['overall'][name])}")
+
+    if report["comparisons"]:
+        print(f"\npaired comparisons (overall, {level} interval of the difference)")
+        header = (f"{'a':<24} {'b':<24} | {'diff':>7} | {'interval':^18} | {'perm p':>8} | {'McNemar p':>9} | "
+                  f"{'a only':>6} | {'b only':>6}")
+        print(header)
+        print("-" * len(header))
+        for c in report["comparisons"]:
+            m = c["mcnemar"]
+            print(f"{c['a']:<24} {c['b']:<24} | {100 * c['difference']:>+7.2f} | "
+                  f"[{100 * c['low']:>+7.2f}, {100 * c['high']:>+7.2f}] | {c['permutation_p']:>8.4f} | "
+                  f"{m['p']:>9.4f} | {m['only_a']:>6} | {m['only_b']:>6}")
+
+
+def _load_models(args):
+    models = {}
+    if args.models:
+        with open(args.models, 'r', encoding='utf-8') as f:
+            models.update(json.load(f))
+    for name, images_dir, cha_dir, sort_file in args.model or []:
+        models[name] = {"images_dir": images_dir, "cha_dir": cha_dir, "sort_file": sort_file}
+    return models
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstrap intervals and paired significance tests between models.")
+    parser.add_argument("--models", default=None,
+                        help='JSON file: {"model": {"images_dir": ..., "cha_dir": ..., "sort_file": ...}, ...}')
+    parser.add_argument("--model", nargs=4, action="append", metavar=("NAME", "IMAGES_DIR", "CHA_DIR", "SORT_FILE"),
+                        help="one model's result locations; repeat for more")
+    parser.add_argument("--tasks", nargs="+", choices=TASKS, default=list(TASKS))
+    parser.add_argument("--resamples", type=int, default=RESAMPLES)
+    parser.add_argument("--permutations", type=int, default=PERMUTATIONS)
+    parser.add_argument("--alpha", type=float, default=ALPHA)
+    parser.add_argument("--all-pairs", action="store_true", help="compare every pair, not only leaderboard neighbours")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--json", default=None, help="write the full report as JSON")
+    args = parser.parse_args()
+
+    models = _load_models(args)
+    if not models:
+        parser.error("no models given, use --models or --model")
+    start = time.perf_counter()
+    report = analyze(models, args.tasks, args.resamples, args.permutations, args.alpha,
+                     "all" if args.all_pairs else "adjacent", args.seed)
+    print_report(report)
+    print(f"\n{len(models)} models, {sum(t['items'] for t in report['tasks'].values())} shared items "
+          f"in {time.perf_counter() - start:.1f} s")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+    sys.exit(0 if report["tasks"] else 1)
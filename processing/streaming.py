@@ -0,0 +1,155 @@
+import json
+
+# default cap on streamed completion tokens spent before the answer; None = only max_tokens applies
+REASONING_BUDGET = None
+STREAM_OPTIONS = {"include_usage": True, "continuous_usage_stats": True}
+
+
+class JsonScanner:
+    # incremental scan of a JSON object as it streams in: tracks nesting, the current top-level key,
+    # completed top-level values, and enough state to close a cut-off document
+    def __init__(self):
+        self.text = []
+        self.length = 0
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.string_is_key = False
+        self.string_start = 0
+        self.primitive_start = None
+        self.expect_key = False
+        self.expect_value = True
+        self.awaiting_colon = False
+        self.key = None
+        self.current = []
+        self.values = {}
+
+    def _value_done(self, value_text):
+        # a value just ended; top-level ones are kept so an answer can be picked up before the object closes
+        if len(self.stack) == 1 and self.key is not None:
+            try:
+                self.values[self.key] = json.loads(value_text)
+            except ValueError:
+                pass
+        self.expect_value = False
+
+    def feed(self, chunk):
+        for ch in chunk:
+            pos = self.length
+            self.length += 1
+            self.text.append(ch)
+            if self.in_string:
+                self.current.append(ch)
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    raw = "".join(self.current)
+                    self.current = []
+                    if self.string_is_key:
+                        try:
+                            self.key = json.loads(raw)
+                        except ValueError:
+                            self.key = None
+                        self.expect_key = False
+                        self.awaiting_colon = True
+                    else:
+                        self._value_done(raw)
+                continue
+
+            if self.primitive_start is not None:
+                if ch in ",}] \t\r\n":
+                    self._value_done("".join(self.text[self.primitive_start:pos]))
+                    self.primitive_start = None
+                else:
+                    continue
+
+            if ch == '"':
+                self.in_string = True
+                self.string_start = pos
+                self.string_is_key = bool(self.stack) and self.stack[-1] == "{" and self.expect_key
+                self.current = ['"']
+            elif ch in "{[":
+                self.stack.append(ch)
+                self.expect_key = ch == "{"
+                self.expect_value = ch == "["
+            elif ch in "}]":
+                if self.stack:
+                    self.stack.pop()
+                self.expect_key = False
+                self.expect_value = False
+            elif ch == ":":
+                self.expect_value = True
+                self.awaiting_colon = False
+            elif ch == ",":
+                top = self.stack[-1] if self.stack else None
+                self.expect_key = top == "{"
+                self.expect_value = top == "["
+            elif not ch.isspace() and self.stack:
+                self.primitive_start = pos
+
+    @property
+    def complete(self):
+        return self.length > 0 and not self.stack and not self.in_string
+
+    def closed_text(self):
+        # the text so far turned into a parseable document: an open string is closed, a half-written key or
+        # number is dropped, then every open container is closed; partial reasoning survives as far as it got
+        text = "".join(self.text)
+        if self.in_string or self.awaiting_colon:
+            if self.string_is_key:
+                text = text[:self.string_start]
+            else:
+                # a cut can land inside an escape sequence (\" or \uXXXX), drop it
+                for cut in range(min(6, len(text) - self.string_start - 1) + 1):
+                    candidate = text[:len(text) - cut] + '"'
+                    try:
+                        json.loads(candidate[self.string_start:])
+                    except ValueError:
+                        continue
+                    text = candidate
+                    break
+        elif self.primitive_start is not None:
+            text = text[:self.primitive_start] + "null"
+        text = text.rstrip()
+        if text.endswith(":"):
+            text += " null"
+        text = text.rstrip(", \t\r\n")
+        closers = "".join("}" if c == "{" else "]" for c in reversed(self.stack))
+        return text + closers
+
+
+class EarlyStop:
+    # watches one streamed JSON answer; stop() turns True once `answer_key` is complete or the budget is spent
+    def __init__(self, answer_key="answer", reasoning_budget=REASONING_BUDGET):
+        self.answer_key = answer_key
+        self.reasoning_budget = reasoning_budget
+        self.scanner = JsonScanner()
+        self.tokens = 0
+        self.reason = None
+
+    def spec(self):
+        # part of the response-cache key, so changing the budget does not replay older cut-offs
+        return {"answer_key": self.answer_key, "reasoning_budget": self.reasoning_budget}
+
+    def feed(self, delta, completion_tokens=None):
+        self.scanner.feed(delta)
+        # with continuous usage stats the server reports the running count; otherwise one chunk ~ one token
+        self.tokens = completion_tokens if completion_tokens is not None else self.tokens + 1
+        if self.answer_key in self.scanner.values:
+            self.reason = "answer"
+        elif self.reasoning_budget is not None and self.tokens >= self.reasoning_budget:
+            self.reason = "budget"
+        return self.reason is not None
+
+    def result(self, finish_reason):
+        # content to hand to the runner plus what happened to the stream
+        answered = self.answer_key in self.scanner.values
+        if self.scanner.complete:
+            content = "".join(self.scanner.text)
+        else:
+            content = self.scanner.closed_text()
+        truncated = not answered and (self.reason == "budget" or finish_reason == "length")
+        return content, {"reason": self.reason or finish_reason, "truncated": truncated, "tokens": self.tokens}
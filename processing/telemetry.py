@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+from image_transport import image_dimensions
+
+# Qwen-VL: 14 px patches merged 2x2, so one vision token per 28x28 pixels, plus the vision start/end markers
+VISION_PATCH = 28
+VISION_EXTRA_TOKENS = 2
+PERCENTILES = (50, 95, 99)
+SLOWEST = 5
+TELEMETRY_SUFFIX = "_telemetry.json"
+
+
+def vision_tokens(width, height):
+    return max(1, round(height / VISION_PATCH)) * max(1, round(width / VISION_PATCH)) + VISION_EXTRA_TOKENS
+
+
+def payload_images(payload):
+    # image count and estimated vision tokens of one chat request
+    images, tokens = 0, 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            continue
+        for part in content or []:
+            if part.get("type") != "image_url":
+                continue
+            images += 1
+            size = image_dimensions(part["image_url"]["url"])
+            if size is not None:
+                tokens += vision_tokens(*size)
+    return {"images": images, "vision_tokens_est": tokens}
+
+
+def telemetry_path(prefix):
+    return f"{prefix}{TELEMETRY_SUFFIX}"
+
+
+def _percentiles(values):
+    values = np.asarray([v for v in values if v is not None], dtype=float)
+    if not len(values):
+        return {f"p{p}": None for p in PERCENTILES}
+    return {f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+class RunTelemetry:
+    # collects the "telemetry" block of every result of one dispatch (one task and category)
+    def __init__(self, label):
+        self.label = label
+        self.items = []
+        self.failed = 0
+        self.start = time.perf_counter()
+
+    def add(self, job_id, result, failed=False):
+        if failed:
+            self.failed += 1
+        telemetry = result.get("telemetry")
+        if telemetry is not None:
+            self.items.append((job_id, telemetry, failed))
+
+    def summary(self):
+        wall = time.perf_counter() - self.start
+        # cached replays and failures would skew the latency picture, they are only counted
+        live = [(job_id, t) for job_id, t, failed in self.items if not failed and not t.get("cached")]
+        usage = [t.get("usage") or {} for _, t in live]
+        prompt_tokens = sum(u.get("prompt_tokens") or 0 for u in usage)
+        completion_tokens = sum(u.get("completion_tokens") or 0 for u in usage)
+        slowest = sorted(live, key=lambda item: item[1]["total"], reverse=True)[:SLOWEST]
+        return {
+            "label": self.label,
+            "wall_s": wall,
+            "requests": len(live),
+            "cached": sum(1 for _, t, _ in self.items if t.get("cached")),
+            "failed": self.failed,
+            "req_per_s": len(live) / wall if wall else 0.0,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "completion_tokens_per_s": completion_tokens / wall if wall else 0.0,
+            "prompt_tokens_per_s": prompt_tokens / wall if wall else 0.0,
+            "payload_mb": sum(t["payload_bytes"] for _, t in live) / 1024 ** 2,
+            "vision_tokens_est": sum(t.get("vision_tokens_est", 0) for _, t in live),
+            "latency": {span: _percentiles([t.get(span) for _, t in live])
+                        for span in ("prep", "serialize", "ttft", "total")},
+            "slowest": [{"id": job_id, "total": t["total"], "attempts": t.get("attempts"),
+                         "completion_tokens": (t.get("usage") or {}).get("completion_tokens")}
+                        for job_id, t in slowest],
+        }
+
+    def save(self, path, summary):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def _ms(value):
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+
+def _item_name(job_id):
+    return "/".join(str(part) for part in job_id) if isinstance(job_id, (tuple, list)) else str(job_id)
+
+
+def format_summary(summary):
+    lines = [f"run summary [{summary['label']}]: {summary['requests']} requests in {summary['wall_s']:.1f} s "
+             f"({summary['req_per_s']:.1f} req/s), {summary['cached']} cached, {summary['failed']} failed"]
+    if summary["requests"]:
+        lines.append(f"  tokens: {summary['prompt_tokens']} prompt ({summary['prompt_tokens_per_s']:.0f}/s, "
+                     f"~{summary['vision_tokens_est']} vision), {summary['completion_tokens']} completion "
+                     f"({summary['completion_tokens_per_s']:.0f}/s); payloads {summary['payload_mb']:.1f} MB")
+        for span, p in summary["latency"].items():
+            lines.append(f"  {span:<9} ms  " + "  ".join(f"p{q} {_ms(p[f'p{q}'])}" for q in PERCENTILES))
+        slowest = ", ".join(f"{_item_name(item['id'])} ({item['total']:.1f} s)" for item in summary["slowest"])
+        lines.append(f"  slowest: {slowest}")
+    return "\n".join(lines)
+
+
+def collect(root):
+    # every saved run summary under root, one per task and category
+    summaries = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in sorted(filenames):
+            if name.endswith(TELEMETRY_SUFFIX):
+                with open(os.path.join(dirpath, name), 'r', encoding='utf-8') as f:
+                    summaries.append(json.load(f))
+    return summaries
+
+
+def print_table(summaries):
+    print(f"{'task / category':<32} | {'reqs':>6} | {'req/s':>7} | {'tok/s':>7} | {'p50 ms':>7} | {'p95 ms':>7} | {'p99 ms':>7}")
+    print("-" * 90)
+    for s in sorted(summaries, key=lambda s: s["label"]):
+        total = s["latency"]["total"]
+        print(f"{s['label']:<32} | {s['requests']:>6} | {s['req_per_s']:>7.1f} | {s['completion_tokens_per_s']:>7.0f} | "
+              f"{_ms(total['p50']):>7} | {_ms(total['p95']):>7} | {_ms(total['p99']):>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tabulate the run summaries saved next to each task's outputs.")
+    parser.add_argument("root", nargs="?", default="/hd/images")
+    args = parser.parse_args()
+    summaries = collect(args.root)
+    if not summaries:
+        print(f"no {TELEMETRY_SUFFIX} files under {args.root}")
+        sys.exit(1)
+    print_table(summaries)
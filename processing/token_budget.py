@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+from PIL import Image
+
+from encode_image import DEFAULT_MAX_PIXELS, GRID, target_size
+from telemetry import vision_tokens, VISION_EXTRA_TOKENS
+
+# vision tokens one request may spend on all of its images together; None keeps the per-image cap only
+TOKEN_BUDGET = None
+# "area" scales every image by the same factor, "equal" gives each image the same share,
+# "aspect" gives elongated images more so their short side stays legible,
+# "content" gives images that compress worse (more detail per pixel) more
+WEIGHTING = "aspect"
+# below this a 28 px grid is too coarse to show anything, e.g. 4x4 patches
+MIN_IMAGE_TOKENS = 16
+PLAN_LOG = os.path.join(os.path.expanduser("~"), ".cache", "chronovision", "token_plans.jsonl")
+
+
+def _weight(width, height, file_size, weighting):
+    if weighting == "equal":
+        return 1.0
+    if weighting == "area":
+        return float(width * height)
+    if weighting == "aspect":
+        return (max(width, height) / max(1, min(width, height))) ** 0.5
+    if weighting == "content":
+        # compressed bytes per pixel as a cheap proxy for detail
+        return max(file_size, 1) / max(1, width * height)
+    raise ValueError(f"unknown weighting: {weighting}")
+
+
+def allocate(needs, weights, budget):
+    # water-filling: each image gets its weighted share of the budget, never more than it needs at full size;
+    # what the small ones leave over goes back to the others
+    alloc = [0] * len(needs)
+    open_set = [i for i, need in enumerate(needs) if need > 0]
+    remaining = budget
+    while open_set and remaining > 0:
+        total_weight = sum(weights[i] for i in open_set) or 1.0
+        shares = {i: remaining * weights[i] / total_weight for i in open_set}
+        capped = [i for i in open_set if needs[i] <= shares[i]]
+        if not capped:
+            for i in open_set:
+                alloc[i] = max(MIN_IMAGE_TOKENS, int(shares[i]))
+            break
+        for i in capped:
+            alloc[i] = needs[i]
+            remaining -= needs[i]
+        open_set = [i for i in open_set if i not in capped]
+    return alloc
+
+
+def max_pixels_for(width, height, tokens):
+    # the largest pixel cap whose grid-aligned resize stays within `tokens` patches
+    max_pixels = tokens * GRID * GRID
+    while max_pixels > GRID * GRID:
+        w, h = target_size(width, height, max_pixels)
+        if (w // GRID) * (h // GRID) <= tokens:
+            return max_pixels
+        max_pixels = int(max_pixels * 0.95)
+    return GRID * GRID
+
+
+def plan_request(paths, budget=TOKEN_BUDGET, weighting=WEIGHTING, max_pixels=DEFAULT_MAX_PIXELS):
+    # one entry per path: {"path", "size", "native_tokens", "planned_tokens", "target", "max_pixels"}
+    images = []
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                width, height = img.size
+            file_size = os.path.getsize(path)
+        except Exception:
+            images.append(None)
+            continue
+        target = target_size(width, height, max_pixels)
+        images.append({"path": path, "size": [width, height], "file_size": file_size,
+                       "native_tokens": vision_tokens(*target), "target": list(target), "max_pixels": max_pixels})
+
+    valid = [image for image in images if image is not None]
+    native_total = sum(image["native_tokens"] for image in valid)
+    if budget is not None and native_total > budget:
+        needs = [image["native_tokens"] - VISION_EXTRA_TOKENS for image in valid]
+        weights = [_weight(*image["size"], image["file_size"], weighting) for image in valid]
+        alloc = allocate(needs, weights, budget - VISION_EXTRA_TOKENS * len(valid))
+        for image, tokens in zip(valid, alloc):
+            if tokens < image["native_tokens"] - VISION_EXTRA_TOKENS:
+                image["max_pixels"] = max_pixels_for(*image["size"], tokens)
+                image["target"] = list(target_size(*image["size"], image["max_pixels"]))
+    for image in valid:
+        image["planned_tokens"] = vision_tokens(*image["target"])
+        del image["file_size"]
+    return images
+
+
+def plan_entries(paths, plan):
+    # prefetch entries with the planned per-image cap: (path, transform, max_pixels)
+    entries = []
+    for entry, image in zip(paths, plan):
+        path, transform = (entry[0], entry[1]) if isinstance(entry, (tuple, list)) else (entry, None)
+        entries.append((path, transform, image["max_pixels"]) if image else (path, transform))
+    return entries
+
+
+def budget_entries(entries, budget=TOKEN_BUDGET, weighting=WEIGHTING, max_pixels=DEFAULT_MAX_PIXELS, group=None):
+    # plans every consecutive `group` entries as one request (all of them by default);
+    # returns the entries with per-image caps and one plan per request
+    group = group or len(entries) or 1
+    planned, plans = [], []
+    for start in range(0, len(entries), group):
+        chunk = entries[start:start + group]
+        paths = [entry[0] if isinstance(entry, (tuple, list)) else entry for entry in chunk]
+        plan = plan_request(paths, budget, weighting, max_pixels)
+        planned.extend(plan_entries(chunk, plan))
+        plans.append(plan)
+    return planned, plans
+
+
+class PlanLog:
+    # appends one line per planned request and keeps run totals for the end-of-run line
+    def __init__(self, budget, weighting, path=PLAN_LOG):
+        self.budget = budget
+        self.weighting = weighting
+        self.path = path
+        self.requests = 0
+        self.resized = 0
+        self.native = 0
+        self.planned = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def add(self, key, plan):
+        valid = [image for image in plan if image]
+        native = sum(image["native_tokens"] for image in valid)
+        planned = sum(image["planned_tokens"] for image in valid)
+        self.requests += 1
+        self.resized += planned < native
+        self.native += native
+        self.planned += planned
+        if not self.path:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"time": time.time(), "key": key, "budget": self.budget, "weighting": self.weighting,
+                                "native_tokens": native, "planned_tokens": planned, "images": plan},
+                               ensure_ascii=False, default=str) + '\n')
+
+    def summary(self):
+        if not self.requests:
+            return "token budget: no requests planned"
+        saved = 1 - self.planned / self.native if self.native else 0.0
+        return (f"token budget {self.budget} ({self.weighting}): {self.resized}/{self.requests} requests downsized, "
+                f"{self.planned} of {self.native} vision tokens ({saved:.1%} saved), "
+                f"{self.planned / self.requests:.0f} per request")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show how a per-request vision-token budget splits over images.")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--budget", type=int, required=True)
+    parser.add_argument("--weighting", choices=("area", "equal", "aspect", "content"), default=WEIGHTING)
+    parser.add_argument("--max-pixels", type=int, default=DEFAULT_MAX_PIXELS)
+    args = parser.parse_args()
+
+    plan = plan_request(args.images, args.budget, args.weighting, args.max_pixels)
+    for path, image in zip(args.images, plan):
+        if image is None:
+            print(f"{path}: unreadable")
+            continue
+        print(f"{path}: {image['size'][0]}x{image['size'][1]} -> {image['target'][0]}x{image['target'][1]}, "
+              f"{image['native_tokens']} -> {image['planned_tokens']} tokens")
+    valid = [image for image in plan if image]
+    print(f"total: {sum(i['native_tokens'] for i in valid)} -> {sum(i['planned_tokens'] for i in valid)} "
+          f"tokens (budget {args.budget})")
+    sys.exit(0 if valid else 1)
@@ -0,0 +1,33 @@
+import os
+import sys
+import socket
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "processing"))
+
+import async_client
+from async_client import run_requests, failure_reason
+
+
+def _dead_url():
+    # a port nothing listens on once the socket is closed
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/v1/chat/completions"
+
+
+def test_all_endpoints_down_fails_instead_of_hanging(monkeypatch):
+    monkeypatch.setattr(async_client, "RETRY_BASE", 0.01)
+    jobs = [(f"job{i}", {"model": "m", "messages": [{"role": "user", "content": "hi"}]}) for i in range(4)]
+    results = []
+    runner = threading.Thread(target=lambda: results.extend(
+        run_requests(jobs, [_dead_url(), _dead_url()], concurrency=2, timeout=5, adaptive=False, max_attempts=3)))
+    runner.daemon = True
+    runner.start()
+    runner.join(30)
+    assert not runner.is_alive(), "run_requests hung with every endpoint down"
+    assert [job_id for job_id, _ in results] == [job_id for job_id, _ in jobs]
+    for _, result in results:
+        assert result["attempts"] == 3
+        assert failure_reason(result) is not None
@@ -0,0 +1,30 @@
+import os
+import re
+import sys
+import json
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "processing"))
+
+import guided
+
+SORT_SPEC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "test & ans", "artifacts", "sort", "sort_test_with_ans.jsonl")
+
+
+def _pattern(n):
+    return guided.order_schema(n)["properties"]["ans"]["pattern"]
+
+
+def test_order_schema_accepts_ground_truth():
+    with open(SORT_SPEC, 'r', encoding='utf-8') as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    for item in items:
+        truth = item["ground_truth"]
+        answer = ", ".join(str(i) for i in truth)
+        assert re.fullmatch(_pattern(len(truth)), answer), (item["id"], answer)
+
+
+def test_order_schema_rejects_out_of_range_index():
+    assert re.fullmatch(_pattern(4), "0, 2, 1, 3")
+    assert not re.fullmatch(_pattern(4), "1, 2, 3, 4")
+    assert not re.fullmatch(_pattern(4), "0, 2, 1")